@@ -1,4 +1,4 @@
 # SPDX-License-Identifier: MIT
 # SPDX-FileCopyrightText: Copyright 2024 Ics inc.
 
-__all__ = ["common", "cve_match", "cve_fetch", "sbom_import"]
+__all__ = ["common", "cve_match", "cve_fetch", "sbom_import", "benchmarks"]
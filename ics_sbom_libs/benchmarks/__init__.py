@@ -0,0 +1,4 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2024 Ics inc.
+
+__all__ = ["harness", "synthetic_nvd", "nvd_stand_in", "match_benchmark", "ingest_benchmark"]
@@ -0,0 +1,134 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Helpers shared by the benchmarks: running a case in a process of its own, measuring it, describing the machine and
+comparing results with those of an earlier run.
+"""
+
+import multiprocessing
+import os
+import platform
+import sqlite3
+import sys
+
+from collections.abc import Callable
+
+__all__ = ["run_isolated", "peak_rss_kb", "io_counters", "environment", "compare_results"]
+
+
+def _send_result(connection, func, args):
+    try:
+        result = func(*args)
+    except Exception as e:
+        result = e
+    connection.send(result)
+    connection.close()
+
+
+def run_isolated(func, *args):
+    """
+    Runs func(*args) in a new process and returns its result. The process is not daemonic, so func can start its
+    own worker processes.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_send_result, args=(sender, func, args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = RuntimeError(f"The benchmark process exited with code {process.exitcode}")
+    finally:
+        process.join()
+
+    if isinstance(result, BaseException):
+        raise result
+
+    return result
+
+
+def peak_rss_kb(children: bool = False) -> int | None:
+    """
+    The peak resident memory of this process, or of the largest of its finished child processes. None where the
+    resource module is missing.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux reports kilobytes, macOS bytes.
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def io_counters() -> dict[str, int] | None:
+    """
+    The I/O counters of this process from /proc/self/io (read_bytes, write_bytes, syscw, ...), None where there is
+    no such file.
+    """
+    try:
+        with open("/proc/self/io") as fp:
+            return {key: int(value) for key, value in (line.split(":") for line in fp if ":" in line)}
+    except OSError:
+        return None
+
+
+def environment() -> dict:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        package_version = version("ics_sbom_libs")
+    except PackageNotFoundError:
+        package_version = None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "ics_sbom_libs": package_version,
+    }
+
+
+def compare_results(
+    baseline: dict,
+    current: dict,
+    key_fields: list[str],
+    compared_fields: list[str],
+    tolerance: float = 0.2,
+    describe: Callable[[dict], str] | None = None,
+) -> list[str]:
+    """
+    Returns a description of every result of current that is worse than the result of baseline with the same
+    key_fields by more than the tolerance, a fraction of the baseline value.
+
+    :param compared_fields: Fields of the results where lower is better.
+    :param describe: Names a result in the descriptions, by default with its key_fields.
+    """
+    if describe is None:
+
+        def describe(result: dict) -> str:
+            return ", ".join(f"{field} {result.get(field)}" for field in key_fields)
+
+    baseline_results = {tuple(result.get(field) for field in key_fields): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = baseline_results.get(tuple(result.get(field) for field in key_fields))
+        if old is None:
+            continue
+
+        for field in compared_fields:
+            if not old.get(field) or result.get(field) is None:
+                continue
+            change = result[field] / old[field] - 1
+            if change > tolerance:
+                regressions.append(
+                    f"{describe(result)}: {field} {old[field]:.6g} -> {result[field]:.6g} (+{change:.0%})"
+                )
+
+    return regressions
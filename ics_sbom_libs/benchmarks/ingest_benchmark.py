@@ -0,0 +1,333 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Benchmark of NVD downloads into a vulnerability database.
+
+VulnerabilityDatabase.create_database downloads a synthetic NVD (see synthetic_nvd.py), or the records of recorded
+NVD files given with --archive, from a local stand-in of the NVD API (see nvd_stand_in.py). The stand-in then
+modifies --changed of its records and the database is updated, the way a nightly update follows the initial
+download. Both phases run with and without bulk ingest settings:
+
+    python -m ics_sbom_libs.benchmarks.ingest_benchmark --cves 20000 --latency 0.5 --output ingest.json
+
+Every phase reports the records per second and what it cost the disk: the commits and statements executed, the
+bytes written and an estimate of the fsync calls. SQLite syncs a fixed number of times per commit for a given
+journal mode and synchronous setting, the estimate is that number times the commits. It does not count the syncs
+of WAL checkpoints. The bytes written come from /proc/self/io and are missing where there is no such file.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Final
+
+from rich import print, table
+
+from ics_sbom_libs.benchmarks import harness
+from ics_sbom_libs.benchmarks.harness import environment, io_counters, peak_rss_kb, run_isolated
+from ics_sbom_libs.benchmarks.nvd_stand_in import NvdStandIn
+from ics_sbom_libs.benchmarks.synthetic_nvd import DEFAULT_SEED, SyntheticNvd
+
+__all__ = ["INGEST_PHASES", "syncs_per_commit", "run_ingest", "run_benchmark", "compare_results", "main"]
+
+BENCHMARK_FORMAT_VERSION: Final = 1
+INGEST_PHASES: Final = ["full", "incremental"]
+# The stand-in never throttles the benchmark, the latency and failures it is given are what is measured.
+UNLIMITED_REQUESTS_PER_WINDOW: Final = 1_000_000
+# Fields of a result compared with the baseline, lower is better for all of them.
+COMPARED_FIELDS: Final = ["wall_sec", "commits", "write_bytes", "peak_rss_kb"]
+
+
+def syncs_per_commit(journal_mode: str, synchronous: int) -> int:
+    """
+    The fsync calls SQLite makes to commit a transaction with the journal mode and synchronous setting
+    (0 OFF, 1 NORMAL, 2 FULL, 3 EXTRA) of the connection, https://www.sqlite.org/atomiccommit.html.
+    """
+    if synchronous == 0:
+        return 0
+
+    journal_mode = journal_mode.lower()
+    if journal_mode == "wal":
+        # NORMAL only syncs the WAL file when it is checkpointed.
+        return 1 if synchronous >= 2 else 0
+    if journal_mode in ("memory", "off"):
+        return 1
+
+    # The journal, its header once it is complete (not with NORMAL) and the database file.
+    return 3 if synchronous >= 2 else 2
+
+
+def run_ingest(cache_dir: pathlib.Path, db_file: str, base_url: str, bulk_ingest: bool, max_in_flight: int) -> dict:
+    """
+    Downloads from the NVD API at base_url into the database, creating it or updating it.
+
+    :return: The measurements taken on the database side.
+    """
+    # Imported here, a process that only compares results does not need the database code.
+    from ics_sbom_libs.cve_fetch.nvd_downloader import NvdDownloader
+    from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+    db = VulnerabilityDatabase(cache_dir, db_file, api_key="none")
+    statements = Counter()
+
+    def count_statement(sql: str):
+        statements[sql.split(None, 1)[0].upper() if sql.strip() else ""] += 1
+
+    db.con.set_trace_callback(count_statement)
+    downloader = NvdDownloader(
+        base_url=base_url,
+        max_in_flight=max_in_flight,
+        requests_per_window=UNLIMITED_REQUESTS_PER_WINDOW,
+        retry_delay=0,
+    )
+
+    io_start = io_counters()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    db.create_database(bulk_ingest=bulk_ingest, downloader=downloader)
+    wall_sec = time.perf_counter() - start
+    cpu_sec = time.process_time() - cpu_start
+    io_end = io_counters()
+
+    db_path = cache_dir / db_file
+    with contextlib.closing(sqlite3.connect(db_path)) as con:
+        journal_mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+    # The connection of create_database is closed, bulk ingest only changes its synchronous setting.
+    synchronous = 1 if bulk_ingest else 2
+    commits = statements["COMMIT"]
+
+    return {
+        "wall_sec": wall_sec,
+        "cpu_sec": cpu_sec,
+        "commits": commits,
+        "statements": dict(statements),
+        "journal_mode": journal_mode,
+        "synchronous": synchronous,
+        "fsyncs_estimated": commits * syncs_per_commit(journal_mode, synchronous),
+        "write_bytes": io_end["write_bytes"] - io_start["write_bytes"] if io_start and io_end else None,
+        "write_calls": io_end["syscw"] - io_start["syscw"] if io_start and io_end else None,
+        "db_size_bytes": db_path.stat().st_size,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def run_benchmark(
+    work_dir: pathlib.Path,
+    nvd: SyntheticNvd | None = None,
+    archive: pathlib.Path | None = None,
+    bulk_ingest: list[bool] | None = None,
+    changed: float = 0.01,
+    page_size: int = 10000,
+    latency: float = 0.0,
+    fail_rate: float = 0.0,
+    max_in_flight: int = 2,
+    seed: int = DEFAULT_SEED,
+    isolate: bool = True,
+) -> dict:
+    """
+    Runs a full and an incremental download with every bulk ingest setting and returns the benchmark document.
+
+    :param nvd: The synthetic NVD to serve, unless archive is given.
+    :param archive: Recorded NVD files to serve, see NvdStandIn.from_archive.
+    :param changed: Fraction of the records modified between the two downloads.
+    :param page_size: Largest page the stand-in serves, NVD's are 2000 CVEs and 10000 CPEs.
+    :param latency: Seconds the stand-in takes to answer a request.
+    :param fail_rate: Probability of the stand-in answering a request with 503.
+    :param isolate: Run every phase in a new process. Without it peak memory is that of the whole run so far.
+    """
+    if bulk_ingest is None:
+        bulk_ingest = [True, False]
+    if archive is None and nvd is None:
+        nvd = SyntheticNvd(seed=seed)
+
+    stand_in_args = {"page_size": page_size, "delay": latency, "fail_rate": fail_rate, "seed": seed}
+    results = []
+    for bulk in bulk_ingest:
+        # Every setting downloads the same records, touch() modifies those of its own stand-in.
+        if archive is not None:
+            stand_in = NvdStandIn.from_archive(archive, **stand_in_args)
+        else:
+            stand_in = NvdStandIn.from_synthetic(nvd, **stand_in_args)
+
+        db_file = f"ingest_{'bulk' if bulk else 'default'}.db"
+        (work_dir / db_file).unlink(missing_ok=True)
+        with stand_in:
+            for phase in INGEST_PHASES:
+                if phase == "incremental":
+                    stand_in.touch(changed, seed)
+
+                requests, failed = len(stand_in.requests), stand_in.failed_requests
+                served = dict(stand_in.served_records)
+                stand_in.max_in_flight = 0
+
+                args = (work_dir, db_file, stand_in.base_url, bulk, max_in_flight)
+                result = run_isolated(run_ingest, *args) if isolate else run_ingest(*args)
+
+                records = {feed: stand_in.served_records[feed] - served[feed] for feed in served}
+                total = sum(records.values())
+                result = {
+                    "phase": phase,
+                    "bulk_ingest": bulk,
+                    "records": records,
+                    "records_per_sec": total / result["wall_sec"] if result["wall_sec"] else None,
+                    "requests": len(stand_in.requests) - requests,
+                    "failed_requests": stand_in.failed_requests - failed,
+                    "max_in_flight": stand_in.max_in_flight,
+                    **result,
+                }
+                results.append(result)
+                print(
+                    f"[green]{phase}[/green] {'bulk' if bulk else 'default'}: {total} records in"
+                    f" {result['wall_sec']:.2f}s, {result['commits']} commits"
+                )
+
+    return {
+        "benchmark": "nvd_ingest",
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "parameters": {
+            "source": str(archive) if archive is not None else "synthetic",
+            "products": nvd.num_products if archive is None else None,
+            "cves": nvd.num_cves if archive is None else None,
+            "changed": changed,
+            "page_size": page_size,
+            "latency": latency,
+            "fail_rate": fail_rate,
+            "max_in_flight": max_in_flight,
+            "seed": seed,
+            "isolated": isolate,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.2) -> list[str]:
+    """
+    Returns a description of every phase of current that is worse than the same phase of baseline by more than the
+    tolerance, a fraction of the baseline value.
+    """
+    return harness.compare_results(
+        baseline,
+        current,
+        ["phase", "bulk_ingest"],
+        COMPARED_FIELDS,
+        tolerance,
+        describe=lambda result: f"{result['phase']} {'bulk' if result['bulk_ingest'] else 'default'} ingest",
+    )
+
+
+def create_result_table(document: dict) -> table.Table:
+    result_table = table.Table(title="NVD Ingest Benchmark", row_styles=["dim", ""])
+    result_table.add_column(header="Phase", style="green")
+    result_table.add_column(header="Bulk", style="magenta")
+    result_table.add_column(header="Records", justify="right")
+    result_table.add_column(header="Time (s)", justify="right")
+    result_table.add_column(header="Records/s", justify="right")
+    result_table.add_column(header="Requests", justify="right")
+    result_table.add_column(header="Commits", justify="right")
+    result_table.add_column(header="fsyncs (est.)", justify="right")
+    result_table.add_column(header="Written (MB)", justify="right")
+    result_table.add_column(header="Peak RSS (MB)", justify="right")
+
+    for result in document["results"]:
+        result_table.add_row(
+            result["phase"],
+            "yes" if result["bulk_ingest"] else "no",
+            f"{sum(result['records'].values())}",
+            f"{result['wall_sec']:.2f}",
+            f"{result['records_per_sec']:.0f}" if result["records_per_sec"] else "",
+            f"{result['requests']} ({result['failed_requests']} failed)",
+            f"{result['commits']}",
+            f"{result['fsyncs_estimated']}",
+            f"{result['write_bytes'] / 2**20:.1f}" if result["write_bytes"] is not None else "",
+            f"{(result['peak_rss_kb'] or 0) / 1024:.0f}",
+        )
+
+    return result_table
+
+
+def setup_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--products", type=int, default=2000, help="Products of the synthetic NVD.")
+    parser.add_argument("--cves", type=int, default=20000, help="CVEs of the synthetic NVD.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic data and failures.")
+    parser.add_argument(
+        "--archive", type=pathlib.Path, help="Serve the records of recorded NVD files instead of synthetic ones."
+    )
+    parser.add_argument(
+        "--bulk-ingest",
+        choices=["on", "off", "both"],
+        default="both",
+        help="Download with bulk ingest settings, without them, or both.",
+    )
+    parser.add_argument(
+        "--changed", type=float, default=0.01, help="Fraction of the records modified before the incremental phase."
+    )
+    parser.add_argument("--page-size", type=int, default=10000, help="Largest page the stand-in serves.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the stand-in takes to answer.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of the requests answered with 503.")
+    parser.add_argument("--max-in-flight", type=int, default=2, help="Page requests per feed kept open at once.")
+    parser.add_argument(
+        "--work-dir", type=pathlib.Path, help="Where the databases are written, a temporary directory by default."
+    )
+    parser.add_argument("--no-isolate", action="store_true", help="Run every phase in this process.")
+    parser.add_argument("--output", type=pathlib.Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", type=pathlib.Path, help="Results of an earlier run to compare with.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed slowdown or growth compared with the baseline."
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks NVD downloads against a local stand-in of the API.")
+    setup_args(parser)
+    args = parser.parse_args(argv)
+    # Read by tqdm when it is imported, which the phase processes do after they inherited it.
+    os.environ.setdefault("TQDM_DISABLE", "1")
+
+    bulk_ingest = {"on": [True], "off": [False], "both": [True, False]}[args.bulk_ingest]
+    nvd = None if args.archive else SyntheticNvd(args.products, args.cves, args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or pathlib.Path(tmp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        document = run_benchmark(
+            work_dir,
+            nvd,
+            args.archive,
+            bulk_ingest,
+            args.changed,
+            args.page_size,
+            args.latency,
+            args.fail_rate,
+            args.max_in_flight,
+            args.seed,
+            isolate=not args.no_isolate,
+        )
+
+    print(create_result_table(document))
+    if args.output:
+        args.output.write_text(json.dumps(document, indent=2))
+
+    if args.baseline:
+        regressions = compare_results(json.loads(args.baseline.read_text()), document, args.tolerance)
+        for regression in regressions:
+            print(f"[red][b]REGRESSION:[/b] {regression}[/red]")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
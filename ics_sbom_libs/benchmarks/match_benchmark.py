@@ -0,0 +1,368 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Benchmark of CveMatcher scans.
+
+A synthetic vulnerability database and Yocto style SBOMs of the requested sizes are generated (see synthetic_nvd.py)
+and every SBOM is scanned with every matching mode. The results, one record per size and mode with the time of each
+phase, the scan throughput and the peak memory, are written as JSON:
+
+    python -m ics_sbom_libs.benchmarks.match_benchmark --sizes 100 1000 20000 --output match.json
+
+Every case runs in a fresh process, so its peak memory is its own and no connection, index or snapshot mapping is
+inherited from an earlier case. With --baseline the results are compared to those of an earlier run, every case
+that got slower or bigger by more than --tolerance is reported and the exit status is 1.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import pathlib
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timezone
+from typing import Final
+
+from rich import print, table
+
+from ics_sbom_libs.benchmarks import harness
+from ics_sbom_libs.benchmarks.harness import environment, peak_rss_kb, run_isolated
+from ics_sbom_libs.benchmarks.synthetic_nvd import (
+    DEFAULT_SEED,
+    SyntheticNvd,
+    create_synthetic_database,
+    write_yocto_sbom,
+)
+from ics_sbom_libs.common.memory_profile import MEMORY_MODES, MemoryProfile, profiling
+
+__all__ = ["MATCH_MODES", "MATCH_PHASES", "run_case", "run_benchmark", "compare_results", "main"]
+
+BENCHMARK_FORMAT_VERSION: Final = 1
+DEFAULT_SIZES: Final = [100, 1000, 5000, 20000]
+# CveMatcher arguments of every mode. "async" scans with process_async() instead of process().
+MATCH_MODES: Final = {
+    "serial": {"backend": "serial"},
+    "thread": {"backend": "thread"},
+    "process": {"backend": "process"},
+    "snapshot": {"backend": "process", "use_snapshot": True},
+    "range_index": {"backend": "serial", "use_range_index": True},
+    "match_cache": {"backend": "process", "use_match_cache": True},
+    "async": {"backend": "thread", "async": True},
+}
+# Phases of a scan reported in phase_median_sec, and the MatchStats stages (see match_stats.py) each one adds up.
+MATCH_PHASES: Final = {
+    "cpe_resolution": ("cpe_resolution",),
+    "cve_lookup": ("range_query", "version_conversion", "version_comparison"),
+    "cve_hydration": ("cve_hydration",),
+    "result_aggregation": ("result_aggregation",),
+}
+# Fields of a result compared with the baseline, lower is better for all of them.
+COMPARED_FIELDS: Final = ["scan_median_sec", "peak_rss_kb"]
+
+
+def run_case(
+    db_path: pathlib.Path,
+    sbom_path: pathlib.Path,
+    size: int,
+    mode: str,
+    workers: int,
+    repeat: int,
+    profile_memory: str | None = None,
+) -> dict:
+    """
+    Imports the SBOM of size packages and scans it repeat times in one mode.
+
+    :param profile_memory: A memory profile mode (see memory_profile.py). The memory of every import and scan phase
+                           is then recorded in memory_phases, at the cost of slower imports and scans in the
+                           tracemalloc mode.
+    :return: The benchmark record of the case.
+    """
+    if not profile_memory:
+        return _run_case(db_path, sbom_path, size, mode, workers, repeat) | {"memory_phases": None}
+
+    with profiling(MemoryProfile(profile_memory)) as profile:
+        result = _run_case(db_path, sbom_path, size, mode, workers, repeat)
+
+    return result | {"memory_phases": profile.to_dict()["phases"]}
+
+
+def _run_case(db_path: pathlib.Path, sbom_path: pathlib.Path, size: int, mode: str, workers: int, repeat: int) -> dict:
+    # Imported here, a process that only generates data or compares results does not need the matcher.
+    from ics_sbom_libs.cve_match.cvematcher import CveMatcher
+    from ics_sbom_libs.sbom_import.parse_anything import parse_anything
+
+    options = dict(MATCH_MODES[mode])
+    use_async = options.pop("async", False)
+
+    start = time.perf_counter()
+    document = parse_anything(sbom_path)
+    import_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # The stage timings cost two clock reads per stage run, little next to the work they measure.
+    matcher = CveMatcher(db_path, max_workers=workers, collect_stats=True, **options)
+    matcher.spdx_document = document
+    # The first use creates the executor and loads the snapshot or the in-memory index. A process pool only starts
+    # its workers with the first scan.
+    _ = matcher.executor, matcher.snapshot_path, matcher.range_index
+    setup_sec = time.perf_counter() - start
+
+    scans = []
+    scan_stages = []
+    try:
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            if use_async:
+                asyncio.run(matcher.process_async())
+            else:
+                matcher.process()
+            scans.append(time.perf_counter() - start)
+            scan_stages.append(matcher.stats.to_dict()["stages"])
+    finally:
+        matcher.close()
+
+    # The first scan also pays for cold caches, the others show the steady state.
+    warm_scans = scans[1:] or scans
+    warm_stages = scan_stages[1:] or scan_stages
+    scan_median = statistics.median(warm_scans)
+    return {
+        "size": size,
+        "mode": mode,
+        "workers": workers,
+        "packages": matcher.total_package_count,
+        "dirty_packages": matcher.dirty_package_count,
+        "cves": matcher.total_cve_count,
+        "import_sec": import_sec,
+        "setup_sec": setup_sec,
+        "first_scan_sec": scans[0],
+        "scan_sec": scans,
+        "scan_median_sec": scan_median,
+        "scan_max_sec": max(warm_scans),
+        "packages_per_sec": matcher.total_package_count / scan_median if scan_median else None,
+        # Summed over the workers of the parallel modes, so a phase can take longer than the scan.
+        "phase_median_sec": {
+            phase: statistics.median(
+                sum(stages[stage]["wall_sec"] for stage in phase_stages if stage in stages) for stages in warm_stages
+            )
+            for phase, phase_stages in MATCH_PHASES.items()
+        },
+        "first_scan_stages": scan_stages[0],
+        "scan_stages": warm_stages[-1],
+        "peak_rss_kb": peak_rss_kb(),
+        "peak_rss_workers_kb": peak_rss_kb(children=True),
+    }
+
+
+def prepare_data(
+    work_dir: pathlib.Path, sizes: list[int], num_products: int, num_cves: int, seed: int
+) -> tuple[pathlib.Path, dict[int, pathlib.Path], dict]:
+    """
+    Generates the database and the SBOMs in work_dir, reusing those of an earlier run with the same parameters.
+
+    :return: The database path, the SBOM directory of every size and the description of the database.
+    """
+    nvd = SyntheticNvd(num_products, num_cves, seed)
+    db_file = f"synthetic_nvd_{num_products}_{num_cves}_{seed}.db"
+    db_path = work_dir / db_file
+    build_sec = None
+    if not db_path.exists():
+        start = time.perf_counter()
+        create_synthetic_database(work_dir, db_file, nvd)
+        build_sec = time.perf_counter() - start
+
+    sboms = {}
+    for size in sizes:
+        sbom_dir = work_dir / f"sbom_{size}_{num_products}_{seed}"
+        if not sbom_dir.exists():
+            write_yocto_sbom(sbom_dir.with_suffix(".tmp"), nvd, size, seed).rename(sbom_dir)
+        sboms[size] = sbom_dir
+
+    with contextlib.closing(sqlite3.connect(db_path)) as con:
+        ranges = con.execute("SELECT COUNT(*) FROM cve_range").fetchone()[0]
+    database = {
+        "products": num_products,
+        "cves": num_cves,
+        "cpes": nvd.num_cpes(),
+        "cve_ranges": ranges,
+        "seed": seed,
+        "size_bytes": db_path.stat().st_size,
+        "build_sec": build_sec,
+    }
+
+    return db_path, sboms, database
+
+
+def run_benchmark(
+    work_dir: pathlib.Path,
+    sizes: list[int],
+    modes: list[str],
+    workers: int,
+    repeat: int = 3,
+    num_products: int = 2000,
+    num_cves: int = 20000,
+    seed: int = DEFAULT_SEED,
+    isolate: bool = True,
+    profile_memory: str | None = None,
+) -> dict:
+    """
+    Runs every mode on every size and returns the benchmark document.
+
+    :param isolate: Run every case in a new process. Without it peak memory is that of the whole run so far.
+    :param profile_memory: Records the memory of the import and scan phases of every case, see run_case().
+    """
+    db_path, sboms, database = prepare_data(work_dir, sizes, num_products, num_cves, seed)
+
+    results = []
+    for size in sizes:
+        for mode in modes:
+            args = (db_path, sboms[size], size, mode, workers, repeat, profile_memory)
+            result = run_isolated(run_case, *args) if isolate else run_case(*args)
+            results.append(result)
+            print(
+                f"[green]{mode}[/green] {size} packages: {result['scan_median_sec']:.3f}s per scan, "
+                f"{result['peak_rss_kb']} kB peak"
+            )
+
+    return {
+        "benchmark": "cve_match",
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "parameters": {
+            "sizes": sizes,
+            "modes": modes,
+            "workers": workers,
+            "repeat": repeat,
+            "isolated": isolate,
+            "profile_memory": profile_memory,
+        },
+        "database": database,
+        "results": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.2) -> list[str]:
+    """
+    Returns a description of every case of current that is worse than the same case (size and mode) of baseline by
+    more than the tolerance, a fraction of the baseline value.
+    """
+    return harness.compare_results(
+        baseline,
+        current,
+        ["size", "mode"],
+        COMPARED_FIELDS,
+        tolerance,
+        describe=lambda result: f"{result['mode']} with {result['size']} packages",
+    )
+
+
+def create_result_table(document: dict) -> table.Table:
+    result_table = table.Table(title="CVE Matching Benchmark", row_styles=["dim", ""])
+    result_table.add_column(header="Packages", style="green", justify="right")
+    result_table.add_column(header="Mode", style="magenta")
+    result_table.add_column(header="Import (s)", justify="right")
+    result_table.add_column(header="Setup (s)", justify="right")
+    result_table.add_column(header="First scan (s)", justify="right")
+    result_table.add_column(header="Scan (s)", justify="right")
+    result_table.add_column(header="CPE (s)", justify="right")
+    result_table.add_column(header="Lookup (s)", justify="right")
+    result_table.add_column(header="Packages/s", justify="right")
+    result_table.add_column(header="Peak RSS (MB)", justify="right")
+    result_table.add_column(header="CVEs", justify="right")
+
+    for result in document["results"]:
+        peak_kb = max(result["peak_rss_kb"] or 0, result["peak_rss_workers_kb"] or 0)
+        result_table.add_row(
+            f"{result['size']}",
+            result["mode"],
+            f"{result['import_sec']:.3f}",
+            f"{result['setup_sec']:.3f}",
+            f"{result['first_scan_sec']:.3f}",
+            f"{result['scan_median_sec']:.3f}",
+            f"{result['phase_median_sec']['cpe_resolution']:.3f}",
+            f"{result['phase_median_sec']['cve_lookup']:.3f}",
+            f"{result['packages_per_sec']:.0f}" if result["packages_per_sec"] else "",
+            f"{peak_kb / 1024:.0f}",
+            f"{result['cves']}",
+        )
+
+    return result_table
+
+
+def setup_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Number of packages per SBOM.")
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MATCH_MODES), default=list(MATCH_MODES), help="Matching modes to run."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=max(2, os.cpu_count() or 1), help="Workers of the parallel modes."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Scans per case, the first one is reported separately.")
+    parser.add_argument("--products", type=int, default=2000, help="Products in the synthetic database.")
+    parser.add_argument("--cves", type=int, default=20000, help="CVEs in the synthetic database.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic data.")
+    parser.add_argument(
+        "--work-dir",
+        type=pathlib.Path,
+        help="Where the generated data is kept and reused, a temporary directory by default.",
+    )
+    parser.add_argument("--no-isolate", action="store_true", help="Run every case in this process.")
+    parser.add_argument(
+        "--profile-memory",
+        choices=MEMORY_MODES,
+        help="Record the peak and retained memory of every import and scan phase, measured this way.",
+    )
+    parser.add_argument("--output", type=pathlib.Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", type=pathlib.Path, help="Results of an earlier run to compare with.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed slowdown or growth compared with the baseline."
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks CveMatcher scans on synthetic data.")
+    setup_args(parser)
+    args = parser.parse_args(argv)
+    # Read by tqdm when it is imported, which the case processes do after they inherited it.
+    os.environ.setdefault("TQDM_DISABLE", "1")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or pathlib.Path(tmp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        document = run_benchmark(
+            work_dir,
+            args.sizes,
+            args.modes,
+            args.workers,
+            args.repeat,
+            args.products,
+            args.cves,
+            args.seed,
+            isolate=not args.no_isolate,
+            profile_memory=args.profile_memory,
+        )
+
+    print(create_result_table(document))
+    if args.output:
+        args.output.write_text(json.dumps(document, indent=2))
+
+    if args.baseline:
+        regressions = compare_results(json.loads(args.baseline.read_text()), document, args.tolerance)
+        for regression in regressions:
+            print(f"[red][b]REGRESSION:[/b] {regression}[/red]")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
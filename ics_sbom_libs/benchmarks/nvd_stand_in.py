@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+A local HTTP server answering the paged NVD 2.0 CVE and CPE API requests, so that downloads can be tested and
+measured without NVD.
+
+The records come from lists, from a SyntheticNvd or from recorded NVD JSON files (see nvd_archive.py). Like NVD the
+server caps the page size, filters on lastModStartDate / lastModEndDate, compresses the pages for clients accepting
+gzip, answers 503 with a Retry-After when asked to fail, and takes its time to answer. It records every request, the
+number of records it served and the largest number of requests it was answering at once.
+"""
+
+import copy
+import gzip
+import json
+import pathlib
+import random
+import threading
+import time
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from ics_sbom_libs.benchmarks.synthetic_nvd import SyntheticNvd, make_cpe_page, make_cve_page
+from ics_sbom_libs.cve_fetch.nvd_archive import NvdJsonReader, iter_archive_files, open_nvd_json
+
+__all__ = ["NvdStandIn"]
+
+
+def _last_modified(feed: str, record: dict) -> str:
+    return record["cve" if feed == "cves" else "cpe"]["lastModified"]
+
+
+def _parse_nvd_date(value: str) -> datetime:
+    # NVD takes dates with or without milliseconds and time zone, records carry neither.
+    return datetime.fromisoformat(value.replace("Z", "")[:23]).replace(tzinfo=None)
+
+
+class NvdStandIn:
+    """
+    Serves the CVE and CPE API from lists of records. Use it as a context manager, base_url is valid inside it.
+    """
+
+    def __init__(
+        self,
+        cves: list,
+        cpes: list,
+        page_size: int = 2,
+        fail_first: int = 0,
+        fail_rate: float = 0.0,
+        delay: float = 0.0,
+        retry_after: float = 0,
+        seed: int = 0,
+    ):
+        """
+        :param cves: Elements of the "vulnerabilities" array of the CVE API.
+        :param cpes: Elements of the "products" array of the CPE API.
+        :param page_size: Largest number of records per page, NVD's are 2000 CVEs and 10000 CPEs.
+        :param fail_first: Number of requests answered with 503 before the first page is served.
+        :param fail_rate: Probability of answering any later request with 503.
+        :param delay: Seconds to wait before answering, NVD takes several seconds for a page of CVEs.
+        :param retry_after: Value of the Retry-After header of the 503 answers.
+        :param seed: Seed of the random failures.
+        """
+        self.feeds = {"cves": (cves, make_cve_page), "cpes": (cpes, make_cpe_page)}
+        self.page_size = page_size
+        self.fail_first = fail_first
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.retry_after = retry_after
+
+        self.requests: list[tuple[str, dict]] = []
+        self.failed_requests = 0
+        self.served_records = {"cves": 0, "cpes": 0}
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        # Records of a feed matching lastModStartDate / lastModEndDate, the paging asks the same query many times.
+        self._selections: dict[tuple, list] = {}
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in._handle(self)
+
+            def log_message(self, format, *args):
+                return
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @classmethod
+    def from_synthetic(cls, nvd: SyntheticNvd, **kwargs) -> "NvdStandIn":
+        return cls(list(nvd.iter_cves()), list(nvd.iter_cpes()), **kwargs)
+
+    @classmethod
+    def from_archive(cls, archive_path: pathlib.Path | str, **kwargs) -> "NvdStandIn":
+        """
+        Serves the records of recorded API pages or feed files, a directory, tarball or single file.
+        """
+        records = {"cve": [], "cpe": []}
+        for name, fp in iter_archive_files(archive_path):
+            reader = NvdJsonReader(open_nvd_json(name, fp))
+            file_records = list(reader)
+            if reader.src_name is not None:
+                records[reader.src_name] += file_records
+
+        return cls(records["cve"], records["cpe"], **kwargs)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/rest/json/{{}}/2.0/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def touch(self, fraction: float, seed: int = 0) -> int:
+        """
+        Modifies a fraction of the CVE and CPE records now, as NVD does between two updates, so that an incremental
+        download has something to fetch.
+
+        :return: The number of modified records.
+        """
+        rng = random.Random(seed)
+        now = datetime.utcnow().isoformat(timespec="milliseconds")
+        count = 0
+        with self._lock:
+            for feed, (records, _) in self.feeds.items():
+                for index in rng.sample(range(len(records)), round(len(records) * fraction)):
+                    record = copy.deepcopy(records[index])
+                    if feed == "cves":
+                        record["cve"]["lastModified"] = now
+                        record["cve"]["descriptions"][0]["value"] += " (updated)"
+                    else:
+                        record["cpe"]["lastModified"] = now
+                    records[index] = record
+                    count += 1
+
+            self._selections.clear()
+
+        return count
+
+    def _select(self, feed: str, params: dict) -> list:
+        records, _ = self.feeds[feed]
+        start, end = params.get("lastModStartDate"), params.get("lastModEndDate")
+        if start is None and end is None:
+            return records
+
+        key = (feed, start, end)
+        with self._lock:
+            if key not in self._selections:
+                start = _parse_nvd_date(start) if start else datetime.min
+                end = _parse_nvd_date(end) if end else datetime.max
+                self._selections[key] = [
+                    record for record in records if start <= _parse_nvd_date(_last_modified(feed, record)) <= end
+                ]
+
+            return self._selections[key]
+
+    def _handle(self, request: BaseHTTPRequestHandler):
+        url = urlsplit(request.path)
+        feed = url.path.split("/")[3]
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        with self._lock:
+            self.requests.append((feed, params))
+            fail = len(self.requests) <= self.fail_first or self._random.random() < self.fail_rate
+            if fail:
+                self.failed_requests += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+        try:
+            time.sleep(self.delay)
+            if fail:
+                request.send_response(503)
+                request.send_header("Retry-After", str(self.retry_after))
+                request.end_headers()
+                return
+
+            records = self._select(feed, params)
+            _, make_page = self.feeds[feed]
+            start = int(params.get("startIndex", 0))
+            end = start + min(int(params.get("resultsPerPage", self.page_size)), self.page_size)
+            page = make_page(records[start:end], start, len(records))
+            with self._lock:
+                self.served_records[feed] += page["resultsPerPage"]
+
+            body = json.dumps(page).encode()
+            request.send_response(200)
+            request.send_header("Content-Type", "application/json")
+            if "gzip" in request.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=1)
+                request.send_header("Content-Encoding", "gzip")
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
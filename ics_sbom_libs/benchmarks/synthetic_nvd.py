@@ -0,0 +1,312 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Synthetic NVD data and Yocto style SBOMs for the benchmarks.
+
+SyntheticNvd generates CVE and CPE records in the layout of the NVD 2.0 API, so they go through the same parsing and
+writing code as downloaded pages. The data is random but shaped like the real feeds: a few products (the kernel,
+openssl, ...) have most of the CVEs, and the CVEs use every kind of version range. The same seed always produces the
+same records.
+
+write_yocto_sbom writes a directory of per package SPDX JSON documents like the one Yocto's create-spdx class puts in
+the image's .spdx.tar.zst. The packages of a recipe share the recipe's CPE, some carry no CPE at all and some are
+not known to NVD. Package names avoid the default exclusions of FilteredParser, so every package is scanned.
+"""
+
+import json
+import pathlib
+import random
+
+from datetime import datetime, timezone
+from typing import Final
+
+from beartype.typing import Iterator
+
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import (
+    CPE_RECORD_PER_PAGE,
+    CVE_RECORD_PER_PAGE,
+    VulnerabilityDatabase,
+)
+
+__all__ = ["SyntheticNvd", "create_synthetic_database", "write_yocto_sbom", "make_cve_page", "make_cpe_page"]
+
+DEFAULT_SEED: Final = 2024
+NVD_TIMESTAMP: Final = "2024-01-01T00:00:00.000"
+# Real recipes of a Yocto image and the vendor NVD lists them under. They come first and get the most CVEs.
+YOCTO_PRODUCTS: Final = [
+    ("linux", "linux_kernel"),
+    ("openssl", "openssl"),
+    ("gnu", "glibc"),
+    ("busybox", "busybox"),
+    ("haxx", "curl"),
+    ("openbsd", "openssh"),
+    ("sqlite", "sqlite"),
+    ("zlib", "zlib"),
+    ("gnu", "bash"),
+    ("systemd_project", "systemd"),
+    ("xmlsoft", "libxml2"),
+    ("libexpat_project", "libexpat"),
+    ("python", "python"),
+    ("freedesktop", "dbus"),
+    ("kernel", "util-linux"),
+    ("gnu", "binutils"),
+    ("gnu", "gcc"),
+    ("tukaani", "xz"),
+    ("bzip", "bzip2"),
+    ("libpng", "libpng"),
+]
+# Packages a recipe is split into, leaving out those the importer filters (-dev, -dbg, -doc, ...). Only the main
+# package is named like the NVD product.
+YOCTO_PACKAGE_SUFFIXES: Final = ["", "-bin", "-utils", "-tools", "-conf", "-client", "-server", "-plugins"]
+_severities: Final = [("LOW", 2.5), ("MEDIUM", 5.5), ("HIGH", 7.5), ("CRITICAL", 9.8)]
+
+
+class SyntheticNvd:
+    """
+    A reproducible set of NVD CVE and CPE records.
+    """
+
+    def __init__(self, num_products: int = 2000, num_cves: int = 20000, seed: int = DEFAULT_SEED):
+        """
+        :param num_products: Number of products, the first ones are taken from YOCTO_PRODUCTS.
+        :param num_cves: Number of CVE records.
+        :param seed: Seed of the random generator.
+        """
+        self.num_products = num_products
+        self.num_cves = num_cves
+        self.seed = seed
+
+        rng = random.Random(seed)
+        # (vendor, product, known versions in ascending order)
+        self.products: list[tuple[str, str, list[str]]] = []
+        for i in range(num_products):
+            if i < len(YOCTO_PRODUCTS):
+                vendor, product = YOCTO_PRODUCTS[i]
+            else:
+                vendor, product = f"vendor{i % 97}", f"lib{_word(rng)}{i}"
+            self.products.append((vendor, product, _versions(rng)))
+
+    def iter_cves(self) -> Iterator[dict]:
+        """
+        Yields the elements of the "vulnerabilities" array of the CVE API.
+        """
+        rng = random.Random(self.seed + 1)
+        # Zipf like: the first products get most of the CVEs.
+        weights = [1 / (rank + 1) ** 0.9 for rank in range(self.num_products)]
+        for i, index in enumerate(rng.choices(range(self.num_products), weights, k=self.num_cves)):
+            vendor, product, versions = self.products[index]
+            cpe_matches = [_cpe_match(rng, vendor, product, versions)]
+            if rng.random() < 0.1:
+                cpe_matches.append(_cpe_match(rng, vendor, product, versions))
+            if rng.random() < 0.1:
+                # A platform the vulnerable product has to run on, NVD marks it as not vulnerable.
+                cpe_matches.append(
+                    {"vulnerable": False, "criteria": "cpe:2.3:o:debian:debian_linux:11.0:*:*:*:*:*:*:*"}
+                )
+
+            severity, score = rng.choice(_severities)
+            cve_id = f"CVE-{1999 + i % 26}-{100000 + i}"
+            yield {
+                "cve": {
+                    "id": cve_id,
+                    "published": "2023-01-01T00:00:00.000",
+                    "lastModified": "2023-06-01T00:00:00.000",
+                    "descriptions": [{"lang": "en", "value": f"Synthetic vulnerability {cve_id} in {product}."}],
+                    "metrics": {
+                        "cvssMetricV31": [
+                            {
+                                "cvssData": {
+                                    "version": "3.1",
+                                    "vectorString": "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:N/A:N",
+                                    "baseScore": score,
+                                    "baseSeverity": severity,
+                                }
+                            }
+                        ]
+                    },
+                    "weaknesses": [{"description": [{"lang": "en", "value": f"CWE-{rng.randint(20, 1000)}"}]}],
+                    "configurations": [{"nodes": [{"operator": "OR", "negate": False, "cpeMatch": cpe_matches}]}],
+                }
+            }
+
+    def iter_cpes(self) -> Iterator[dict]:
+        """
+        Yields the elements of the "products" array of the CPE API, one per known product version.
+        """
+        rng = random.Random(self.seed + 2)
+        count = 0
+        for vendor, product, versions in self.products:
+            for version in versions:
+                count += 1
+                yield {
+                    "cpe": {
+                        "deprecated": rng.random() < 0.05,
+                        "cpeName": f"cpe:2.3:a:{vendor}:{product}:{version}:*:*:*:*:*:*:*",
+                        "cpeNameId": f"00000000-0000-0000-0000-{count:012d}",
+                        "lastModified": "2023-06-01T00:00:00.000",
+                        "created": "2023-01-01T00:00:00.000",
+                    }
+                }
+
+    def num_cpes(self) -> int:
+        return sum(len(versions) for _, _, versions in self.products)
+
+
+def make_cve_page(cves: list, start_index: int = 0, total_results: int | None = None) -> dict:
+    return _make_page("NVD_CVE", "vulnerabilities", cves, start_index, total_results)
+
+
+def make_cpe_page(products: list, start_index: int = 0, total_results: int | None = None) -> dict:
+    return _make_page("NVD_CPE", "products", products, start_index, total_results)
+
+
+def _make_page(page_format: str, key: str, records: list, start_index: int, total_results: int | None) -> dict:
+    return {
+        "resultsPerPage": len(records),
+        "startIndex": start_index,
+        "totalResults": len(records) if total_results is None else total_results,
+        "format": page_format,
+        "version": "2.0",
+        "timestamp": NVD_TIMESTAMP,
+        key: records,
+    }
+
+
+def create_synthetic_database(cache_dir: pathlib.Path, db_file: str, nvd: SyntheticNvd) -> pathlib.Path:
+    """
+    Writes the records of nvd into a new vulnerability database, page by page like create_database does, and marks
+    both sources as downloaded.
+
+    :return: The path of the database file.
+    """
+    db = VulnerabilityDatabase(cache_dir, db_file, api_key="none")
+    db._enable_bulk_ingest()
+    for src_name, records, write, page_size in (
+        ("cve", nvd.iter_cves(), db._process_cve_data_, CVE_RECORD_PER_PAGE),
+        ("cpe", nvd.iter_cpes(), db._process_cpe_data_, CPE_RECORD_PER_PAGE),
+    ):
+        make_page = make_cve_page if src_name == "cve" else make_cpe_page
+        page = []
+        for record in records:
+            page.append(record)
+            if len(page) == page_size:
+                write(make_page(page))
+                db.con.commit()
+                page = []
+        if page:
+            write(make_page(page))
+
+        db._set_status_value(f"initial_{src_name}_download_completed", True, commit=False)
+        db._set_status_value(f"{src_name}_last_updated", NVD_TIMESTAMP, commit=False)
+        db.con.commit()
+
+    db._finish_bulk_ingest()
+    db_path = db.db_path
+    db.con.close()
+    db.con = None
+
+    return db_path
+
+
+def write_yocto_sbom(
+    directory: pathlib.Path, nvd: SyntheticNvd, num_packages: int, seed: int = DEFAULT_SEED, cpe_ratio: float = 0.7
+) -> pathlib.Path:
+    """
+    Writes num_packages SPDX 2.3 JSON documents of one package each, named recipe-<name>.spdx.json like Yocto's.
+
+    :param nvd: The products the recipes are drawn from. A tenth of the recipes are not known to NVD.
+    :param cpe_ratio: Fraction of the recipes whose packages carry a CPE reference, the others are matched by name.
+    :return: The directory.
+    """
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+
+    written = 0
+    recipe = 0
+    used_products = set()
+    while written < num_packages:
+        if rng.random() < 0.1:
+            vendor, product, version = None, f"{_word(rng)}-files{recipe}", "1.0"
+        else:
+            vendor, product, versions = nvd.products[min(int(rng.paretovariate(0.6)) - 1, nvd.num_products - 1)]
+            version = rng.choice(versions)
+        has_cpe = vendor is not None and rng.random() < cpe_ratio
+        # Recipes are drawn with repetition, package names have to be unique within the image.
+        recipe_name = f"{product}{recipe}" if product in used_products else product
+        used_products.add(product)
+
+        for suffix in YOCTO_PACKAGE_SUFFIXES[: rng.randint(1, len(YOCTO_PACKAGE_SUFFIXES))]:
+            if written == num_packages:
+                break
+
+            name = f"{recipe_name}{suffix}"
+            package = {
+                "SPDXID": f"SPDXRef-Package-{written}",
+                "name": name,
+                "versionInfo": f"{version}-r0",
+                "downloadLocation": "NOASSERTION",
+                "licenseDeclared": "MIT",
+                "supplier": "Organization: OpenEmbedded ()",
+            }
+            if has_cpe:
+                # Yocto leaves the vendor out unless CVE_PRODUCT names it.
+                cpe_vendor = vendor if rng.random() < 0.5 else "*"
+                package["externalRefs"] = [
+                    {
+                        "referenceCategory": "SECURITY",
+                        "referenceType": "http://spdx.org/rdf/references/cpe23Type",
+                        "referenceLocator": f"cpe:2.3:a:{cpe_vendor}:{product}:{version}:*:*:*:*:*:*:*",
+                    }
+                ]
+
+            document = {
+                "spdxVersion": "SPDX-2.3",
+                "dataLicense": "CC0-1.0",
+                "SPDXID": "SPDXRef-DOCUMENT",
+                "name": f"recipe-{name}",
+                "documentNamespace": f"http://spdx.org/spdxdocs/recipe-{name}-{written}",
+                "creationInfo": {"created": created, "creators": ["Tool: OpenEmbedded Core create-spdx.bbclass"]},
+                "packages": [package],
+            }
+            (directory / f"recipe-{name}.spdx.json").write_text(json.dumps(document))
+            written += 1
+
+        recipe += 1
+
+    return directory
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8)))
+
+
+def _versions(rng: random.Random) -> list[str]:
+    major = rng.randint(0, 5)
+    versions = set()
+    while len(versions) < 12:
+        versions.add(f"{major + rng.randint(0, 2)}.{rng.randint(0, 20)}.{rng.randint(0, 30)}")
+    return sorted(versions, key=lambda version: tuple(int(part) for part in version.split(".")))
+
+
+def _cpe_match(rng: random.Random, vendor: str, product: str, versions: list[str]) -> dict:
+    criteria = f"cpe:2.3:a:{vendor}:{product}:{{}}:*:*:*:*:*:*:*"
+    first, last = sorted(rng.sample(range(len(versions)), 2))
+    kind = rng.random()
+    if kind < 0.45:
+        return {"vulnerable": True, "criteria": criteria.format("*"), "versionEndExcluding": versions[last]}
+    if kind < 0.65:
+        return {
+            "vulnerable": True,
+            "criteria": criteria.format("*"),
+            "versionStartIncluding": versions[first],
+            "versionEndExcluding": versions[last],
+        }
+    if kind < 0.8:
+        return {"vulnerable": True, "criteria": criteria.format(versions[last])}
+    if kind < 0.9:
+        return {"vulnerable": True, "criteria": criteria.format("*"), "versionEndIncluding": versions[last]}
+
+    return {"vulnerable": True, "criteria": criteria.format("*")}
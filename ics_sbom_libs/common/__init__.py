@@ -1,4 +1,4 @@
 # SPDX-License-Identifier: MIT
 # SPDX-FileCopyrightText: Copyright 2024 Ics inc.
 
-__all__ = ["ratelimiter", "dbproperties", "logging_setup", "vulnerability"]
+__all__ = ["ratelimiter", "dbproperties", "logging_setup", "vulnerability", "memory_profile"]
@@ -2,6 +2,8 @@
 # SPDX-FileCopyrightText: 2024 Ics inc.
 # SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
 
+from urllib.parse import unquote, urlsplit
+
 
 class DBProperties:
     def __init__(
@@ -24,6 +26,25 @@ class DBProperties:
 
         self._update_connection_string()
 
+    @classmethod
+    def from_connection_string(cls, connection_string: str):
+        """
+        Creates the properties from a connection string in the format built by connection_string.
+        """
+        parts = urlsplit(connection_string)
+        props = cls(
+            database_type=parts.scheme,
+            database_name=parts.path.lstrip("/"),
+            user_name=unquote(parts.username or ""),
+            password=unquote(parts.password or ""),
+        )
+        if parts.hostname:
+            props.host_name = parts.hostname
+        if parts.port:
+            props.host_port = str(parts.port)
+
+        return props
+
     @property
     def database_type(self):
         return self._db_type
@@ -0,0 +1,239 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Opt-in accounting of the memory used by the phases of an SBOM import and of a scan.
+
+The import and the matcher mark their phases with memory_phase(name). Nothing is measured unless a MemoryProfile is
+active:
+
+    with profiling(MemoryProfile()) as profile:
+        document = parse_anything(sbom_path)
+        matcher.process()
+    print(profile.to_json(indent=2))
+
+For every phase the profile keeps the highest memory use above the memory in use when the phase started (peak) and
+what the phase left allocated when it ended (retained). A phase that runs several times, like the parsing of every
+file of a directory, adds up its retained memory and keeps its largest peak. Phases may nest, an outer phase's peak
+includes those of the phases it contains.
+
+Two ways of measuring are available:
+
+- tracemalloc: the Python allocations, exact and attributable to source lines (see top_allocations) but several
+  times slower.
+- rss: the resident memory of the process, sampled by a background thread, which includes memory allocated outside
+  of Python (SQLite, mapped snapshots) but misses peaks shorter than the sampling interval. Needs /proc/self/statm.
+
+Only this process is measured, the memory of matcher worker processes is not.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import tracemalloc
+
+from typing import Final
+
+__all__ = ["MEMORY_MODES", "MemoryProfile", "PhaseMemory", "profiling", "current_profile", "memory_phase"]
+
+MEMORY_MODES: Final = ("tracemalloc", "rss")
+# Seconds between two RSS samples.
+RSS_SAMPLE_INTERVAL_SEC: Final = 0.01
+# Stack frames kept per allocation with top_allocations, the innermost is the reported source line.
+TRACEMALLOC_FRAMES: Final = 1
+
+_active: "MemoryProfile | None" = None
+_not_profiling = contextlib.nullcontext()
+
+
+def _current_rss() -> int | None:
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PhaseMemory:
+    """
+    The memory accounting of one phase, in bytes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.peak_bytes = 0
+        self.retained_bytes = 0
+        # The highest memory use of the process seen during the phase.
+        self.max_in_use_bytes = 0
+        # Source lines that retained the most memory in the last run of the phase, with top_allocations.
+        self.top_allocations: list[tuple[str, int]] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "peak_bytes": self.peak_bytes,
+            "retained_bytes": self.retained_bytes,
+            "max_in_use_bytes": self.max_in_use_bytes,
+            "top_allocations": [{"location": location, "bytes": size} for location, size in self.top_allocations],
+        }
+
+
+class _RunningPhase:
+    __slots__ = ("name", "start", "peak", "snapshot")
+
+    def __init__(self, name: str, start: int, snapshot):
+        self.name = name
+        self.start = start
+        self.peak = start
+        self.snapshot = snapshot
+
+
+class MemoryProfile:
+    """
+    Peak and retained memory of every phase run while the profile is active, see profiling().
+    """
+
+    def __init__(self, mode: str = "tracemalloc", sample_interval: float = RSS_SAMPLE_INTERVAL_SEC, top_allocations=0):
+        """
+        :param mode: How memory is measured, tracemalloc or rss.
+        :param sample_interval: Seconds between two samples of the rss mode.
+        :param top_allocations: With tracemalloc, the number of source lines that retained the most memory kept per
+                                phase. Every phase then takes two snapshots, which is slow for phases that run often.
+        """
+        if mode not in MEMORY_MODES:
+            raise ValueError(f"Unknown memory profile mode {mode}, expected one of {', '.join(MEMORY_MODES)}")
+
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.top_allocations = top_allocations if mode == "tracemalloc" else 0
+        self.phases: dict[str, PhaseMemory] = {}
+
+        self._running: list[_RunningPhase] = []
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        self._sampler: threading.Thread | None = None
+        self._stop_sampling = threading.Event()
+
+    def start(self):
+        if self.mode == "tracemalloc":
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+            return
+
+        if _current_rss() is None:
+            raise RuntimeError("Sampling the resident memory needs /proc/self/statm.")
+
+        self._stop_sampling.clear()
+        self._sampler = threading.Thread(target=self._sample_rss, name="memory-profile", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def _sample_rss(self):
+        while not self._stop_sampling.wait(self.sample_interval):
+            self._observe(_current_rss() or 0)
+
+    def _observe(self, in_use: int):
+        with self._lock:
+            for running in self._running:
+                running.peak = max(running.peak, in_use)
+
+    def _in_use(self) -> tuple[int, int]:
+        """
+        The memory in use now and the highest use since the last call, starting a new peak.
+        """
+        if self.mode == "tracemalloc":
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            return current, peak
+
+        current = _current_rss() or 0
+        return current, current
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Accounts the memory of the with block to the phase.
+        """
+        # Taken first, the snapshot itself is not accounted to the phase.
+        snapshot = tracemalloc.take_snapshot() if self.top_allocations else None
+        current, peak = self._in_use()
+        self._observe(peak)
+        running = _RunningPhase(name, current, snapshot)
+        with self._lock:
+            self._running.append(running)
+
+        try:
+            yield
+        finally:
+            current, peak = self._in_use()
+            self._observe(peak)
+            with self._lock:
+                self._running.remove(running)
+                for outer in self._running:
+                    outer.peak = max(outer.peak, running.peak)
+
+            self._record(running, current)
+
+    def _record(self, running: _RunningPhase, end: int):
+        phase = self.phases.get(running.name)
+        if phase is None:
+            phase = self.phases[running.name] = PhaseMemory(running.name)
+
+        phase.calls += 1
+        phase.peak_bytes = max(phase.peak_bytes, running.peak - running.start)
+        phase.retained_bytes += end - running.start
+        phase.max_in_use_bytes = max(phase.max_in_use_bytes, running.peak)
+        if running.snapshot is not None:
+            differences = tracemalloc.take_snapshot().compare_to(running.snapshot, "lineno")
+            phase.top_allocations = [
+                (f"{difference.traceback[0].filename}:{difference.traceback[0].lineno}", difference.size_diff)
+                for difference in differences[: self.top_allocations]
+            ]
+
+    def to_dict(self) -> dict:
+        return {"mode": self.mode, "phases": {name: phase.to_dict() for name, phase in self.phases.items()}}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def current_profile() -> MemoryProfile | None:
+    return _active
+
+
+@contextlib.contextmanager
+def profiling(profile: MemoryProfile):
+    """
+    Makes profile the active profile of the process for the with block.
+    """
+    global _active
+
+    previous = _active
+    profile.start()
+    _active = profile
+    try:
+        yield profile
+    finally:
+        _active = previous
+        profile.stop()
+
+
+def memory_phase(name: str):
+    """
+    Accounts the memory of the with block to the phase of the active profile, if there is one.
+    """
+    profile = _active
+    return profile.phase(name) if profile is not None else _not_profiling
@@ -2,65 +2,147 @@
 # SPDX-FileCopyrightText: 2018 Quentin Pradet https://gist.github.com/pquentin/5d8f5408cdad73e589d85ba509091741
 
 import asyncio
+import email.utils
+import random
+import threading
 import time
 
-import aiohttp
-
-START = time.monotonic()
+from collections.abc import Mapping
 
 
 class RateLimiter:
     """Rate limits an HTTP client that would make get() and post() calls.
 
-    Calls are rate-limited by host.
     https://quentin.pradet.me/blog/how-do-you-rate-limit-calls-with-aiohttp.html
-    This class is not thread-safe."""
+
+    At most max_tokens + rate * t requests are made in any t seconds. A request reserves a token and waits until the
+    bucket has refilled up to it, so waiting costs no polling and the limiter can be shared by threads and event
+    loops: acquire() waits in a coroutine, acquire_blocking() in a thread.
+
+    The rate adapts to the server. backoff() halves it and holds every request for the server's Retry-After when a
+    request was throttled, recover() brings it back to the configured rate step by step as requests succeed."""
 
     RATE = 1  # one request per second
     MAX_TOKENS = 10
-
-    def __init__(self, client):
+    # Statuses the server uses to ask clients to slow down, answered by lowering the rate.
+    THROTTLE_STATUS = frozenset({403, 429, 503})
+    # Fraction of the configured rate given back for every request that succeeds.
+    RECOVERY_STEP = 0.1
+    # The rate is never lowered below this fraction of the configured rate.
+    MIN_RATE_FACTOR = 1 / 16
+
+    def __init__(
+        self,
+        client=None,
+        rate: float = RATE,
+        max_tokens: int = MAX_TOKENS,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 300.0,
+    ):
+        """
+        :param client: The HTTP client get() forwards to, e.g. an aiohttp.ClientSession.
+        :param rate: Tokens added per second.
+        :param max_tokens: Size of the bucket, the number of requests that may be made at once.
+        :param retry_delay: Delay before the first retry of a failed request, doubled for every following retry.
+        :param max_retry_delay: Upper bound of the retry delay.
+        """
         self.client = client
-        self.tokens = self.MAX_TOKENS
+        self.max_rate = rate
+        self.rate = rate
+        self.max_tokens = max_tokens
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self.tokens = float(max_tokens)
         self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_window(cls, requests_per_window: int, window_sec: float, client=None, **kwargs) -> "RateLimiter":
+        """
+        Returns a limiter that never makes more than requests_per_window requests in any window of window_sec, the
+        way services with rolling window quotas count them. A tenth of the quota may be used as a burst, the rest is
+        spread evenly over the window.
+        """
+        max_tokens = max(1, requests_per_window // 10)
+        rate = max(requests_per_window - max_tokens, 1) / window_sec
+        return cls(client, rate=rate, max_tokens=max_tokens, **kwargs)
 
     async def get(self, *args, **kwargs):
-        await self.wait_for_token()
-        now = time.monotonic() - START
-        print(f"{now:.0f}s: ask {args[0]}")
+        await self.acquire()
         return self.client.get(*args, **kwargs)
 
-    async def wait_for_token(self):
-        while self.tokens < 1:
-            self.add_new_tokens()
-            await asyncio.sleep(0.1)
-        self.tokens -= 1
-
-    def add_new_tokens(self):
-        now = time.monotonic()
-        time_since_update = now - self.updated_at
-        new_tokens = time_since_update * self.RATE
-        if self.tokens + new_tokens >= 1:
-            self.tokens = min(self.tokens + new_tokens, self.MAX_TOKENS)
-            self.updated_at = now
-
-
-async def fetch_one(client, i):
-    url = f"https://httpbin.org/get?i={i}"
-    # Watch out for the extra 'await' here!
-    async with await client.get(url) as resp:
-        resp = await resp.json()
-        now = time.monotonic() - START
-        print(f"{now:.0f}s: got {resp['args']}")
-
-
-async def main():
-    async with aiohttp.ClientSession() as client:
-        client = RateLimiter(client)
-        tasks = [asyncio.ensure_future(fetch_one(client, i)) for i in range(20)]
-        await asyncio.gather(*tasks)
-
-
-if __name__ == "__main__":
-    # Requires Python 3.7+
-    asyncio.run(main())
+    async def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _reserve(self) -> float:
+        """
+        Takes a token, possibly one the bucket has not refilled yet, and returns the seconds until it is available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.add_new_tokens(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def add_new_tokens(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.max_tokens)
+        self.updated_at = now
+
+    def backoff(self, attempt: int, status: int | None = None, headers: Mapping | None = None) -> float:
+        """
+        Returns how long to wait before retrying a failed request, exponential in attempt (counted from 0) with
+        jitter, or the server's Retry-After. A throttling status also lowers the rate, and holds every other request
+        of the limiter for the same time.
+        """
+        delay = retry_after(headers) if headers is not None else None
+        if delay is None:
+            delay = min(self.retry_delay * 2**attempt, self.max_retry_delay)
+            delay *= random.uniform(0.5, 1.0)
+
+        if status in self.THROTTLE_STATUS:
+            with self._lock:
+                self.add_new_tokens()
+                self.rate = max(self.rate / 2, self.max_rate * self.MIN_RATE_FACTOR)
+                self.tokens = min(self.tokens, 0.0)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+        return delay
+
+    def recover(self):
+        """
+        Records a successful request, raising a lowered rate back towards the configured one.
+        """
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.add_new_tokens()
+                self.rate = min(self.rate + self.max_rate * self.RECOVERY_STEP, self.max_rate)
+
+
+def retry_after(headers: Mapping) -> float | None:
+    """
+    Returns the seconds a Retry-After header asks to wait, given either as seconds or as an HTTP date.
+    """
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import json
+import tracemalloc
+import unittest
+
+from ics_sbom_libs.common.memory_profile import MemoryProfile, _current_rss, current_profile, memory_phase, profiling
+
+MEGABYTE = 1024 * 1024
+
+
+class TestMemoryProfile(unittest.TestCase):
+    def test_peak_and_retained(self):
+        kept = []
+        with profiling(MemoryProfile(top_allocations=3)) as profile:
+            self.assertIs(current_profile(), profile)
+            with memory_phase("outer"):
+                with memory_phase("inner"):
+                    temporary = bytearray(8 * MEGABYTE)
+                    del temporary
+                for _ in range(2):
+                    with memory_phase("kept"):
+                        kept.append(bytearray(2 * MEGABYTE))
+
+        self.assertIsNone(current_profile())
+        self.assertFalse(tracemalloc.is_tracing())
+
+        inner, outer, repeated = profile.phases["inner"], profile.phases["outer"], profile.phases["kept"]
+        self.assertGreaterEqual(inner.peak_bytes, 8 * MEGABYTE)
+        self.assertLess(inner.retained_bytes, MEGABYTE)
+        # The outer phase saw the peak of the inner one and keeps what its nested phases retained.
+        self.assertGreaterEqual(outer.peak_bytes, inner.peak_bytes)
+        self.assertGreaterEqual(outer.retained_bytes, 4 * MEGABYTE)
+
+        self.assertEqual(repeated.calls, 2)
+        self.assertGreaterEqual(repeated.retained_bytes, 4 * MEGABYTE)
+        self.assertLess(repeated.peak_bytes, 3 * MEGABYTE)
+        self.assertIn("test_memory_profile.py", repeated.top_allocations[0][0])
+
+        values = json.loads(profile.to_json())
+        self.assertEqual(values["mode"], "tracemalloc")
+        self.assertEqual(list(values["phases"]), ["inner", "kept", "outer"])
+
+    def test_inactive(self):
+        self.assertIsNone(current_profile())
+        with memory_phase("nothing"):
+            pass
+
+        with self.assertRaises(ValueError):
+            MemoryProfile("valgrind")
+
+    @unittest.skipIf(_current_rss() is None, "needs /proc/self/statm")
+    def test_rss(self):
+        with profiling(MemoryProfile("rss", sample_interval=0.001)) as profile:
+            with memory_phase("rss"):
+                data = bytes(32 * MEGABYTE)
+
+        phase = profile.phases["rss"]
+        self.assertEqual(phase.calls, 1)
+        self.assertGreater(phase.max_in_use_bytes, len(data))
+        self.assertEqual(phase.top_allocations, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
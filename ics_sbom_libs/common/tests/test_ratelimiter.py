@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import unittest
+
+from email.utils import formatdate
+
+from ics_sbom_libs.common.ratelimiter import RateLimiter, retry_after
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_window_quota(self):
+        limiter = RateLimiter.for_window(50, 30)
+        self.assertEqual(limiter.max_tokens, 5)
+        # The burst plus what is refilled over a window never exceeds the quota.
+        self.assertLessEqual(limiter.max_tokens + limiter.rate * 30, 50)
+
+        waits = [limiter._reserve() for _ in range(7)]
+        self.assertEqual(waits[:5], [0.0] * 5)
+        self.assertAlmostEqual(waits[5], 1 / limiter.rate, places=2)
+        self.assertAlmostEqual(waits[6], 2 / limiter.rate, places=2)
+
+    def test_backoff_and_recover(self):
+        limiter = RateLimiter(rate=10, max_tokens=10, retry_delay=2)
+        self.assertLessEqual(limiter.backoff(2), 8)
+        self.assertEqual(limiter.rate, 10)
+
+        self.assertEqual(limiter.backoff(0, 503, {"Retry-After": "3"}), 3)
+        self.assertEqual(limiter.rate, 5)
+        self.assertGreater(limiter._reserve(), 2.9)
+
+        for _ in range(5):
+            limiter.recover()
+        self.assertEqual(limiter.rate, 10)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after({"Retry-After": "12"}), 12)
+        self.assertIsNone(retry_after({}))
+        self.assertIsNone(retry_after({"Retry-After": "soon"}))
+        self.assertAlmostEqual(retry_after({"Retry-After": formatdate(usegmt=True)}), 0, delta=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,4 @@
 # SPDX-License-Identifier: MIT
 # SPDX-FileCopyrightText: Copyright 2024 Ics inc.
 
-__all__ = ["vulnerabilitydatabase"]
+__all__ = ["vulnerabilitydatabase", "connection_registry", "cve_detail_codec", "storage_backend", "match_snapshot"]
@@ -0,0 +1,134 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Read only VulnerabilityDatabase connections that live for the whole life of a worker.
+
+The matchers look up the database once per package and once per CPE. Opening a new VulnerabilityDatabase for each
+of those calls means a new sqlite3 connection, directory checks and reading the API key from disk every time. The
+registry opens one read only connection per database path and thread and hands it out to every following call. Pass
+``init_worker`` as the initializer of a process or thread pool to open the connections as soon as a worker starts.
+
+The connections of the threads that ended are closed by ``close_ended_threads``, when a thread pool is shut down
+and before a new connection is opened. That returns those of a PostgreSQL database to the connection pool. A thread
+pool working on a PostgreSQL database calls ``reserve_connections`` first, so that the pool has a connection for
+every worker.
+"""
+
+import os
+import pathlib
+import threading
+
+from ics_sbom_libs.common.dbproperties import DBProperties
+from ics_sbom_libs.cve_fetch import storage_backend
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+__all__ = ["get_database", "init_worker", "close_databases", "close_ended_threads", "reserve_connections"]
+
+_local = threading.local()
+
+# Connections inherited through fork() belong to the parent. SQLite must not use (or close) them in the child, so
+# they are only kept alive here.
+_inherited: list[VulnerabilityDatabase] = []
+
+# The databases of every thread of the process, to close those of the threads that ended.
+_threads: list[tuple[threading.Thread, dict[str, VulnerabilityDatabase]]] = []
+_threads_pid = os.getpid()
+_threads_lock = threading.Lock()
+
+
+def _databases() -> dict[str, VulnerabilityDatabase]:
+    databases = getattr(_local, "databases", None)
+    if databases is None or _local.pid != os.getpid():
+        if databases:
+            _inherited.extend(databases.values())
+        databases = _local.databases = {}
+        _local.pid = os.getpid()
+        with _threads_lock:
+            _threads.append((threading.current_thread(), databases))
+
+    return databases
+
+
+def close_ended_threads():
+    """
+    Closes the databases of the threads that ended, like the workers of a thread pool that was shut down.
+    """
+    global _threads_pid
+
+    with _threads_lock:
+        if _threads_pid != os.getpid():
+            for _, databases in _threads:
+                _inherited.extend(databases.values())
+            _threads.clear()
+            _threads_pid = os.getpid()
+
+        ended = [databases for thread, databases in _threads if not thread.is_alive()]
+        _threads[:] = [(thread, databases) for thread, databases in _threads if thread.is_alive()]
+
+    for databases in ended:
+        for db in databases.values():
+            if db.con:
+                db.con.close()
+                db.con = None
+        databases.clear()
+
+
+def get_database(db_path: pathlib.Path | str | DBProperties, immutable: bool = False) -> VulnerabilityDatabase:
+    """
+    Returns the read only database of the current thread for the given path, opening it on first use.
+
+    :param db_path: Path of the database file, or the DBProperties of a PostgreSQL database. The connections to a
+                    server come from the connection pool of the process.
+    :param immutable: Open the database with immutable=1 when it is not open yet. SQLite then skips all locking and
+                      change detection, so the file must not change for as long as the connection is kept, which for
+                      a pool worker is its whole life.
+    """
+    databases = _databases()
+
+    key = db_path.connection_string if isinstance(db_path, DBProperties) else str(db_path)
+    db = databases.get(key)
+    if db is None:
+        close_ended_threads()
+        if isinstance(db_path, DBProperties):
+            db = VulnerabilityDatabase(api_key="none", read_only=True, db_properties=db_path)
+        else:
+            db_path = pathlib.Path(db_path)
+            db = VulnerabilityDatabase(
+                db_path.parent, db_path.name, api_key="none", read_only=True, immutable=immutable
+            )
+        databases[key] = db
+
+    return db
+
+
+def init_worker(*db_paths: pathlib.Path | str | DBProperties, immutable: bool = False):
+    """
+    Process or thread pool initializer that opens the databases of the worker up front.
+    """
+    for db_path in db_paths:
+        get_database(db_path, immutable)
+
+
+def reserve_connections(db_path: pathlib.Path | str | DBProperties, workers: int):
+    """
+    Makes sure the workers of a thread pool can each keep a connection to the database. Only PostgreSQL databases
+    have a limit.
+    """
+    if isinstance(db_path, DBProperties):
+        storage_backend.reserve_connections(db_path, workers)
+
+
+def close_databases():
+    """
+    Closes every database opened by the current thread.
+    """
+    databases = _databases()
+
+    for db in databases.values():
+        if db.con:
+            db.con.close()
+            db.con = None
+
+    databases.clear()
@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+zstd compression of the CVE descriptions and configurations kept in the cve_detail table.
+
+Most descriptions are only a few hundred bytes long, too short for zstd to find much to reuse within a single value.
+The first large batch written to a database is therefore used to train a dictionary, which is stored in the
+cve_detail_dict table and used for every value compressed after it. Each cve_detail row records the dictionary it
+was compressed with (NULL for none), so values stay readable when a later dictionary is added.
+"""
+
+import logging
+import sqlite3
+import sys
+
+from typing import Final
+
+if sys.version_info >= (3, 14):
+    from compression import zstd
+else:
+    from backports import zstd
+
+log = logging.getLogger(__name__)
+
+DETAIL_COMPRESSION_LEVEL: Final = 9
+DETAIL_DICT_SIZE: Final = 64 * 1024
+# Training needs enough samples to produce a useful dictionary, smaller batches are compressed without one.
+DETAIL_DICT_MIN_SAMPLES: Final = 1000
+
+
+class CveDetailCodec:
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+        self._dicts: dict[int, zstd.ZstdDict] = {}
+        self.dict_id: int | None = None
+
+        try:
+            row = self.con.execute("SELECT id, dict FROM cve_detail_dict ORDER BY id DESC LIMIT 1").fetchone()
+        except sqlite3.Error:
+            row = None
+
+        if row:
+            self.dict_id = row[0]
+            self._dicts[row[0]] = zstd.ZstdDict(bytes(row[1]))
+
+    def _get_dict(self, dict_id: int | None) -> zstd.ZstdDict | None:
+        if dict_id is None:
+            return None
+
+        if dict_id not in self._dicts:
+            row = self.con.execute("SELECT dict FROM cve_detail_dict WHERE id=?", (dict_id,)).fetchone()
+            self._dicts[dict_id] = zstd.ZstdDict(bytes(row[0]))
+
+        return self._dicts[dict_id]
+
+    def train(self, samples: list[str]):
+        """
+        Trains a dictionary from the samples and stores it, unless the database already has one or there are too
+        few samples. The caller commits.
+        """
+        if self.dict_id is not None or len(samples) < DETAIL_DICT_MIN_SAMPLES:
+            return
+
+        try:
+            zstd_dict = zstd.train_dict([sample.encode() for sample in samples], DETAIL_DICT_SIZE)
+        except zstd.ZstdError as e:
+            log.info(f"Compressing CVE details without a dictionary: {e}")
+            return
+
+        self.con.execute("INSERT INTO cve_detail_dict (dict) VALUES (?)", (zstd_dict.dict_content,))
+        self.dict_id = self.con.execute("SELECT MAX(id) FROM cve_detail_dict").fetchone()[0]
+        self._dicts[self.dict_id] = zstd_dict
+
+    def compress(self, text: str | None) -> bytes | None:
+        """
+        Compresses a value with the current dictionary, dict_id has to be stored with the result.
+        """
+        if text is None:
+            return None
+
+        return zstd.compress(text.encode(), level=DETAIL_COMPRESSION_LEVEL, zstd_dict=self._get_dict(self.dict_id))
+
+    def decompress(self, data: bytes | None, dict_id: int | None) -> str | None:
+        if data is None:
+            return None
+
+        # PostgreSQL returns the bytea values as memoryview.
+        return zstd.decompress(bytes(data), zstd_dict=self._get_dict(dict_id)).decode()
+
+    def write(self, curs: sqlite3.Cursor, details: list[tuple[str, str | None, str | None]]):
+        """
+        Stores (cve_number, description, configurations) rows, training the dictionary first if there is none yet.
+        """
+        if not details:
+            return
+
+        self.train([text for _, *texts in details for text in texts if text])
+
+        curs.executemany(
+            "INSERT INTO cve_detail (cve_number, dict_id, description, configurations) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (cve_number) DO UPDATE SET dict_id=excluded.dict_id, description=excluded.description, "
+            "configurations=excluded.configurations",
+            [
+                (cve_number, self.dict_id, self.compress(description), self.compress(configurations))
+                for cve_number, description, configurations in details
+            ],
+        )
@@ -9,35 +9,72 @@
 -- v2.0  : Added "vulnerable" to the "cve_range" table.
 -- v3.0  : Added the CPE dictionary table.
 -- v4.0  : Added configurations field to the cve_severity table.
+-- v4.1  : Added indexes for the product/vendor lookups of cve_range and the product lookups of cpe_dictionary.
+--         From here on existing databases are upgraded in place by the migrations in vulnerabilitydatabase.py.
+-- v4.2  : Moved the ranges to "cve_range_entry" with integer keys into the "cpe_vendor" and "cpe_product" tables.
+--         "cve_range" is now a view with the old columns.
+-- v4.3  : Moved the description and configurations of a CVE to the zstd compressed "cve_detail" table.
 BEGIN TRANSACTION;
-DROP TABLE IF EXISTS "cve_range";
-CREATE TABLE IF NOT EXISTS "cve_range" (
+DROP VIEW IF EXISTS "cve_range";
+DROP TABLE IF EXISTS "cpe_vendor";
+CREATE TABLE IF NOT EXISTS "cpe_vendor" (
+	"id"	integer NOT NULL,
+	"name"	text NOT NULL UNIQUE,
+	PRIMARY KEY("id")
+);
+DROP TABLE IF EXISTS "cpe_product";
+CREATE TABLE IF NOT EXISTS "cpe_product" (
+	"id"	integer NOT NULL,
+	"name"	text NOT NULL UNIQUE,
+	PRIMARY KEY("id")
+);
+DROP TABLE IF EXISTS "cve_range_entry";
+CREATE TABLE IF NOT EXISTS "cve_range_entry" (
 	"id"	                integer NOT NULL,
 	"cve_number"            text NOT NULL,
-	"vendor"	            text,
-	"product"	            text,
+	"vendor_id"	            integer NOT NULL REFERENCES cpe_vendor(id),
+	"product_id"	        integer NOT NULL REFERENCES cpe_product(id),
 	"version"	            text,
 	"part_type"	            text,
-	"cpe"		            text,
+	"cpe_tail"	            text,
 	"vulnerable"            integer,
 	"versionStartIncluding"	text,
 	"versionStartExcluding"	text,
 	"versionEndIncluding"	text,
 	"versionEndExcluding"	text,
-	"data_source"	        text,
-	PRIMARY KEY("id" AUTOINCREMENT)
+	PRIMARY KEY("id")
 );
+-- The cpe column is rebuilt from its parts, cpe_tail is NULL when every field after the version is '*'.
+CREATE VIEW IF NOT EXISTS "cve_range" AS
+SELECT r.id, r.cve_number, v.name AS vendor, p.name AS product, r.version, r.part_type,
+	'cpe:2.3:' || r.part_type || ':' || v.name || ':' || p.name || ':' || r.version || ':'
+		|| COALESCE(r.cpe_tail, '*:*:*:*:*:*:*') AS cpe,
+	r.vulnerable, r.versionStartIncluding, r.versionStartExcluding, r.versionEndIncluding, r.versionEndExcluding,
+	'NVD' AS data_source
+FROM cve_range_entry r JOIN cpe_vendor v ON v.id = r.vendor_id JOIN cpe_product p ON p.id = r.product_id;
 DROP TABLE IF EXISTS "cve_severity";
 CREATE TABLE IF NOT EXISTS "cve_severity" (
 	"cve_number"	text NOT NULL,
 	"severity"	    text,
-	"description"	text,
 	"score"	        integer,
 	"cvss_version"	real,
 	"cvss_vector"	text,
 	"data_source"	text,
 	"last_modified"	datetime,
-	"configurations" text,
+	PRIMARY KEY("cve_number")
+);
+DROP TABLE IF EXISTS "cve_detail_dict";
+CREATE TABLE IF NOT EXISTS "cve_detail_dict" (
+	"id"	integer NOT NULL,
+	"dict"	blob NOT NULL,
+	PRIMARY KEY("id")
+);
+DROP TABLE IF EXISTS "cve_detail";
+CREATE TABLE IF NOT EXISTS "cve_detail" (
+	"cve_number"	    text NOT NULL,
+	"dict_id"	        integer REFERENCES cve_detail_dict(id),
+	"description"	    blob,
+	"configurations"    blob,
 	PRIMARY KEY("cve_number")
 );
 DROP TABLE IF EXISTS "cve_weakness";
@@ -54,7 +91,7 @@ CREATE TABLE IF NOT EXISTS "status" (
     "value" text NOT NULL,
 	UNIQUE(key) ON CONFLICT REPLACE
 );
-INSERT INTO "status" ("key", "value") VALUES ("version", "3.0");
+INSERT INTO "status" ("key", "value") VALUES ("version", "4.3");
 DROP TABLE IF EXISTS "cpe_dictionary";
 CREATE TABLE IF NOT EXISTS "cpe_dictionary" (
     "cpe_id"        text NOT NULL,
@@ -66,5 +103,7 @@ CREATE TABLE IF NOT EXISTS "cpe_dictionary" (
     "last_modified" datetime,
     PRIMARY KEY("cpe_id")
 );
-CREATE INDEX IF NOT EXISTS product_index ON cve_range (cve_number, vendor, product);
+CREATE INDEX IF NOT EXISTS cve_range_entry_cve_index ON cve_range_entry (cve_number);
+CREATE INDEX IF NOT EXISTS cve_range_entry_product_vendor_index ON cve_range_entry (product_id, vendor_id);
+CREATE INDEX IF NOT EXISTS cpe_dictionary_product_index ON cpe_dictionary (product, deprecated);
 COMMIT;
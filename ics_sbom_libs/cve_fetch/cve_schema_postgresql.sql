@@ -0,0 +1,88 @@
+-- SPDX-License-Identifier: LGPL-2.0-or-later
+-- SPDX-FileCopyrightText: 2024 Ics inc.
+-- SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+-- PostgreSQL version of cve_schema.sql, see that file for the version history. The tables and columns have the same
+-- names so VulnerabilityDatabase can use the same queries for both. Dates are kept as text, like SQLite returns them.
+-- The mixed case columns are not quoted, PostgreSQL folds them to lower case in the table and in every query.
+BEGIN;
+CREATE TABLE IF NOT EXISTS "cpe_vendor" (
+	"id"	integer GENERATED BY DEFAULT AS IDENTITY,
+	"name"	text NOT NULL UNIQUE,
+	PRIMARY KEY("id")
+);
+CREATE TABLE IF NOT EXISTS "cpe_product" (
+	"id"	integer GENERATED BY DEFAULT AS IDENTITY,
+	"name"	text NOT NULL UNIQUE,
+	PRIMARY KEY("id")
+);
+CREATE TABLE IF NOT EXISTS "cve_range_entry" (
+	"id"	                bigint GENERATED BY DEFAULT AS IDENTITY,
+	"cve_number"            text NOT NULL,
+	"vendor_id"	            integer NOT NULL REFERENCES cpe_vendor(id),
+	"product_id"	        integer NOT NULL REFERENCES cpe_product(id),
+	"version"	            text,
+	"part_type"	            text,
+	"cpe_tail"	            text,
+	"vulnerable"            integer,
+	versionStartIncluding	text,
+	versionStartExcluding	text,
+	versionEndIncluding	text,
+	versionEndExcluding	text,
+	PRIMARY KEY("id")
+);
+CREATE OR REPLACE VIEW "cve_range" AS
+SELECT r.id, r.cve_number, v.name AS vendor, p.name AS product, r.version, r.part_type,
+	'cpe:2.3:' || r.part_type || ':' || v.name || ':' || p.name || ':' || r.version || ':'
+		|| COALESCE(r.cpe_tail, '*:*:*:*:*:*:*') AS cpe,
+	r.vulnerable, r.versionStartIncluding, r.versionStartExcluding, r.versionEndIncluding,
+	r.versionEndExcluding, 'NVD' AS data_source
+FROM cve_range_entry r JOIN cpe_vendor v ON v.id = r.vendor_id JOIN cpe_product p ON p.id = r.product_id;
+CREATE TABLE IF NOT EXISTS "cve_severity" (
+	"cve_number"	text NOT NULL,
+	"severity"	    text,
+	"score"	        double precision,
+	"cvss_version"	double precision,
+	"cvss_vector"	text,
+	"data_source"	text,
+	"last_modified"	text,
+	PRIMARY KEY("cve_number")
+);
+CREATE TABLE IF NOT EXISTS "cve_detail_dict" (
+	"id"	integer GENERATED BY DEFAULT AS IDENTITY,
+	"dict"	bytea NOT NULL,
+	PRIMARY KEY("id")
+);
+CREATE TABLE IF NOT EXISTS "cve_detail" (
+	"cve_number"	    text NOT NULL,
+	"dict_id"	        integer REFERENCES cve_detail_dict(id),
+	"description"	    bytea,
+	"configurations"    bytea,
+	PRIMARY KEY("cve_number")
+);
+CREATE TABLE IF NOT EXISTS "cve_weakness" (
+	"id"	        bigint GENERATED BY DEFAULT AS IDENTITY,
+	"cve_number"	text NOT NULL,
+	"value"	        text NOT NULL,
+	PRIMARY KEY("id"),
+	UNIQUE(cve_number, value)
+);
+CREATE TABLE IF NOT EXISTS "status" (
+    "key"   text NOT NULL,
+    "value" text NOT NULL,
+	UNIQUE(key)
+);
+INSERT INTO "status" ("key", "value") VALUES ('version', '4.3') ON CONFLICT (key) DO NOTHING;
+CREATE TABLE IF NOT EXISTS "cpe_dictionary" (
+    "cpe_id"        text NOT NULL,
+    "cpe"           text,
+    "vendor"	    text,
+	"product"	    text,
+    "deprecated"    integer,
+    "created"       text,
+    "last_modified" text,
+    PRIMARY KEY("cpe_id")
+);
+CREATE INDEX IF NOT EXISTS cve_range_entry_cve_index ON cve_range_entry (cve_number);
+CREATE INDEX IF NOT EXISTS cve_range_entry_product_vendor_index ON cve_range_entry (product_id, vendor_id);
+CREATE INDEX IF NOT EXISTS cpe_dictionary_product_index ON cpe_dictionary (product, deprecated);
+COMMIT;
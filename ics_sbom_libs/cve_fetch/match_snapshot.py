@@ -0,0 +1,271 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+A compact, memory mapped copy of what matching needs from the vulnerability database.
+
+The snapshot is a single file of unsigned 32 bit words followed by UTF-8 string data:
+
+    header      magic (2 words), format version, byte order mark, string count, product count, range count,
+                cve count, string index of the database content version
+    strings     string count + 1 offsets into the string data
+    products    (product, vendor, first range, range count) sorted by product then vendor
+    ranges      (cve, vulnerable, version, versionStartIncluding, versionStartExcluding, versionEndIncluding,
+                versionEndExcluding), grouped by product and vendor in cve_range order
+    cves        (cve, severity) sorted by CVE number
+    string data
+
+Every text value is stored once and referenced by its index, NULL values by 0xFFFFFFFF. Opening a snapshot only maps
+the file and lookups binary search the product table, so every process matching against the same snapshot shares the
+operating system's page cache instead of loading its own copy of the data.
+"""
+
+import mmap
+import os
+import pathlib
+import threading
+
+from array import array
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Final
+
+if TYPE_CHECKING:
+    from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+__all__ = ["MatchSnapshot", "write_match_snapshot", "snapshot_path_for", "open_snapshot", "ensure_match_snapshot"]
+
+SNAPSHOT_MAGIC: Final = (0x4D534349, 0x50414E53)  # "ICSMSNAP"
+SNAPSHOT_FORMAT_VERSION: Final = 1
+# Written in the native byte order, a snapshot is only read on the kind of machine that wrote it.
+_byte_order_mark: Final = 0x01020304
+_null: Final = 0xFFFFFFFF
+_header_words: Final = 9
+_product_words: Final = 4
+_range_words: Final = 7
+_cve_words: Final = 2
+
+
+def snapshot_path_for(db_path: pathlib.Path) -> pathlib.Path:
+    return db_path.parent / f"{db_path.stem}.match_snapshot"
+
+
+def write_match_snapshot(db: "VulnerabilityDatabase", snapshot_path: pathlib.Path) -> pathlib.Path:
+    """
+    Writes the snapshot of the database. The file is written next to its final path and moved in place, so readers
+    never see a partial snapshot.
+    """
+    strings: dict[str, int] = {}
+
+    def string_index(value) -> int:
+        if value is None:
+            return _null
+
+        value = str(value)
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    content_version = string_index(db.content_version)
+
+    # Duplicate rows are dropped like get_product_ranges() does, the dict keeps the cve_range order.
+    grouped: dict[tuple[str, str], dict[tuple, None]] = {}
+    for cve_number, vendor, product, vulnerable, *bounds in db.iter_cve_ranges() or []:
+        row = (string_index(cve_number), int(vulnerable or 0), *(string_index(value) for value in bounds))
+        grouped.setdefault((product, vendor), {})[row] = None
+
+    products = array("I")
+    ranges = array("I")
+    for product, vendor in sorted(grouped):
+        rows = grouped[(product, vendor)]
+        products.extend((string_index(product), string_index(vendor), len(ranges) // _range_words, len(rows)))
+        for row in rows:
+            ranges.extend(row)
+
+    cves = array("I")
+    for cve_number, severity in db.query_cache("SELECT cve_number, severity FROM cve_severity ORDER BY cve_number"):
+        cves.extend((string_index(cve_number), string_index(severity)))
+
+    data = bytearray()
+    offsets = array("I", [0])
+    for value in strings:
+        data += value.encode()
+        offsets.append(len(data))
+
+    header = array(
+        "I",
+        [
+            *SNAPSHOT_MAGIC,
+            SNAPSHOT_FORMAT_VERSION,
+            _byte_order_mark,
+            len(strings),
+            len(products) // _product_words,
+            len(ranges) // _range_words,
+            len(cves) // _cve_words,
+            content_version,
+        ],
+    )
+
+    snapshot_path = pathlib.Path(snapshot_path)
+    tmp_path = snapshot_path.with_name(f"{snapshot_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as fp:
+            for section in (header, offsets, products, ranges, cves):
+                section.tofile(fp)
+            fp.write(data)
+        os.replace(tmp_path, snapshot_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return snapshot_path
+
+
+class MatchSnapshot:
+    """
+    Read only view of a snapshot file. It can be shared by every thread of a process.
+    """
+
+    def __init__(self, snapshot_path: pathlib.Path):
+        self.snapshot_path = pathlib.Path(snapshot_path)
+
+        with open(self.snapshot_path, "rb") as fp:
+            self.file_id = _file_id(os.fstat(fp.fileno()))
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = memoryview(self._mm)[: _header_words * 4].cast("I")
+        magic, version, byte_order = tuple(header[0:2]), header[2], header[3]
+        self.string_count, self.product_count, self.range_count, self.cve_count = header[4:8]
+        self._content_version_index = header[8]
+        header.release()
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION or byte_order != _byte_order_mark:
+            self.close()
+            raise ValueError(f"{self.snapshot_path} is not a match snapshot this version can read.")
+
+        self._offsets_start = _header_words
+        self._products_start = self._offsets_start + self.string_count + 1
+        self._ranges_start = self._products_start + self.product_count * _product_words
+        self._cves_start = self._ranges_start + self.range_count * _range_words
+        data_start = (self._cves_start + self.cve_count * _cve_words) * 4
+
+        self._words = memoryview(self._mm)[:data_start].cast("I")
+        self._data = memoryview(self._mm)[data_start:]
+        self._strings: dict[int, str] = {}
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        for view in ("_words", "_data"):
+            if getattr(self, view, None) is not None:
+                getattr(self, view).release()
+                setattr(self, view, None)
+
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _string(self, index: int) -> str | None:
+        if index == _null:
+            return None
+
+        value = self._strings.get(index)
+        if value is None:
+            start = self._words[self._offsets_start + index]
+            end = self._words[self._offsets_start + index + 1]
+            value = self._strings[index] = str(self._data[start:end], "utf-8")
+        return value
+
+    @property
+    def content_version(self) -> str | None:
+        return self._string(self._content_version_index)
+
+    def _product(self, position: int) -> str:
+        return self._string(self._words[self._products_start + position * _product_words])
+
+    def _cve(self, position: int) -> str:
+        return self._string(self._words[self._cves_start + position * _cve_words])
+
+    def product_ranges(self, product: str, vendor: str = "*") -> list[tuple]:
+        """
+        Returns the ranges of a product as (cve_number, vulnerable, version, versionStartIncluding,
+        versionStartExcluding, versionEndIncluding, versionEndExcluding), the rows of
+        VulnerabilityDatabase.get_product_ranges().
+        """
+        words = self._words
+        rows = []
+        position = bisect_left(range(self.product_count), product, key=self._product)
+        while position < self.product_count and self._product(position) == product:
+            base = self._products_start + position * _product_words
+            position += 1
+            if vendor != "*" and self._string(words[base + 1]) != vendor:
+                continue
+
+            first, count = words[base + 2], words[base + 3]
+            for row in range(first, first + count):
+                start = self._ranges_start + row * _range_words
+                end = start + _range_words
+                cve, vulnerable, *bounds = words[start:end]
+                rows.append((self._string(cve), vulnerable, *(self._string(value) for value in bounds)))
+
+        return rows
+
+    def cve_severity(self, cve_number: str) -> str | None:
+        position = bisect_left(range(self.cve_count), cve_number, key=self._cve)
+        if position < self.cve_count and self._cve(position) == cve_number:
+            return self._string(self._words[self._cves_start + position * _cve_words + 1])
+
+        return None
+
+
+def _file_id(stat: os.stat_result) -> tuple[int, int, int]:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+_snapshots: dict[str, MatchSnapshot] = {}
+_snapshots_pid = os.getpid()
+_snapshots_lock = threading.Lock()
+
+
+def open_snapshot(snapshot_path: pathlib.Path | str) -> MatchSnapshot:
+    """
+    Returns the snapshot of the current process for the given path, mapping the file on first use and again after
+    it was replaced by a new export.
+    """
+    global _snapshots_pid
+
+    with _snapshots_lock:
+        if _snapshots_pid != os.getpid():
+            # A forked child maps the file again, the mapping itself is shared through the page cache.
+            _snapshots.clear()
+            _snapshots_pid = os.getpid()
+
+        key = str(snapshot_path)
+        snapshot = _snapshots.get(key)
+        if snapshot is None or snapshot.file_id != _file_id(os.stat(snapshot_path)):
+            # The old mapping is left to the garbage collector, other threads may still be reading it.
+            snapshot = _snapshots[key] = MatchSnapshot(pathlib.Path(snapshot_path))
+
+        return snapshot
+
+
+def ensure_match_snapshot(db: "VulnerabilityDatabase", snapshot_path: pathlib.Path | None = None) -> pathlib.Path:
+    """
+    Returns the path of an up to date snapshot of the database, writing it first when it is missing or was written
+    for another content version. A database without a content version gives no way to tell whether a snapshot is
+    current, its snapshot is written again every time.
+    """
+    snapshot_path = pathlib.Path(snapshot_path or snapshot_path_for(db.db_path))
+    if db.content_version is not None and snapshot_path.exists():
+        try:
+            snapshot = MatchSnapshot(snapshot_path)
+            current = snapshot.content_version == db.content_version
+            snapshot.close()
+            if current:
+                return snapshot_path
+        except ValueError:
+            pass
+
+    return write_match_snapshot(db, snapshot_path)
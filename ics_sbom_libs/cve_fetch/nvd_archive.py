@@ -0,0 +1,244 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Reading NVD data from local files, for machines that cannot reach the NVD API.
+
+An archive is a directory, a tarball (optionally gzip, bzip2, xz or zstd compressed) or a single file. The JSON files
+in it are pages saved from the 2.0 CVE or CPE API, or the 2.0 feed files, which have the same layout. They may be
+plain (.json), gzip (.json.gz) or zstd (.json.zst) compressed. Files are read in name order, so the "modified" feed
+is imported after the yearly ones and its newer records win.
+
+A yearly feed file decodes to hundreds of MB of dicts. NvdJsonReader therefore never decodes a whole file: it reads
+the text in chunks and hands out one record of the "vulnerabilities" or "products" array at a time, so memory use
+does not depend on the size of the file.
+
+The files of a directory and the members of an uncompressed tarball can be opened on their own, see archive_members()
+and open_archive_file(), so every file can be read and decoded by a different process.
+"""
+
+import contextlib
+import gzip
+import io
+import json
+import pathlib
+import re
+import sys
+import tarfile
+
+from typing import Final
+
+from beartype.typing import BinaryIO, Iterator, TextIO
+
+if sys.version_info >= (3, 14):
+    from compression import zstd
+else:
+    from backports import zstd
+
+__all__ = [
+    "iter_archive_files",
+    "archive_members",
+    "open_archive_file",
+    "open_nvd_json",
+    "is_nvd_json",
+    "NvdJsonReader",
+]
+
+NVD_JSON_SUFFIXES: Final = (".json", ".json.gz", ".json.zst")
+# Characters read from a file at once by NvdJsonReader.
+NVD_READ_CHUNK_SIZE: Final = 1 << 20
+_zstd_tar_suffixes: Final = (".tar.zst", ".tzst")
+# Top level arrays holding the records, and the source they belong to.
+_record_arrays: Final = {"vulnerabilities": "cve", "products": "cpe"}
+_whitespace: Final = re.compile(r"[ \t\n\r]*")
+
+
+def is_nvd_json(name: str) -> bool:
+    return name.lower().endswith(NVD_JSON_SUFFIXES)
+
+
+def iter_archive_files(path: pathlib.Path | str) -> Iterator[tuple[str, BinaryIO]]:
+    """
+    Yields (name, binary stream) for every JSON file of the archive in name order. A stream is closed when the next
+    file is yielded.
+    """
+    path = pathlib.Path(path)
+
+    if path.is_dir():
+        for name, file in _directory_files(path):
+            with open(file, "rb") as fp:
+                yield name, fp
+        return
+
+    if path.name.lower().endswith(_zstd_tar_suffixes):
+        with zstd.open(path, "rb") as fileobj, tarfile.open(fileobj=fileobj) as tar:
+            yield from _iter_tar_members(tar)
+        return
+
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as tar:
+            yield from _iter_tar_members(tar)
+        return
+
+    with open(path, "rb") as fp:
+        yield path.name, fp
+
+
+def archive_members(path: pathlib.Path | str) -> list[tuple[str, pathlib.Path, tarfile.TarInfo | None]] | None:
+    """
+    Returns (name, path, tarball member or None) for every JSON file of the archive in name order, for
+    open_archive_file() to open them one by one. None for a compressed tarball, whose members can only be reached by
+    decompressing everything in front of them, iter_archive_files() reads those.
+    """
+    path = pathlib.Path(path)
+
+    if path.is_dir():
+        return [(name, file, None) for name, file in _directory_files(path)]
+
+    if path.name.lower().endswith(_zstd_tar_suffixes):
+        return None
+
+    if not tarfile.is_tarfile(path):
+        return [(path.name, path, None)]
+
+    try:
+        with tarfile.open(path, "r:") as tar:
+            return [(member.name, path, member) for member in _tar_members(tar)]
+    except tarfile.ReadError:
+        return None
+
+
+@contextlib.contextmanager
+def open_archive_file(path: pathlib.Path, member: tarfile.TarInfo | None = None) -> Iterator[BinaryIO]:
+    """
+    Opens a file returned by archive_members().
+    """
+    if member is None:
+        with open(path, "rb") as fp:
+            yield fp
+        return
+
+    with tarfile.open(path, "r:") as tar:
+        with tar.extractfile(member) as fp:
+            yield fp
+
+
+def _directory_files(path: pathlib.Path) -> list[tuple[str, pathlib.Path]]:
+    files = {str(file.relative_to(path)): file for file in path.rglob("*") if file.is_file() and is_nvd_json(file.name)}
+    return sorted(files.items())
+
+
+def _tar_members(tar: tarfile.TarFile) -> list[tarfile.TarInfo]:
+    return sorted((m for m in tar.getmembers() if m.isfile() and is_nvd_json(m.name)), key=lambda m: m.name)
+
+
+def _iter_tar_members(tar: tarfile.TarFile) -> Iterator[tuple[str, BinaryIO]]:
+    for member in _tar_members(tar):
+        with tar.extractfile(member) as fp:
+            yield member.name, fp
+
+
+def open_nvd_json(name: str, fp: BinaryIO) -> TextIO:
+    """
+    Returns a text stream of a JSON file, decompressing it according to its name.
+    """
+    lower_name = name.lower()
+    if lower_name.endswith(".gz"):
+        fp = gzip.GzipFile(fileobj=fp)
+    elif lower_name.endswith(".zst"):
+        fp = zstd.ZstdFile(fp)
+
+    return io.TextIOWrapper(fp, encoding="utf-8")
+
+
+class NvdJsonReader:
+    """
+    Iterates over the records of an NVD JSON document without decoding the whole document.
+
+    The top level object is walked key by key. The elements of the record array are decoded one at a time and
+    yielded, every other value is decoded as a whole and kept in fields. Only the record being decoded and one chunk
+    of text are held in memory.
+    """
+
+    def __init__(self, fp: TextIO, chunk_size: int = NVD_READ_CHUNK_SIZE):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+        # Top level values other than the records, e.g. timestamp and totalResults.
+        self.fields: dict = {}
+        # "cve" or "cpe" once the record array was found.
+        self.src_name: str | None = None
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+
+        start = self._pos
+        self._buffer = self._buffer[start:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            self._pos = _whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of NVD JSON data")
+
+    def _take(self, expected: str) -> str:
+        c = self._peek()
+        if c not in expected:
+            raise ValueError(f"Expected one of '{expected}' in NVD JSON data, found '{c}'")
+
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._fill()
+
+    def __iter__(self) -> Iterator[dict]:
+        self._take("{")
+        if self._peek() == "}":
+            return
+
+        while True:
+            key = self._value()
+            self._take(":")
+            if key in _record_arrays and self._peek() == "[":
+                self.src_name = _record_arrays[key]
+                self._take("[")
+                if self._peek() == "]":
+                    self._take("]")
+                else:
+                    while True:
+                        yield self._value()
+                        if self._take(",]") == "]":
+                            break
+            else:
+                self.fields[key] = self._value()
+
+            if self._take(",}") == "}":
+                return
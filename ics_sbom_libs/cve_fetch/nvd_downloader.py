@@ -0,0 +1,176 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Concurrent download of the paged NVD API feeds.
+
+NVD allows a fixed number of requests per rolling 30 second window, 50 with an API key and 5 without. A page of the
+CVE feed takes several seconds for NVD to produce, so a single request at a time leaves most of that quota unused.
+NvdDownloader keeps up to max_in_flight page requests open, all of them drawing from one RateLimiter that stays within
+the quota, and hands the pages back in feed order so the caller can checkpoint after each one. The requests share one
+pooled, keep-alive HTTP session that asks for gzip compressed responses, the CVE pages compress about tenfold.
+"""
+
+import asyncio
+import logging
+
+from collections import deque
+from typing import Final
+
+import aiohttp
+
+from beartype.typing import AsyncIterator
+
+from ics_sbom_libs.common.ratelimiter import RateLimiter
+
+log = logging.getLogger(__name__)
+
+__all__ = ["NvdDownloader", "nvd_rate_limiter"]
+
+# CVE v2. See https://nvd.nist.gov/developers/vulnerabilities for refrence
+NIST_BASE_URL: Final = "https://services.nvd.nist.gov/rest/json/{}/2.0/"
+# See https://nvd.nist.gov/developers/start-here, "Rate Limits".
+NVD_WINDOW_SEC: Final = 30
+NVD_REQUESTS_PER_WINDOW: Final = 50
+NVD_REQUESTS_PER_WINDOW_NO_API_KEY: Final = 5
+NVD_MAX_IN_FLIGHT: Final = 4
+NVD_MAX_RETRIES: Final = 8
+NVD_RETRY_DELAY_SEC: Final = 6
+# NVD answers 403 as well as 429 when a client goes over the limit, and 503 when it is busy.
+NVD_RETRY_STATUS: Final = {403, 429, 500, 502, 503, 504}
+# NVD stops waiting on slow clients after a while, a page of 2000 CVEs can still take a minute to produce.
+NVD_REQUEST_TIMEOUT_SEC: Final = 300
+
+
+def nvd_rate_limiter(
+    api_key: str = "",
+    requests_per_window: int | None = None,
+    window_sec: float = NVD_WINDOW_SEC,
+    retry_delay: float = NVD_RETRY_DELAY_SEC,
+) -> RateLimiter:
+    """
+    Returns a RateLimiter for NVD's rolling window quota of the API key. Share it between everything talking to NVD
+    with the same key, the quota is counted per key, not per connection.
+    """
+    if requests_per_window is None:
+        requests_per_window = NVD_REQUESTS_PER_WINDOW if api_key else NVD_REQUESTS_PER_WINDOW_NO_API_KEY
+
+    return RateLimiter.for_window(requests_per_window, window_sec, retry_delay=retry_delay)
+
+
+class NvdDownloader:
+    """
+    Downloads pages of the NVD feeds. Use it as an async context manager, the HTTP session lives until it is left.
+    """
+
+    def __init__(
+        self,
+        api_key: str = "",
+        base_url: str = NIST_BASE_URL,
+        max_in_flight: int = NVD_MAX_IN_FLIGHT,
+        requests_per_window: int | None = None,
+        window_sec: float = NVD_WINDOW_SEC,
+        retry_delay: float = NVD_RETRY_DELAY_SEC,
+        limiter: RateLimiter | None = None,
+    ):
+        """
+        :param api_key: The NVD API key, an empty key uses the lower quota of anonymous clients.
+        :param base_url: URL of the API with '{}' in place of the feed name.
+        :param max_in_flight: Number of page requests of a feed kept open at once.
+        :param requests_per_window: Requests allowed per window, defaults to NVD's quota for the key.
+        :param window_sec: Length of the quota window.
+        :param retry_delay: Seconds to wait before the first retry of a failed request, doubled for every retry.
+        :param limiter: A RateLimiter shared with other NVD clients of the same key, replaces the three parameters
+                        above.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_in_flight = max(1, max_in_flight)
+        self.limiter = limiter or nvd_rate_limiter(api_key, requests_per_window, window_sec, retry_delay)
+
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        if self.api_key:
+            headers["apiKey"] = self.api_key
+        # Both feeds are downloaded at once, each with up to max_in_flight requests.
+        connector = aiohttp.TCPConnector(limit_per_host=2 * self.max_in_flight, keepalive_timeout=NVD_WINDOW_SEC)
+        self._session = aiohttp.ClientSession(
+            headers=headers, connector=connector, timeout=aiohttp.ClientTimeout(total=NVD_REQUEST_TIMEOUT_SEC)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._session.close()
+        self._session = None
+
+    async def fetch_page(self, url: str, params: dict) -> dict:
+        """
+        Returns the decoded JSON of one page, retrying when NVD is busy or rate limits the request.
+        """
+        for attempt in range(NVD_MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            try:
+                async with self._session.get(url, params=params) as response:
+                    if response.status == 200:
+                        data = await response.json(content_type=None)
+                        self.limiter.recover()
+                        return data
+
+                    if response.status not in NVD_RETRY_STATUS or attempt == NVD_MAX_RETRIES:
+                        response.raise_for_status()
+
+                    delay = self.limiter.backoff(attempt, response.status, response.headers)
+                    reason = f"status {response.status}"
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == NVD_MAX_RETRIES:
+                    raise
+                delay = self.limiter.backoff(attempt)
+                reason = str(e) or type(e).__name__
+
+            log.info(f"Request for {url} at {params.get('startIndex', 0)} failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def iter_pages(self, feed: str, params: dict, start_index: int, records_per_page: int) -> AsyncIterator[dict]:
+        """
+        Yields the pages of a feed from start_index on, in order. The first page tells how many records there are,
+        the requests for the following pages are then kept max_in_flight deep.
+
+        :param feed: The feed name, 'cves' or 'cpes'.
+        :param params: Query parameters sent with every page request.
+        """
+        url = self.base_url.format(feed)
+
+        def request(start: int):
+            return self.fetch_page(url, {**params, "resultsPerPage": records_per_page, "startIndex": start})
+
+        first = await request(start_index)
+        yield first
+
+        # NVD may return fewer records per page than asked for, the following pages use its page size.
+        step = first["resultsPerPage"]
+        if step <= 0:
+            return
+
+        starts = iter(range(start_index + step, first["totalResults"], step))
+        pending: deque[asyncio.Task] = deque()
+
+        def schedule():
+            while len(pending) < self.max_in_flight:
+                start = next(starts, None)
+                if start is None:
+                    return
+                pending.append(asyncio.ensure_future(request(start)))
+
+        try:
+            schedule()
+            while pending:
+                page = await pending.popleft()
+                schedule()
+                yield page
+        finally:
+            for task in pending:
+                task.cancel()
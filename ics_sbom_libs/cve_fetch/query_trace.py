@@ -0,0 +1,319 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Opt-in statistics of the queries VulnerabilityDatabase.query_cache runs.
+
+Queries are grouped by shape: the SQL with its literals replaced by '?' and every IN list collapsed to one
+placeholder, so the lookups of different CPEs, or of CVE chunks of different sizes, count as one query. For every
+shape the trace keeps the number of executions, their total latency, a histogram of the latencies for the
+percentiles, the rows returned and the parameters of the slowest execution, which explain() runs EXPLAIN QUERY PLAN
+on. The latency of an execution covers the execute call and the fetching of its rows.
+
+Tracing is per thread, queries are only recorded in a with tracing(trace) block:
+
+    with tracing(QueryTrace()) as trace:
+        db.get_cves(cve_ids)
+    trace.explain(db)
+    print(trace.to_json(indent=2))
+
+Traces are plain data once exported with to_dict(), the matcher workers send theirs back to be merged (see
+CveMatcher's trace_queries).
+"""
+
+import contextlib
+import functools
+import json
+import math
+import re
+import threading
+import time
+
+from typing import Final
+
+__all__ = ["QueryTrace", "QueryShapeStats", "normalize_query", "current_trace", "tracing"]
+
+# Latency histogram buckets per doubling, the percentiles are exact to about 20%.
+LATENCY_BUCKETS_PER_OCTAVE: Final = 4
+# Percentiles reported for every shape.
+LATENCY_PERCENTILES: Final = (50, 90, 99)
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_placeholder_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_whitespace = re.compile(r"\s+")
+
+_local = threading.local()
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str:
+    """
+    Returns the shape of a query: literals become '?', IN lists '(?...)' and whitespace a single space.
+    """
+    shape = _string_literal.sub("?", query)
+    shape = _number_literal.sub("?", shape)
+    shape = _placeholder_list.sub("(?...)", shape)
+    return _whitespace.sub(" ", shape).strip().rstrip(";")
+
+
+def _bucket(seconds: float) -> int:
+    return math.floor(math.log2(max(seconds, 1e-9)) * LATENCY_BUCKETS_PER_OCTAVE)
+
+
+def _bucket_upper_bound(bucket: int) -> float:
+    return 2 ** ((bucket + 1) / LATENCY_BUCKETS_PER_OCTAVE)
+
+
+class QueryShapeStats:
+    """
+    Executions of one query shape.
+    """
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        self.rows = 0
+        # Histogram bucket -> executions, see _bucket().
+        self.latencies: dict[int, int] = {}
+        # The query and parameters of the slowest execution, and its plan once explain() ran.
+        self.slowest_query: str | None = None
+        self.slowest_parameters: tuple = ()
+        self.plan: list[str] | None = None
+
+    def record(self, query: str, parameters, seconds: float, rows: int):
+        self.count += 1
+        self.total_sec += seconds
+        self.rows += rows
+        bucket = _bucket(seconds)
+        self.latencies[bucket] = self.latencies.get(bucket, 0) + 1
+        if seconds >= self.max_sec:
+            self.max_sec = seconds
+            self.slowest_query = query
+            self.slowest_parameters = tuple(parameters)
+
+    def percentile(self, percent: float) -> float:
+        """
+        The latency that percent of the executions did not exceed, rounded up to its histogram bucket.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket in sorted(self.latencies):
+            seen += self.latencies[bucket]
+            if seen >= rank:
+                return min(_bucket_upper_bound(bucket), self.max_sec)
+
+        return self.max_sec
+
+    def merge(self, other: dict):
+        self.count += other["count"]
+        self.total_sec += other["total_sec"]
+        self.rows += other["rows"]
+        for bucket, executions in other["latencies"].items():
+            bucket = int(bucket)
+            self.latencies[bucket] = self.latencies.get(bucket, 0) + executions
+        if other["max_sec"] >= self.max_sec:
+            self.max_sec = other["max_sec"]
+            self.slowest_query = other["slowest_query"]
+            self.slowest_parameters = tuple(other["slowest_parameters"])
+            self.plan = other.get("plan") or self.plan
+
+    def to_dict(self) -> dict:
+        return {
+            "shape": self.shape,
+            "count": self.count,
+            "total_sec": self.total_sec,
+            "mean_sec": self.total_sec / self.count if self.count else 0.0,
+            "max_sec": self.max_sec,
+            **{f"p{percent}_sec": self.percentile(percent) for percent in LATENCY_PERCENTILES},
+            "rows": self.rows,
+            # Keyed by strings like JSON objects, so the exported dictionary and its JSON agree.
+            "latencies": {str(bucket): executions for bucket, executions in sorted(self.latencies.items())},
+            "slowest_query": self.slowest_query,
+            "slowest_parameters": list(self.slowest_parameters),
+            "plan": self.plan,
+        }
+
+
+class QueryTrace:
+    """
+    The statistics of every query shape run while the trace was active. It may be active in several threads.
+    """
+
+    def __init__(self):
+        self.shapes: dict[str, QueryShapeStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, query: str, parameters, seconds: float, rows: int):
+        shape = normalize_query(query)
+        with self._lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = QueryShapeStats(shape)
+            stats.record(query, parameters, seconds, rows)
+
+    def execute(self, con, query: str, parameters=()):
+        """
+        Runs the query on the connection and returns its cursor, which records the execution once its rows are
+        fetched.
+        """
+        start = time.perf_counter()
+        cursor = con.execute(query, parameters)
+        return TracedCursor(self, cursor, query, parameters, time.perf_counter() - start)
+
+    @property
+    def query_count(self) -> int:
+        return sum(stats.count for stats in self.shapes.values())
+
+    def slowest(self, top: int = 5) -> list[QueryShapeStats]:
+        """
+        The shapes that took the most time in total.
+        """
+        return sorted(self.shapes.values(), key=lambda stats: stats.total_sec, reverse=True)[:top]
+
+    def explain(self, db, top: int = 5) -> dict[str, list[str]]:
+        """
+        Runs the query plan of the slowest execution of each of the top shapes on the database (see
+        VulnerabilityDatabase.explain_query) and keeps it with the shape.
+
+        :return: The plans keyed by shape.
+        """
+        plans = {}
+        for stats in self.slowest(top):
+            if stats.slowest_query is None:
+                continue
+            stats.plan = db.explain_query(stats.slowest_query, stats.slowest_parameters)
+            plans[stats.shape] = stats.plan
+
+        return plans
+
+    def merge(self, other: "QueryTrace | dict"):
+        """
+        Adds the executions of other, a QueryTrace or its to_dict().
+        """
+        if isinstance(other, QueryTrace):
+            other = other.to_dict()
+
+        with self._lock:
+            for values in other["shapes"]:
+                stats = self.shapes.get(values["shape"])
+                if stats is None:
+                    stats = self.shapes[values["shape"]] = QueryShapeStats(values["shape"])
+                stats.merge(values)
+
+    def to_dict(self) -> dict:
+        """
+        The shapes, slowest in total first.
+        """
+        return {
+            "query_count": self.query_count,
+            "total_sec": sum(stats.total_sec for stats in self.shapes.values()),
+            "shapes": [stats.to_dict() for stats in self.slowest(len(self.shapes))],
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "QueryTrace":
+        trace = cls()
+        trace.merge(values)
+        return trace
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+class TracedCursor:
+    """
+    Wraps the cursor of a traced query, timing the fetching of its rows and counting them. The execution is recorded
+    when every row was fetched, or when the cursor is closed or dropped.
+    """
+
+    def __init__(self, trace: QueryTrace, cursor, query: str, parameters, seconds: float):
+        self._trace = trace
+        self._cursor = cursor
+        self._query = query
+        self._parameters = parameters
+        self._seconds = seconds
+        self._rows = 0
+        self._iterator = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _fetched(self, start: float, rows: int, done: bool):
+        self._seconds += time.perf_counter() - start
+        self._rows += rows
+        if done:
+            self._finish()
+
+    def _finish(self):
+        if self._trace is not None:
+            self._trace.record(self._query, self._parameters, self._seconds, self._rows)
+            self._trace = None
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size: int = 1):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self._cursor)
+
+        start = time.perf_counter()
+        try:
+            row = next(self._iterator)
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    def __del__(self):
+        self._finish()
+
+
+def current_trace() -> QueryTrace | None:
+    """
+    The trace the queries of the current thread are recorded in, None when they are not traced.
+    """
+    return getattr(_local, "trace", None)
+
+
+@contextlib.contextmanager
+def tracing(trace: QueryTrace | None):
+    """
+    Records the queries of the current thread in trace for the with block, None stops tracing in the block.
+    """
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
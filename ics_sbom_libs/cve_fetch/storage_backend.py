@@ -0,0 +1,384 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+"""
+Storage backends of VulnerabilityDatabase.
+
+VulnerabilityDatabase talks to its connection through the sqlite3 API: connection.execute(), cursor(), executemany(),
+commit(). The SQLite backend hands out plain sqlite3 connections. The PostgreSQL backend hands out connections from a
+pool shared by every VulnerabilityDatabase of the process, wrapped so they accept the same queries: '?' and ':name'
+placeholders are translated to the psycopg2 ones. Everything else that differs between the two (creating the schema,
+bulk ingest settings, the index catalog) is a method of the backend.
+"""
+
+import os
+import pathlib
+import sqlite3
+import threading
+
+from functools import lru_cache
+from typing import Final
+
+from ics_sbom_libs.common.dbproperties import DBProperties
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+import logging
+
+log = logging.getLogger(__name__)
+
+__all__ = ["SqliteBackend", "PostgresBackend", "create_backend", "translate_placeholders", "reserve_connections"]
+
+POSTGRES_POOL_MIN_CONNECTIONS: Final = 1
+# Every thread that matches or ingests holds one connection while its VulnerabilityDatabase is open. Thread pools
+# reserve room for their workers on top of this, see reserve_connections().
+POSTGRES_POOL_MAX_CONNECTIONS: Final = 32
+# Rows sent to the server per round trip by executemany().
+POSTGRES_BATCH_SIZE: Final = 1000
+
+_schema_dir = pathlib.Path(__file__).parent.resolve()
+_postgres_tables: Final = [
+    "cve_range_entry",
+    "cpe_vendor",
+    "cpe_product",
+    "cve_severity",
+    "cve_detail",
+    "cve_detail_dict",
+    "cve_weakness",
+    "status",
+    "cpe_dictionary",
+]
+
+
+class SqliteBackend:
+    name: Final = "sqlite"
+    errors: Final = (sqlite3.Error,)
+    supports_migrations: Final = True
+    null_safe_equal: Final = "IS"
+
+    def __init__(self, db_path: pathlib.Path, read_only: bool = False, immutable: bool = False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.immutable = immutable
+
+    def connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            # Read only connections are used by the matchers, they never create or update the database. An immutable
+            # connection also skips all file locking, it must not be used while the database is being updated.
+            uri = f"{self.db_path.as_uri()}?mode=ro"
+            if self.immutable:
+                uri += "&immutable=1"
+            return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+        if not self.db_path.parent.exists():
+            self.db_path.parent.mkdir(parents=True)
+
+        if not os.path.exists(self.db_path):
+            con = sqlite3.connect(self.db_path)
+            self.reset(con)
+            con.close()
+
+        return sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def reset(con: sqlite3.Connection):
+        """
+        Drops all data and creates the tables of the current schema.
+        """
+        con.executescript((_schema_dir / "cve_schema.sql").read_text())
+
+    @staticmethod
+    def enable_bulk_ingest(con: sqlite3.Connection, pragmas: dict[str, str]):
+        con.execute("PRAGMA journal_mode=WAL")
+        for pragma, value in pragmas.items():
+            con.execute(f"PRAGMA {pragma}={value}")
+
+    @staticmethod
+    def finish_bulk_ingest(con: sqlite3.Connection):
+        # Moves everything out of the WAL file, immutable readers only look at the main database file.
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    @staticmethod
+    def index_definitions(con: sqlite3.Connection, tables: list[str]) -> list[tuple[str, str, str]]:
+        """
+        Returns (table, index name, CREATE INDEX statement) for the secondary indexes of the tables.
+        """
+        curs = con.execute(
+            "SELECT tbl_name, name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"
+            f" AND tbl_name IN ({', '.join('?' * len(tables))})",
+            tables,
+        )
+        return curs.fetchall()
+
+    @staticmethod
+    def vacuum(con: sqlite3.Connection):
+        con.execute("VACUUM")
+
+    @staticmethod
+    def explain(con: sqlite3.Connection, query: str, parameters=()) -> list[str]:
+        # Rows are (id, parent, notused, detail), a step is indented below its parent.
+        depth = {0: -1}
+        plan = []
+        for step, parent, _, detail in con.execute(f"EXPLAIN QUERY PLAN {query}", parameters):
+            depth[step] = depth.get(parent, -1) + 1
+            plan.append("  " * depth[step] + detail)
+
+        return plan
+
+
+class PostgresBackend:
+    name: Final = "postgresql"
+    supports_migrations: Final = False
+    null_safe_equal: Final = "IS NOT DISTINCT FROM"
+
+    def __init__(self, properties: DBProperties, read_only: bool = False):
+        if psycopg2 is None:
+            raise ImportError("The PostgreSQL backend of the vulnerability database needs psycopg2.")
+
+        self.properties = properties
+        self.read_only = read_only
+        self.errors = (psycopg2.Error,)
+
+    def connect(self) -> "PostgresConnection":
+        pool = _get_pool(self.properties.connection_string)
+        raw = pool.getconn()
+        # Matching only reads, so its connections do not keep a transaction open between queries.
+        raw.set_session(readonly=self.read_only, autocommit=self.read_only)
+        con = PostgresConnection(raw, pool)
+
+        if not self.read_only:
+            self._create_schema(raw)
+
+        return con
+
+    @staticmethod
+    def _create_schema(raw):
+        with raw.cursor() as curs:
+            curs.execute("SELECT to_regclass('status')")
+            exists = curs.fetchone()[0] is not None
+            if not exists:
+                curs.execute((_schema_dir / "cve_schema_postgresql.sql").read_text())
+        raw.commit()
+
+    def reset(self, con: "PostgresConnection"):
+        """
+        Drops all data and creates the tables of the current schema.
+        """
+        con.execute("DROP VIEW IF EXISTS cve_range")
+        for table in _postgres_tables:
+            con.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+        con.commit()
+        self._create_schema(con._raw)
+
+    @staticmethod
+    def enable_bulk_ingest(con: "PostgresConnection", pragmas: dict[str, str]):
+        # The closest equivalent of synchronous=NORMAL: a crash may lose the last pages, which the next run downloads
+        # again, but never corrupts the database.
+        con.execute("SET synchronous_commit TO OFF")
+
+    @staticmethod
+    def finish_bulk_ingest(con: "PostgresConnection"):
+        con.execute("ANALYZE")
+        con.commit()
+
+    @staticmethod
+    def index_definitions(con: "PostgresConnection", tables: list[str]) -> list[tuple[str, str, str]]:
+        # Indexes backing a primary key or unique constraint have a matching pg_constraint row and are left alone.
+        curs = con.execute(
+            "SELECT tablename, indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema()"
+            f" AND tablename IN ({', '.join('?' * len(tables))})"
+            " AND indexname NOT IN (SELECT conname FROM pg_constraint)",
+            tables,
+        )
+        return curs.fetchall()
+
+    @staticmethod
+    def vacuum(con: "PostgresConnection"):
+        # Autovacuum takes care of PostgreSQL databases.
+        return
+
+    @staticmethod
+    def explain(con: "PostgresConnection", query: str, parameters=()) -> list[str]:
+        return [row[0] for row in con.execute(f"EXPLAIN {query}", parameters).fetchall()]
+
+
+def create_backend(location: pathlib.Path | DBProperties, read_only: bool = False, immutable: bool = False):
+    """
+    Returns the backend for a database file or for the server described by a DBProperties.
+    """
+    if isinstance(location, DBProperties):
+        if location.database_type not in ("postgresql", "postgres"):
+            raise ValueError(f"Unsupported vulnerability database type: {location.database_type}")
+
+        return PostgresBackend(location, read_only)
+
+    return SqliteBackend(pathlib.Path(location), read_only, immutable)
+
+
+def _starts_name(query: str, index: int) -> bool:
+    return index < len(query) and (query[index].isalpha() or query[index] == "_")
+
+
+@lru_cache(maxsize=256)
+def translate_placeholders(query: str) -> str:
+    """
+    Translates the sqlite3 '?' and ':name' placeholders of a query to the psycopg2 '%s' and '%(name)s' ones. Text in
+    quotes is copied as is, apart from '%' which psycopg2 needs doubled everywhere.
+    """
+    result = []
+    quote = None
+    i = 0
+    while i < len(query):
+        c = query[i]
+        if c == "%":
+            result.append("%%")
+        elif quote:
+            result.append(c)
+            if c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+            result.append(c)
+        elif c == "?":
+            result.append("%s")
+        elif c == ":" and _starts_name(query, i + 1) and (i == 0 or query[i - 1] != ":"):
+            # A named placeholder, '::' casts are copied as is.
+            start = end = i + 1
+            while end < len(query) and (query[end].isalnum() or query[end] == "_"):
+                end += 1
+            result.append(f"%({query[start:end]})s")
+            i = end
+            continue
+        else:
+            result.append(c)
+        i += 1
+
+    return "".join(result)
+
+
+class PostgresCursor:
+    """
+    psycopg2 cursor with the sqlite3 execute() and executemany() signatures.
+    """
+
+    def __init__(self, raw_cursor):
+        self._cursor = raw_cursor
+
+    def execute(self, query: str, parameters=()):
+        if not parameters:
+            # psycopg2 only interpolates, and expects '%' to be doubled, when there are parameters.
+            self._cursor.execute(query)
+        else:
+            self._cursor.execute(translate_placeholders(query), parameters)
+        return self
+
+    def executemany(self, query: str, seq_of_parameters):
+        psycopg2.extras.execute_batch(
+            self._cursor, translate_placeholders(query), seq_of_parameters, page_size=POSTGRES_BATCH_SIZE
+        )
+        return self
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: int = 1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class PostgresConnection:
+    """
+    Pooled psycopg2 connection with the parts of the sqlite3.Connection API that VulnerabilityDatabase uses.
+    Closing it returns the connection to the pool.
+    """
+
+    def __init__(self, raw, pool):
+        self._raw = raw
+        self._pool = pool
+
+    def cursor(self) -> PostgresCursor:
+        return PostgresCursor(self._raw.cursor())
+
+    def execute(self, query: str, parameters=()) -> PostgresCursor:
+        return self.cursor().execute(query, parameters)
+
+    def executemany(self, query: str, seq_of_parameters) -> PostgresCursor:
+        return self.cursor().executemany(query, seq_of_parameters)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is None:
+            return
+
+        if not self._raw.closed:
+            self._raw.rollback()
+        self._pool.putconn(self._raw)
+        self._raw = None
+
+
+_pools: dict[str, "psycopg2.pool.ThreadedConnectionPool"] = {}
+# Largest number of connections of every pool, see reserve_connections().
+_pool_sizes: dict[str, int] = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+
+
+def _get_pool(connection_string: str):
+    global _pools_pid
+
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Pools inherited through fork() hold the parent's sockets, the child opens its own connections.
+            _pools.clear()
+            _pools_pid = os.getpid()
+
+        pool = _pools.get(connection_string)
+        if pool is None:
+            pool = psycopg2.pool.ThreadedConnectionPool(
+                POSTGRES_POOL_MIN_CONNECTIONS,
+                _pool_sizes.get(connection_string, POSTGRES_POOL_MAX_CONNECTIONS),
+                connection_string,
+            )
+            _pools[connection_string] = pool
+
+        return pool
+
+
+def reserve_connections(properties: DBProperties, count: int):
+    """
+    Makes room in the connection pool of the server for a thread pool of count workers, each of them holding a
+    connection for as long as it lives (see connection_registry.py). The connections of the other threads of the
+    process keep the room they had.
+    """
+    connection_string = properties.connection_string
+    with _pools_lock:
+        size = max(
+            _pool_sizes.get(connection_string, POSTGRES_POOL_MAX_CONNECTIONS), POSTGRES_POOL_MAX_CONNECTIONS + count
+        )
+        _pool_sizes[connection_string] = size
+        pool = _pools.get(connection_string)
+        if pool is not None:
+            pool.maxconn = max(pool.maxconn, size)
@@ -1,4 +1,4 @@
 # SPDX-License-Identifier: MIT
 # SPDX-FileCopyrightText: Copyright 2024 Ics inc.
 
-__all__ = ["matchresult", "cvematcher", "cpe_match_results", "package_matching"]
+__all__ = ["matchresult", "cvematcher", "cpe_match_results", "match_stats", "package_matching"]
@@ -0,0 +1,153 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import os
+import pathlib
+import sys
+import threading
+
+from beartype.typing import Iterator
+
+from ics_sbom_libs.cve_fetch.match_snapshot import MatchSnapshot, open_snapshot
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+from ics_sbom_libs.cve_match.match_stats import count, measure
+from ics_sbom_libs.cve_match.package_matching import VersionFactory, VersionRange, iter_matching_cves
+
+
+def convert_ranges(product: str, rows) -> dict[str, list[VersionRange]]:
+    """
+    Converts (cve_number, vulnerable, version, ...) rows of a product into its ranges grouped by CVE number.
+    """
+    handler = VersionFactory.get_handler(product)
+    cache = {}
+
+    ranges: dict[str, list[VersionRange]] = {}
+    with measure("version_conversion"):
+        for cve_number, *bounds in rows:
+            ranges.setdefault(cve_number, []).append(VersionRange.from_row(handler, bounds, cache))
+
+    return ranges
+
+
+class CveRangeIndex:
+    """
+    In-memory copy of the cve_range table keyed by product and vendor.
+
+    The table is read with a single query. The version bounds of a product are converted by the product's
+    VersionHandler the first time the product is looked up and are kept for every following lookup, so matching a
+    CPE no longer needs any SQL.
+    """
+
+    def __init__(self):
+        # product -> vendor -> cve_number -> raw range rows
+        self._rows: dict[str, dict[str, dict[str, list[tuple]]]] = {}
+        # (product, vendor) -> cve_number -> converted ranges
+        self._ranges: dict[tuple[str, str], dict[str, list[VersionRange]]] = {}
+        self._row_count = 0
+
+    @classmethod
+    def from_database(cls, db: VulnerabilityDatabase):
+        index = cls()
+        index.load(db)
+        return index
+
+    @property
+    def row_count(self):
+        return self._row_count
+
+    def load(self, db: VulnerabilityDatabase):
+        self._rows.clear()
+        self._ranges.clear()
+        self._row_count = 0
+
+        cursor = db.iter_cve_ranges()
+        if not cursor:
+            return
+
+        for cve_number, vendor, product, *bounds in cursor:
+            vendors = self._rows.setdefault(sys.intern(product), {})
+            cves = vendors.setdefault(sys.intern(vendor), {})
+            cves.setdefault(cve_number, []).append(tuple(sys.intern(b) if isinstance(b, str) else b for b in bounds))
+            self._row_count += 1
+
+    def version_ranges(self, product: str, vendor: str = "*") -> dict[str, list[VersionRange]]:
+        """
+        Returns the converted ranges of a product grouped by CVE number. A vendor of '*' matches all vendors of the
+        product.
+        """
+        key = (product, vendor)
+        if key in self._ranges:
+            return self._ranges[key]
+
+        with measure("range_query"):
+            rows = [
+                (cve_number, *row)
+                for vendor_name, cves in self._rows.get(product, {}).items()
+                if vendor == "*" or vendor_name == vendor
+                for cve_number, cve_rows in cves.items()
+                for row in cve_rows
+            ]
+        count("range_rows", len(rows))
+
+        ranges = self._ranges[key] = convert_ranges(product, rows)
+        return ranges
+
+    def iter_matching_cves(self, product: str, vendor: str, version: str) -> Iterator[str]:
+        return iter_matching_cves(self.version_ranges(product, vendor), VersionFactory.get_handler(product), version)
+
+
+class SnapshotRangeIndex(CveRangeIndex):
+    """
+    CveRangeIndex backed by a memory mapped match snapshot. Nothing is loaded up front, the ranges of a product are
+    read from the mapped file the first time it is looked up.
+    """
+
+    def __init__(self, snapshot: MatchSnapshot):
+        super().__init__()
+        self.snapshot = snapshot
+
+    @property
+    def row_count(self):
+        return self.snapshot.range_count
+
+    def load(self, db: VulnerabilityDatabase):
+        raise TypeError("A snapshot index is written with VulnerabilityDatabase.export_match_snapshot().")
+
+    def version_ranges(self, product: str, vendor: str = "*") -> dict[str, list[VersionRange]]:
+        key = (product, vendor)
+        if key in self._ranges:
+            return self._ranges[key]
+
+        with measure("range_query"):
+            rows = self.snapshot.product_ranges(product, vendor)
+        count("range_rows", len(rows))
+
+        ranges = self._ranges[key] = convert_ranges(product, rows)
+        return ranges
+
+
+_snapshot_indexes: dict[str, SnapshotRangeIndex] = {}
+_snapshot_indexes_pid = os.getpid()
+_snapshot_indexes_lock = threading.Lock()
+
+
+def snapshot_range_index(snapshot_path: pathlib.Path | str) -> SnapshotRangeIndex:
+    """
+    Returns the snapshot index of the current process for the given path. Its converted ranges are kept for every
+    following chunk the worker matches, until the snapshot is written again.
+    """
+    global _snapshot_indexes_pid
+
+    with _snapshot_indexes_lock:
+        if _snapshot_indexes_pid != os.getpid():
+            _snapshot_indexes.clear()
+            _snapshot_indexes_pid = os.getpid()
+
+        key = str(snapshot_path)
+        snapshot = open_snapshot(snapshot_path)
+        index = _snapshot_indexes.get(key)
+        if index is None or index.snapshot is not snapshot:
+            index = _snapshot_indexes[key] = SnapshotRangeIndex(snapshot)
+
+        return index
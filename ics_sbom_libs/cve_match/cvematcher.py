@@ -4,20 +4,23 @@
 # SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
 # SPDX-FileContributor: Milo Kerr <mkerr@ics.com>
 
+import asyncio
+import contextlib
 import datetime
 import os
 
 from enum import Enum
+from typing import Final
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
 
 from .matchresult import MatchResult
-import semantic_version
 import pathlib
 
 from rich import table, print
 
-from beartype.typing import Optional
+from beartype.typing import AsyncIterator, Optional
 from cpeparser import CpeParser
 from spdx_tools.spdx.model import Document as SPDXDocument
 from spdx_tools.spdx.model import CreationInfo as SPDXCreationInfo
@@ -29,10 +32,34 @@ from spdx_tools.spdx.model import ExternalPackageRef as SPDXExternalPackageRef
 from spdx_tools.spdx.model import ExternalPackageRefCategory as SPDXExternalRefCategory
 
 from ics_sbom_libs.cve_match.package_matching.versionfactory import VersionFactory
+from ics_sbom_libs.cve_match.package_matching.versionrange import VersionRange, iter_matching_cves
+from ics_sbom_libs.cve_match.cve_range_index import CveRangeIndex, convert_ranges, snapshot_range_index
+from ics_sbom_libs.cve_match.match_cache import MatchCache
 from ics_sbom_libs.cve_match.cpe_match_results import CpeMatchResult
+from ics_sbom_libs.cve_match.match_stats import MatchStats, call_collecting, collecting, count, measure
 
+from ics_sbom_libs.common.dbproperties import DBProperties
+from ics_sbom_libs.common.memory_profile import memory_phase
 from ics_sbom_libs.common.vulnerability import vulnerability_styles
 from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+from ics_sbom_libs.cve_fetch.connection_registry import (
+    close_ended_threads,
+    get_database,
+    init_worker,
+    reserve_connections,
+)
+from ics_sbom_libs.cve_fetch.match_snapshot import ensure_match_snapshot
+
+# Number of packages, or CPEs, handed to a worker at once.
+MATCH_CHUNK_SIZE: Final = 64
+# Number of database lookups a single asynchronous scan keeps in flight.
+MATCH_ASYNC_CONCURRENCY: Final = 8
+
+
+class MatchBackend(Enum):
+    Process = "process"
+    Thread = "thread"
+    Serial = "serial"
 
 
 class MatchTableOutput(Enum):
@@ -49,7 +76,7 @@ def cpe_factory(product: str, version: Optional[str] = None, vendor: Optional[st
 
 
 class CveMatcher:
-    db_path: pathlib.Path
+    db_path: pathlib.Path | DBProperties
     _spdx_document: SPDXDocument
 
     # Results
@@ -64,8 +91,64 @@ class CveMatcher:
     # Timing meta data
     scanTime: str
 
-    def __init__(self, db_path: pathlib.Path):
+    # Matching engine
+    use_range_index: bool
+    max_workers: Optional[int]
+    chunk_size: int
+    backend: MatchBackend
+    use_match_cache: bool
+    use_snapshot: bool
+
+    # Stage timings and query trace of the last scan, when collect_stats or trace_queries is set
+    collect_stats: bool
+    trace_queries: bool
+    stats: Optional[MatchStats]
+
+    def __init__(
+        self,
+        db_path: pathlib.Path | DBProperties,
+        use_range_index: bool = False,
+        max_workers: Optional[int] = None,
+        chunk_size: int = MATCH_CHUNK_SIZE,
+        executor: Optional[Executor] = None,
+        backend: Optional[MatchBackend | str] = None,
+        use_match_cache: bool = False,
+        use_snapshot: bool = False,
+        collect_stats: bool = False,
+        trace_queries: bool = False,
+    ):
+        """
+        :param db_path: Path of the vulnerability database, or the DBProperties of a PostgreSQL database
+                        (VulnerabilityDatabase.location).
+        :param use_range_index: Match against an in-memory copy of the cve_range table.
+        :param max_workers: Number of workers, a value of 1 or less matches in this process.
+        :param chunk_size: Number of packages, or CPEs, sent to a worker at once.
+        :param executor: An executor to run the workers in. It is used as is and is not shut down by close(). When
+                         not given the matcher creates the backend's executor on first use and keeps it until close().
+        :param backend: Where the workers run (process, thread or serial). Defaults to default_match_backend().
+        :param use_match_cache: Reuse the CPE results of earlier scans of the same database content.
+        :param use_snapshot: Match against the memory mapped snapshot of the database, which every worker process
+                             shares through the page cache. It is written next to the database when it is missing or
+                             out of date. Ignored for PostgreSQL databases and when use_range_index is set.
+        :param collect_stats: Record the wall and CPU time of every stage of a scan, and counters of the work done, in
+                              stats. The workers record their share and send it back with their results.
+        :param trace_queries: Also trace the database queries of a scan, in every worker, into stats.queries (see
+                              query_trace.py). Implies collect_stats.
+        """
         self.db_path = db_path
+        self.use_range_index = use_range_index
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self._range_index: Optional[CveRangeIndex] = None
+        self.backend = _resolve_backend(backend, max_workers)
+        self._executor: Optional[Executor] = executor
+        self._owns_executor = executor is None
+        self.use_match_cache = use_match_cache
+        self._match_cache: Optional[MatchCache] = None
+        self.use_snapshot = use_snapshot
+        self.collect_stats = collect_stats or trace_queries
+        self.trace_queries = trace_queries
+        self.stats = None
 
         self.total_package_count = 0
         self.dirty_package_count = 0
@@ -94,6 +177,81 @@ class CveMatcher:
 
         self._spdx_document = document
 
+    @property
+    def range_index(self) -> Optional[CveRangeIndex]:
+        """
+        The in-memory cve_range index used for matching. It is loaded on first use when use_range_index is set and
+        kept for every following call to process().
+        """
+        if not self.use_range_index:
+            return None
+
+        if self._range_index is None:
+            self._range_index = CveRangeIndex.from_database(get_database(self.db_path))
+
+        return self._range_index
+
+    @property
+    def snapshot_path(self) -> Optional[pathlib.Path]:
+        """
+        The match snapshot of the database when use_snapshot is set, exported again whenever the database content
+        changed since it was written.
+        """
+        if not self.use_snapshot or self.use_range_index or isinstance(self.db_path, DBProperties):
+            return None
+
+        return ensure_match_snapshot(get_database(self.db_path))
+
+    @property
+    def executor(self) -> Optional[Executor]:
+        """
+        The executor shared by every phase of every scan, or None when matching runs in this process.
+        """
+        if self._executor is not None:
+            return self._executor
+
+        self._executor = create_executor(self.backend, self.db_path, self.max_workers)
+        self._owns_executor = True
+        return self._executor
+
+    @property
+    def match_cache(self) -> Optional[MatchCache]:
+        """
+        The CPE result cache of the database, opened on first use when use_match_cache is set. It is reopened when
+        the database content changed since the cache was opened.
+        """
+        if not self.use_match_cache:
+            return None
+
+        if self._match_cache is not None and self._match_cache.db_version != MatchCache.database_version(self.db_path):
+            self._match_cache.close()
+            self._match_cache = None
+
+        if self._match_cache is None:
+            self._match_cache = MatchCache.for_database(self.db_path)
+
+        return self._match_cache
+
+    def close(self):
+        """
+        Shuts down the process pool owned by the matcher and closes the match cache. An executor given to the
+        constructor is left running.
+        """
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown()
+            self._executor = None
+            close_ended_threads()
+
+        if self._match_cache is not None:
+            self._match_cache.close()
+            self._match_cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def add_package(self, package: str, version: Optional[str] = None, vendor: Optional[str] = None):
         if len(package) == 0:
             print("[red][b]ERROR:[/b] The package name is empty. Not adding to Matcher.[/red]")
@@ -128,8 +286,54 @@ class CveMatcher:
         self.dirty_package_count = 0
         self.clean_package_count = 0
         self.total_cve_count = 0
+        self.stats = MatchStats(self.trace_queries) if self.collect_stats else None
+
+        self.result_list = process(
+            self.spdx_document,
+            self.db_path,
+            self.range_index,
+            max_workers=self.max_workers,
+            chunk_size=self.chunk_size,
+            backend=self.backend,
+            executor=self.executor,
+            match_cache=self.match_cache,
+            snapshot_path=self.snapshot_path,
+            stats=self.stats,
+        )
+        self.scanTime = str(datetime.datetime.now(datetime.timezone.utc)).replace(" ", "T")[:-7] + "Z"
+
+        for result in self.result_list:
+            if result.cve_list:
+                self.dirty_package_count += 1
+                self.total_cve_count += len(result.cve_list)
+            else:
+                self.clean_package_count += 1
+
+    async def process_async(self, max_concurrency: int = MATCH_ASYNC_CONCURRENCY):
+        """
+        Asynchronous variant of process() that does not block the event loop. The database lookups run in the
+        matcher's executor, or in a thread pool created for the scan when the matcher has none.
+        """
+        if len(self.spdx_document.packages) == 0:
+            print("[red][b]ERROR:[/b] No SPDX Document has no packages[/red]")
+            raise RuntimeError("No SPDX Document has no packages")
 
-        self.result_list = process(self.spdx_document, self.db_path)
+        self.total_package_count = len(self.spdx_document.packages)
+        self.dirty_package_count = 0
+        self.clean_package_count = 0
+        self.total_cve_count = 0
+        self.stats = MatchStats(self.trace_queries) if self.collect_stats else None
+
+        self.result_list = await process_async(
+            self.spdx_document,
+            self.db_path,
+            executor=self.executor,
+            max_concurrency=max_concurrency,
+            stats=self.stats,
+            range_index=self.range_index,
+            match_cache=self.match_cache,
+            snapshot_path=self.snapshot_path,
+        )
         self.scanTime = str(datetime.datetime.now(datetime.timezone.utc)).replace(" ", "T")[:-7] + "Z"
 
         for result in self.result_list:
@@ -139,6 +343,15 @@ class CveMatcher:
             else:
                 self.clean_package_count += 1
 
+    def explain_slowest_queries(self, top: int = 5) -> dict[str, list[str]]:
+        """
+        Adds the query plans of the top query shapes of the last traced scan to its trace, and returns them.
+        """
+        if self.stats is None or self.stats.queries is None:
+            return {}
+
+        return self.stats.queries.explain(get_database(self.db_path), top)
+
     def create_match_table(self, table_output: MatchTableOutput = MatchTableOutput.All):
         match_table = table.Table(title="CVE Results", row_styles=["dim", ""], expand=True)
         match_table.add_column(header="Package", style="green")
@@ -217,43 +430,263 @@ class CveMatcher:
         return str(self.create_match_table())
 
 
-def process(spdx_document: SPDXDocument, db_path: pathlib.Path):
-    results_list = []
-    unique_cpes = {}
+def default_match_backend() -> MatchBackend:
+    """
+    The backend selected by the environment: MATCH_BACKEND (process, thread or serial) or, when it is not set,
+    MATCH_USE_PARALLEL.
+    """
+    if "MATCH_BACKEND" in os.environ:
+        return MatchBackend(os.environ["MATCH_BACKEND"].lower())
+
     use_parallel = os.environ["MATCH_USE_PARALLEL"].upper() == "TRUE" if "MATCH_USE_PARALLEL" in os.environ else True
-    match_results = {}
+    return MatchBackend.Process if use_parallel else MatchBackend.Serial
+
+
+def _resolve_backend(backend: Optional[MatchBackend | str], max_workers: Optional[int]) -> MatchBackend:
+    if backend is None:
+        backend = default_match_backend()
+    elif isinstance(backend, str):
+        backend = MatchBackend(backend.lower())
+
+    if max_workers is not None and max_workers <= 1:
+        backend = MatchBackend.Serial
+
+    return backend
+
+
+def create_executor(
+    backend: MatchBackend, db_path: pathlib.Path, max_workers: Optional[int] = None
+) -> Optional[Executor]:
+    """
+    Creates the executor of a matching backend, None for the serial backend.
+
+    The thread backend opens its own read only connection in every thread. SQLite releases the GIL while it runs a
+    query, so the threads avoid the process start up and pickling costs without serializing the queries. The
+    connections are not immutable: the pool may outlive an update of the database, which they have to notice.
+    """
+    if backend is MatchBackend.Process:
+        return ProcessPoolExecutor(max_workers, initializer=init_worker, initargs=(db_path,))
+
+    if backend is MatchBackend.Thread:
+        executor = ThreadPoolExecutor(
+            max_workers,
+            thread_name_prefix="cve_match",
+            initializer=init_worker,
+            initargs=(db_path,),
+        )
+        # Every thread keeps its connection until the executor is shut down.
+        reserve_connections(db_path, executor._max_workers)
+        return executor
+
+    return None
+
+
+def _chunks(items: list, chunk_size: int):
+    chunk_size = max(1, chunk_size)
+    for start in range(0, len(items), chunk_size):
+        end = start + chunk_size
+        yield items[start:end]
+
+
+def _map_chunks(
+    func,
+    chunks: list,
+    db_path: pathlib.Path,
+    executor: Optional[Executor],
+    pbar: tqdm,
+    stats: Optional[MatchStats] = None,
+):
+    """
+    Runs func(chunk, db_path) for every chunk, either in the executor or in the current process, and yields the
+    results as they complete. With stats, the stats every chunk recorded are merged into it.
+    """
+    if stats is not None:
+        func = partial(call_collecting, func, trace_queries=stats.queries is not None)
+
+    def unpack(result):
+        if stats is None:
+            return result
+
+        result, chunk_stats = result
+        stats.merge(chunk_stats)
+        return result
+
+    if executor is None:
+        for chunk in chunks:
+            yield unpack(func(chunk, db_path))
+            pbar.update(len(chunk))
+        return
+
+    future_to_size = {executor.submit(func, chunk, db_path): len(chunk) for chunk in chunks}
+    for future in as_completed(future_to_size):
+        yield unpack(future.result())
+        pbar.update(future_to_size[future])
+
+
+def process(
+    spdx_document: SPDXDocument,
+    db_path: pathlib.Path,
+    range_index: Optional[CveRangeIndex] = None,
+    max_workers: Optional[int] = None,
+    chunk_size: int = MATCH_CHUNK_SIZE,
+    backend: Optional[MatchBackend | str] = None,
+    executor: Optional[Executor] = None,
+    match_cache: Optional[MatchCache] = None,
+    snapshot_path: Optional[pathlib.Path] = None,
+    stats: Optional[MatchStats] = None,
+):
+    """
+    Matches the packages of the SPDX document against the vulnerability database.
+
+    :param spdx_document: The document with the packages to match.
+    :param db_path: Path of the vulnerability database.
+    :param range_index: An optional in-memory cve_range index. When given the CVE lookups run in this process.
+    :param max_workers: Number of workers, defaults to the executor's own default. A value of 1 or less runs
+                        everything in this process.
+    :param chunk_size: Number of packages, or CPEs, sent to a worker at once.
+    :param backend: Where the workers run (process, thread or serial). Defaults to default_match_backend().
+    :param executor: A long-lived executor to run the workers in. It is left running when the scan is done. Without
+                     it an executor for the backend is created for the scan.
+    :param match_cache: A cache of earlier CPE results. Cached CPEs are not matched again and new results are added.
+    :param snapshot_path: An optional match snapshot of the database. The workers look up the CVE ranges in it
+                          instead of the database.
+    :param stats: Where to record the time of every stage and the work done, see MatchStats.
+    :return: A list of MatchResults, one per package name.
+
+    The memory of the scan and of its phases is accounted to the active memory profile, if any (see
+    memory_profile.py).
+    """
+    scan = stats.scan() if stats is not None else contextlib.nullcontext()
+    with collecting(stats), scan, memory_phase("match"):
+        return _process(
+            spdx_document,
+            db_path,
+            range_index,
+            max_workers,
+            chunk_size,
+            backend,
+            executor,
+            match_cache,
+            snapshot_path,
+            stats,
+        )
 
-    package_pbar = tqdm(
-        total=len(spdx_document.packages), desc="Matching CPEs", unit="packages", mininterval=0, miniters=1
-    )
-    if use_parallel:
-        with ProcessPoolExecutor() as executor:
-            future_to_package = {
-                executor.submit(process_spdx_package, package, db_path): package for package in spdx_document.packages
-            }
-            for future in as_completed(future_to_package):
-                package = future_to_package[future]
-                result, unique_cpes_partial = future.result()
-                match_results.update(result)
-                for cpe, packages in unique_cpes_partial.items():
-                    if cpe not in unique_cpes:
-                        unique_cpes[cpe] = packages
-                    else:
-                        unique_cpes[cpe].extend(packages)
-                package_pbar.update()
-    else:
-        for package in spdx_document.packages:
-            result, unique_cpes_partial = process_spdx_package(package, db_path)
-            match_results.update(result)
-            for cpe, packages in unique_cpes_partial.items():
-                if cpe not in unique_cpes:
-                    unique_cpes[cpe] = packages
-                else:
-                    unique_cpes[cpe].extend(packages)
-            package_pbar.update()
+
+def _process(
+    spdx_document: SPDXDocument,
+    db_path: pathlib.Path,
+    range_index: Optional[CveRangeIndex],
+    max_workers: Optional[int],
+    chunk_size: int,
+    backend: Optional[MatchBackend | str],
+    executor: Optional[Executor],
+    match_cache: Optional[MatchCache],
+    snapshot_path: Optional[pathlib.Path],
+    stats: Optional[MatchStats],
+):
+    owns_executor = executor is None
+    if owns_executor:
+        executor = create_executor(_resolve_backend(backend, max_workers), db_path, max_workers)
+
+    # Only what the workers need is sent to them, not the whole SPDXPackage.
+    packages = [
+        (package.name, package.version, generate_cpe_list(package.external_references))
+        for package in spdx_document.packages
+    ]
+
+    positions: dict[str, int] = {}
+    for position, (name, _, _) in enumerate(packages):
+        positions.setdefault(name, position)
+
+    unique_cpes: dict[str, list[str]] = {}
+    match_results: dict[str, MatchResult] = {}
+    cpe_cve_ids: dict[str, list[str]] = {}
+
+    try:
+        # The memory phases cover what this process keeps: unique_cpes and match_results, then cpe_cve_ids.
+        with memory_phase("match.cpe_resolution"):
+            package_pbar = tqdm(total=len(packages), desc="Matching CPEs", unit="packages", mininterval=0, miniters=1)
+            for chunk_results in _map_chunks(
+                process_package_chunk, list(_chunks(packages, chunk_size)), db_path, executor, package_pbar, stats
+            ):
+                with measure("result_aggregation"):
+                    for result, unique_cpes_partial in chunk_results:
+                        match_results.update(result)
+                        for cpe, package_names in unique_cpes_partial.items():
+                            if cpe not in unique_cpes:
+                                unique_cpes[cpe] = package_names
+                            else:
+                                unique_cpes[cpe].extend(package_names)
+
+        with memory_phase("match.cve_lookup"):
+            _lookup_cve_ids(
+                unique_cpes, cpe_cve_ids, db_path, range_index, chunk_size, executor, match_cache, snapshot_path, stats
+            )
+
+    finally:
+        if owns_executor and executor is not None:
+            executor.shutdown()
+            close_ended_threads()
+
+    # The workers only return CVE numbers, every matched CVE is loaded once here.
+    with memory_phase("match.cve_hydration"), measure("cve_hydration"):
+        vulnerabilities = get_database(db_path).get_cves(cve for cve_ids in cpe_cve_ids.values() for cve in cve_ids)
+    count("hydrated_cves", len(vulnerabilities))
+
+    with memory_phase("match.result_aggregation"):
+        cpe_cves = {
+            cpe: [vulnerabilities[cve] for cve in cpe_cve_ids.get(cpe, []) if cve in vulnerabilities]
+            for cpe in unique_cpes
+        }
+        _assign_cves(match_results, _cpe_owners(unique_cpes, positions), cpe_cves)
+
+    return list(match_results.values())
+
+
+def _cpe_owners(unique_cpes: dict[str, list[str]], positions: dict[str, int]) -> dict[str, str]:
+    """
+    The package the CVEs of every CPE are reported for: of the packages sharing a CPE, the first of the document.
+
+    :param unique_cpes: The names of the packages of every CPE.
+    :param positions: The position in the document of every package name.
+    """
+    return {cpe: min(package_names, key=positions.__getitem__) for cpe, package_names in unique_cpes.items()}
+
+
+def _assign_cves(match_results: dict[str, MatchResult], owners: dict[str, str], cpe_cves: dict[str, list]):
+    """
+    Adds the CVEs of every CPE to the result of the package owning the CPE (see _cpe_owners()), so a CPE shared by
+    several packages has its CVEs reported once.
+    """
+    with measure("result_aggregation"):
+        for cpe, cve_list in cpe_cves.items():
+            if cve_list:
+                match_results[owners[cpe]].cve_list += cve_list
+
+
+def _lookup_cve_ids(
+    unique_cpes: dict[str, list[str]],
+    cpe_cve_ids: dict[str, list[str]],
+    db_path: pathlib.Path,
+    range_index: Optional[CveRangeIndex],
+    chunk_size: int,
+    executor: Executor,
+    match_cache: Optional[MatchCache],
+    snapshot_path: Optional[pathlib.Path],
+    stats: Optional[MatchStats],
+):
+    """
+    Fills cpe_cve_ids with the CVE numbers of every CPE of unique_cpes, from the match cache or the database.
+    """
+    if match_cache is not None:
+        cpe_cve_ids.update(match_cache.get_many(unique_cpes))
+        count("match_cache_hits", len(cpe_cve_ids))
+    missing_cpes = [cpe for cpe in unique_cpes if cpe not in cpe_cve_ids]
+    count("cpes", len(unique_cpes))
 
     pbar = tqdm(
         total=len(unique_cpes),
+        initial=len(unique_cpes) - len(missing_cpes),
         desc="Checking CPEs for Known Issues",
         unit="cpes",
         mininterval=0,
@@ -261,38 +694,186 @@ def process(spdx_document: SPDXDocument, db_path: pathlib.Path):
         position=0,
         leave=True,
     )
-    if use_parallel:
-        with ProcessPoolExecutor() as executor:
-            future_result = {executor.submit(find_cves_for_cpe, cpe, db_path): cpe for cpe in unique_cpes}
-
-            for result in as_completed(future_result):
-                results_list.append(result.result())
-                pbar.update()
-
+    if range_index is not None:
+        # The index answers every CPE from memory, there is nothing left to spread across processes.
+        for cpe in missing_cpes:
+            cpe_cve_ids[cpe] = find_cve_ids_with_cpe(cpe, None, range_index)
+            pbar.update()
     else:
+        find_cve_ids = partial(find_cve_ids_for_cpes, snapshot_path=snapshot_path)
+        for chunk_results in _map_chunks(
+            find_cve_ids, list(_chunks(missing_cpes, chunk_size)), db_path, executor, pbar, stats
+        ):
+            cpe_cve_ids.update(chunk_results)
+
+    if match_cache is not None:
+        match_cache.put_many({cpe: cpe_cve_ids[cpe] for cpe in missing_cpes})
+
+
+async def iter_process_async(
+    spdx_document: SPDXDocument,
+    db_path: pathlib.Path,
+    executor: Optional[Executor] = None,
+    max_concurrency: int = MATCH_ASYNC_CONCURRENCY,
+    stats: Optional[MatchStats] = None,
+    range_index: Optional[CveRangeIndex] = None,
+    match_cache: Optional[MatchCache] = None,
+    snapshot_path: Optional[pathlib.Path] = None,
+) -> AsyncIterator[MatchResult]:
+    """
+    Matches the packages of the SPDX document and yields a MatchResult per package name as soon as all of the
+    package's CPEs have been checked. The results are those of process(): the CVEs of a CPE shared by several
+    packages are reported for the first of them in the document, so a package is only yielded once the CPEs of the
+    packages before it are resolved.
+
+    Every database lookup runs in the executor and at most max_concurrency of them are in flight at once, so several
+    scans can share one event loop. Cancelling the consumer, or closing the generator, cancels every lookup that has
+    not started yet.
+
+    :param spdx_document: The document with the packages to match.
+    :param db_path: Path of the vulnerability database.
+    :param executor: The executor for the lookups. It is left running when the scan is done. Without it a thread
+                     pool is created for the scan.
+    :param max_concurrency: Maximum number of lookups in flight.
+    :param stats: Where to record the time of every stage and the work done, see MatchStats.
+    :param range_index: An optional in-memory cve_range index. When given the CVE lookups run in the event loop's
+                        thread.
+    :param match_cache: A cache of earlier CPE results. Cached CPEs are not matched again and new results are added.
+    :param snapshot_path: An optional match snapshot of the database to look up the CVE ranges in.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = create_executor(MatchBackend.Thread, db_path, max_concurrency)
+
+    async def run(func, *args):
+        async with semaphore:
+            if stats is None:
+                return await loop.run_in_executor(executor, func, *args)
+
+            collect = partial(call_collecting, func, trace_queries=stats.queries is not None)
+            result, lookup_stats = await loop.run_in_executor(executor, collect, *args)
+            stats.merge(lookup_stats)
+            return result
+
+    # A CPE shared by several packages is only checked once.
+    cpe_tasks: dict[str, asyncio.Future] = {}
+    new_cve_ids: dict[str, list[str]] = {}
+
+    async def find_cves(cpe: str) -> list:
+        cve_ids = match_cache.get_many([cpe]).get(cpe) if match_cache is not None else None
+        if cve_ids is not None:
+            if stats is not None:
+                stats.count("match_cache_hits")
+        elif range_index is not None:
+            with collecting(stats):
+                cve_ids = find_cve_ids_with_cpe(cpe, None, range_index)
+        else:
+            [(_, cve_ids)] = await run(find_cve_ids_for_cpes, [cpe], db_path, snapshot_path)
+
+        if match_cache is not None:
+            new_cve_ids[cpe] = cve_ids
+
+        return await run(find_cves_by_number, cve_ids, db_path) if cve_ids else []
+
+    # Like process(), there is one result per package name.
+    packages = {
+        package.name: (package.name, package.version, generate_cpe_list(package.external_references))
+        for package in spdx_document.packages
+    }
+    resolutions = {
+        name: asyncio.ensure_future(run(process_package, *package, db_path)) for name, package in packages.items()
+    }
+
+    # The CPEs whose CVEs every package reports, see _cpe_owners().
+    owners: dict[str, str] = {}
+    owned_cpes: dict[str, asyncio.Future] = {name: loop.create_future() for name in packages}
+
+    async def assign_owners():
+        try:
+            for name, resolution in resolutions.items():
+                _, unique_cpes = await asyncio.shield(resolution)
+                owned_cpes[name].set_result([cpe for cpe in unique_cpes if owners.setdefault(cpe, name) == name])
+        except Exception as error:
+            for owned in owned_cpes.values():
+                if not owned.done():
+                    owned.set_exception(error)
+            raise
+
+    async def match_package(name: str) -> MatchResult:
+        results, unique_cpes = await asyncio.shield(resolutions[name])
         for cpe in unique_cpes:
-            result = find_cves_for_cpe(cpe, db_path)
-            results_list.append(result)
-            pbar.update()
+            if cpe not in cpe_tasks:
+                cpe_tasks[cpe] = asyncio.ensure_future(find_cves(cpe))
+                if stats is not None:
+                    stats.count("cpes")
 
-    for cpe in results_list:
-        if not cpe.cve_list:
-            continue
+        cpes = await asyncio.shield(owned_cpes[name])
+        cpe_cves = await asyncio.gather(*(asyncio.shield(cpe_tasks[cpe]) for cpe in cpes))
+        with collecting(stats):
+            _assign_cves(results, dict.fromkeys(cpes, name), dict(zip(cpes, cpe_cves)))
 
-        for package in unique_cpes[cpe.cpe]:
-            match_results[package.name].cve_list += cpe.cve_list
-            break
+        return results[name]
 
-    return list(match_results.values())
+    owners_task = asyncio.ensure_future(assign_owners())
+    tasks = [asyncio.ensure_future(match_package(name)) for name in packages]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+
+        if match_cache is not None:
+            match_cache.put_many(new_cve_ids)
+
+    finally:
+        for task in tasks + list(resolutions.values()) + list(cpe_tasks.values()) + [owners_task]:
+            task.cancel()
+        if owns_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def process_async(
+    spdx_document: SPDXDocument,
+    db_path: pathlib.Path,
+    executor: Optional[Executor] = None,
+    max_concurrency: int = MATCH_ASYNC_CONCURRENCY,
+    stats: Optional[MatchStats] = None,
+    range_index: Optional[CveRangeIndex] = None,
+    match_cache: Optional[MatchCache] = None,
+    snapshot_path: Optional[pathlib.Path] = None,
+) -> list[MatchResult]:
+    """
+    Asynchronous variant of process(), see iter_process_async().
+    """
+    results = iter_process_async(
+        spdx_document, db_path, executor, max_concurrency, stats, range_index, match_cache, snapshot_path
+    )
+    try:
+        with stats.scan() if stats is not None else contextlib.nullcontext():
+            return [result async for result in results]
+    finally:
+        await results.aclose()
+
+
+async def find_cve_with_cpe_async(
+    cpe: str, db_path: pathlib.Path, executor: Optional[Executor] = None
+) -> CpeMatchResult:
+    """
+    Asynchronous variant of find_cves_for_cpe(), the lookup runs in the executor (the loop's default executor when
+    none is given).
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, find_cves_for_cpe, cpe, db_path)
 
 
 def lookup_cpe_for_package(package_name: str, db_path: pathlib.Path) -> list[str] | None:
-    db = VulnerabilityDatabase(db_path.parent, db_path.name)
+    db = get_database(db_path)
     cpe_strings = []
 
-    query = f"SELECT cpe FROM cpe_dictionary WHERE product='{package_name}' AND deprecated='0'"
+    # Same shape as the cpe_dictionary (product, deprecated) index.
+    query = "SELECT cpe FROM cpe_dictionary WHERE product=? AND deprecated=?"
 
-    cursor = db.query_cache(query)
+    cursor = db.query_cache(query, (package_name, 0))
     if not cursor:
         return cpe_strings
 
@@ -312,39 +893,82 @@ def create_cpe_string(cpe: dict) -> str:
 
 
 def find_cves_for_cpe(cpe: str, db_path: pathlib.Path) -> CpeMatchResult:
-    db = VulnerabilityDatabase(db_path.parent, db_path.name)
-    # db = sqlite3.connect(db_path)
+    db = get_database(db_path)
 
     result = find_cve_with_cpe(cpe, db)
 
     return result
 
 
-def find_cve_with_cpe(cpe: str, db: VulnerabilityDatabase) -> CpeMatchResult:
+def find_cves_by_number(cve_ids: list[str], db_path: pathlib.Path) -> list:
+    """
+    Loads the CVEs of the given numbers, in that order, skipping those missing from the database.
+    """
+    with measure("cve_hydration"):
+        vulnerabilities = get_database(db_path).get_cves(cve_ids)
+    count("hydrated_cves", len(vulnerabilities))
+
+    return [vulnerabilities[cve] for cve in cve_ids if cve in vulnerabilities]
+
+
+def find_cve_ids_for_cpes(
+    cpes: list[str], db_path: pathlib.Path, snapshot_path: Optional[pathlib.Path] = None
+) -> list[tuple[str, list[str]]]:
+    """
+    Worker side of the CVE lookup: returns the matched CVE numbers for each CPE of the chunk.
+
+    :param snapshot_path: Match against this snapshot, mapped once per worker process, instead of the database.
+    """
+    if snapshot_path is not None:
+        index = snapshot_range_index(snapshot_path)
+        return [(cpe, find_cve_ids_with_cpe(cpe, None, index)) for cpe in cpes]
+
+    db = get_database(db_path)
+    return [(cpe, find_cve_ids_with_cpe(cpe, db)) for cpe in cpes]
+
+
+def find_cve_with_cpe(
+    cpe: str, db: VulnerabilityDatabase, range_index: Optional[CveRangeIndex] = None
+) -> CpeMatchResult:
     result = CpeMatchResult(cpe)
-    vendor, product, version = result.get_cpe_properties()
 
-    query = f"SELECT DISTINCT cve_number FROM cve_range WHERE product='{product}'"
-    second_query = f"AND product='{product}'"
-    if vendor != "*":
-        query += f" AND vendor='{vendor}'"
-        second_query += f" AND vendor='{vendor}'"
+    cve_ids = find_cve_ids_with_cpe(result, db, range_index)
+    with measure("cve_hydration"):
+        vulnerabilities = db.get_cves(cve_ids)
+    count("hydrated_cves", len(vulnerabilities))
+    for cve in cve_ids:
+        if cve in vulnerabilities:
+            result.append_cve(vulnerabilities[cve])
 
-    cursor = db.query_cache(query)
-    if not cursor:
-        return result
+    return result
 
-    res = cursor.fetchall()
 
-    try:
-        if not res:
-            return result
-        for cve in res:
-            include = cve_version_included(db, cve[0], product, version, sql_ex=second_query)
+def find_cve_ids_with_cpe(
+    cpe: str | CpeMatchResult, db: VulnerabilityDatabase, range_index: Optional[CveRangeIndex] = None
+) -> list[str]:
+    """
+    Finds the numbers of the CVEs that include the version of the CPE.
+
+    :param cpe: The CPE string or an already parsed CpeMatchResult.
+    :param db: The vulnerability database, used when no range index is given.
+    :param range_index: An optional in-memory index of the cve_range table.
+    """
+    if not isinstance(cpe, CpeMatchResult):
+        cpe = CpeMatchResult(cpe)
+    vendor, product, version = cpe.get_cpe_properties()
+
+    if range_index is not None:
+        ranges = range_index.version_ranges(product, vendor)
+    else:
+        ranges = query_version_ranges(db, product, vendor)
 
-            if include:
-                vuln = db.get_cve(cve[0])
-                result.append_cve(vuln)
+    cve_ids = []
+    try:
+        with measure("version_comparison"):
+            for cve in iter_matching_cves(ranges, VersionFactory.get_handler(product), version):
+                cve_ids.append(cve)
+        count("compared_cves", len(ranges))
+        count("matched_cves", len(cve_ids))
 
     except ValueError as vError:
         print(
@@ -352,12 +976,25 @@ def find_cve_with_cpe(cpe: str, db: VulnerabilityDatabase) -> CpeMatchResult:
             f" {vError}[/red]"
         )
 
-    return result
+    return cve_ids
+
+
+def query_version_ranges(db: VulnerabilityDatabase, product: str, vendor: str = "*") -> dict[str, list[VersionRange]]:
+    """
+    Loads every cve_range row of a product with a single query and groups the converted ranges by CVE number.
+    """
+    with measure("range_query"):
+        cursor = db.get_product_ranges(product, vendor)
+        rows = cursor.fetchall() if cursor else []
+    count("range_rows", len(rows))
+
+    return convert_ranges(product, rows)
 
 
 def cve_version_included(db: VulnerabilityDatabase, cve_id, package_name, package_version_str, sql_ex: str):
     cve = cve_id
-    package_version = VersionFactory.get_handler(package_name).convert(package_version_str)
+    handler = VersionFactory.get_handler(package_name)
+    package_version = handler.convert(package_version_str)
     if not sql_ex:
         sql_ex = f"AND product LIKE '{package_name}'"
     query = (
@@ -368,50 +1005,7 @@ def cve_version_included(db: VulnerabilityDatabase, cve_id, package_name, packag
 
     results = cursor.fetchall()
     for version in results:
-        vulnerable = bool(version[0])
-
-        if not vulnerable:
-            # The simplest way to deal with this is to ignore the result if it's not a true vulnerability.
-            continue
-
-        handler = VersionFactory.get_handler(package_name)
-        version_exact = handler.convert(version[1])
-        version_starting_including = version[2]
-        version_starting_excluding = version[3]
-        version_end_including = version[4]
-        version_end_excluding = version[5]
-        if version_exact == "*" and isinstance(package_version, semantic_version.Version):
-            version_start = handler.version_type.coerce("0")
-            inc_low = True
-            if version_starting_including:
-                version_start = handler.convert(version_starting_including)
-            elif version_starting_excluding:
-                version_start = handler.convert(version_starting_excluding)
-                inc_low = False
-
-            version_end = handler.version_type.coerce("10000")
-            inc_high = True
-            if version_end_including:
-                version_end = handler.convert(version_end_including)
-            elif version_end_excluding:
-                version_end = handler.convert(version_end_excluding)
-                inc_high = False
-
-            if isinstance(version_start, str) or isinstance(version_end, str):
-                return True
-            if inc_low and inc_high and (package_version >= version_start) and (package_version <= version_end):
-                return True
-            if inc_low and (package_version >= version_start) and (package_version < version_end):
-                return True
-            if inc_high and (package_version > version_start) and (package_version <= version_end):
-                return True
-            if (package_version > version_start) and (package_version < version_end):
-                return True
-
-        if isinstance(package_version, str) and package_version == "-":
-            return True
-
-        if package_version == version_exact:
+        if VersionRange.from_row(handler, version).includes(package_version):
             return True
     return False
 
@@ -426,25 +1020,50 @@ def generate_cpe_list(ext_refs) -> list[str]:
 
 
 def process_spdx_package(spdx_package, db_path):
-    match = MatchResult(name=spdx_package.name, version=spdx_package.version)
-    unique_cpes = {}
+    match_results, unique_cpes = process_package(
+        spdx_package.name, spdx_package.version, generate_cpe_list(spdx_package.external_references), db_path
+    )
+    return match_results, {cpe: [spdx_package] * len(names) for cpe, names in unique_cpes.items()}
+
+
+def process_package_chunk(packages: list[tuple[str, str, list[str]]], db_path: pathlib.Path):
+    """
+    Worker side of the CPE resolution: runs process_package for a chunk of (name, version, cpe list) tuples.
+    """
+    return [process_package(name, version, cpes, db_path) for name, version, cpes in packages]
+
+
+def process_package(name: str, version: str, cpes: list[str], db_path: pathlib.Path):
+    """
+    Resolves the CPEs of a package, looking them up in the CPE dictionary when the package has none.
+
+    :return: The MatchResult keyed by package name, and the package's CPEs mapped to the package name.
+    """
+    with measure("cpe_resolution"):
+        return _resolve_package_cpes(name, version, cpes, db_path)
+
+
+def _resolve_package_cpes(name: str, version: str, cpes: list[str], db_path: pathlib.Path):
+    count("packages")
+    match = MatchResult(name=name, version=version)
+    unique_cpes: dict[str, list[str]] = {}
     match_results = {}
 
-    cpes = generate_cpe_list(spdx_package.external_references)
     if cpes:
         for cpe in cpes:
             if cpe not in unique_cpes.keys():
-                unique_cpes[cpe] = [spdx_package]
+                unique_cpes[cpe] = [name]
             else:
-                unique_cpes[cpe].append(spdx_package)
+                unique_cpes[cpe].append(name)
             match.cpe_list.append(cpe)
     else:
-        looked_up_cpes = lookup_cpe_for_package(spdx_package.name, db_path)
-        new_cpe = CpeParser().parser(cpe_factory(spdx_package.name, spdx_package.version))
+        count("cpe_lookups")
+        looked_up_cpes = lookup_cpe_for_package(name, db_path)
+        new_cpe = CpeParser().parser(cpe_factory(name, version))
         if not looked_up_cpes:
             new_cpe_str = create_cpe_string(new_cpe)
             if new_cpe_str not in unique_cpes:
-                unique_cpes[new_cpe_str] = [spdx_package]
+                unique_cpes[new_cpe_str] = [name]
             match.cpe_list.append(new_cpe_str)
         else:
             for cpe in looked_up_cpes:
@@ -453,11 +1072,11 @@ def process_spdx_package(spdx_package, db_path):
                 new_cpe["vendor"] = parsed_cpe["vendor"]
                 new_cpe_str = create_cpe_string(new_cpe)
                 if new_cpe_str not in unique_cpes.keys():
-                    unique_cpes[new_cpe_str] = [spdx_package]
+                    unique_cpes[new_cpe_str] = [name]
                 else:
-                    unique_cpes[new_cpe_str].append(spdx_package)
+                    unique_cpes[new_cpe_str].append(name)
                 if new_cpe_str not in match.cpe_list:
                     match.cpe_list.append(new_cpe_str)
 
-    match_results[spdx_package.name] = match
+    match_results[name] = match
     return match_results, unique_cpes
@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+import sqlite3
+
+from typing import Final
+
+from ics_sbom_libs.common.dbproperties import DBProperties
+from ics_sbom_libs.cve_fetch.connection_registry import get_database
+
+# Part of every cache key. Bump it whenever the matching rules change so old results are not reused.
+MATCH_CACHE_FORMAT: Final = "1"
+
+
+class MatchCache:
+    """
+    Disk backed cache of CPE -> matched CVE numbers.
+
+    The results are stored next to the vulnerability database and are keyed by the CPE string and the database's
+    content version. Every write of NVD data changes that version, so results computed against older data are never
+    returned and are purged the next time the cache is opened.
+    """
+
+    def __init__(self, cache_path: pathlib.Path, db_version: str):
+        self.cache_path = cache_path
+        self.db_version = db_version
+
+        self.con = sqlite3.connect(cache_path, timeout=30)
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS cpe_match ("
+            "cpe text NOT NULL PRIMARY KEY, db_version text NOT NULL, cve_ids text NOT NULL)"
+        )
+        self.con.execute("DELETE FROM cpe_match WHERE db_version != ?", (self.db_version,))
+        self.con.commit()
+
+    def __del__(self):
+        self.close()
+
+    @staticmethod
+    def database_version(db_path: pathlib.Path | DBProperties) -> str | None:
+        """
+        The cache key version for the current content of the database, None if the database has no content version.
+        """
+        db_version = get_database(db_path).content_version
+        if db_version is None:
+            return None
+
+        return f"{MATCH_CACHE_FORMAT}:{db_version}"
+
+    @classmethod
+    def for_database(cls, db_path: pathlib.Path | DBProperties):
+        """
+        Opens the cache of the given vulnerability database, None if the database has no content version yet or is
+        on a PostgreSQL server, which has no local directory to keep the cache in.
+        """
+        if isinstance(db_path, DBProperties):
+            return None
+
+        db_version = cls.database_version(db_path)
+        if db_version is None:
+            return None
+
+        return cls(cache_path_for(db_path), db_version)
+
+    def get_many(self, cpes) -> dict[str, list[str]]:
+        """
+        Returns the cached CVE numbers of every given CPE that is in the cache.
+        """
+        found: dict[str, list[str]] = {}
+        if not self.con:
+            return found
+
+        cpes = list(cpes)
+        for start in range(0, len(cpes), 500):
+            end = start + 500
+            chunk = cpes[start:end]
+            cursor = self.con.execute(
+                f"SELECT cpe, cve_ids FROM cpe_match WHERE db_version=? AND cpe IN ({', '.join('?' * len(chunk))})",
+                (self.db_version, *chunk),
+            )
+            for cpe, cve_ids in cursor:
+                found[cpe] = cve_ids.split() if cve_ids else []
+
+        return found
+
+    def put_many(self, cpe_cve_ids: dict[str, list[str]]):
+        if not self.con or not cpe_cve_ids:
+            return
+
+        self.con.executemany(
+            "INSERT INTO cpe_match (cpe, db_version, cve_ids) VALUES (?, ?, ?) "
+            "ON CONFLICT (cpe) DO UPDATE SET db_version=excluded.db_version, cve_ids=excluded.cve_ids",
+            ((cpe, self.db_version, " ".join(cve_ids)) for cpe, cve_ids in cpe_cve_ids.items()),
+        )
+        self.con.commit()
+
+    def clear(self):
+        if not self.con:
+            return
+
+        self.con.execute("DELETE FROM cpe_match")
+        self.con.commit()
+
+    def close(self):
+        if getattr(self, "con", None):
+            self.con.close()
+            self.con = None
+
+
+def cache_path_for(db_path: pathlib.Path) -> pathlib.Path:
+    return db_path.parent / f"{db_path.stem}_match_cache.db"
@@ -0,0 +1,182 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import contextlib
+import json
+import threading
+import time
+
+from typing import Final
+
+from ics_sbom_libs.cve_fetch.query_trace import QueryTrace, tracing
+
+# The stages of a scan, in the order they run for a CPE.
+MATCH_STAGES: Final = (
+    "cpe_resolution",
+    "range_query",
+    "version_conversion",
+    "version_comparison",
+    "cve_hydration",
+    "result_aggregation",
+)
+
+# The stats the current thread records into, see collecting().
+_local = threading.local()
+_not_collecting = contextlib.nullcontext()
+
+
+class StageStats:
+    """
+    Number of runs of a stage and the wall and CPU time they took.
+    """
+
+    __slots__ = ("calls", "wall_sec", "cpu_sec")
+
+    def __init__(self, calls: int = 0, wall_sec: float = 0.0, cpu_sec: float = 0.0):
+        self.calls = calls
+        self.wall_sec = wall_sec
+        self.cpu_sec = cpu_sec
+
+    def to_dict(self) -> dict:
+        return {"calls": self.calls, "wall_sec": self.wall_sec, "cpu_sec": self.cpu_sec}
+
+
+class MatchStats:
+    """
+    Time spent in every stage of a scan and counters of the work done (packages, CPEs, range rows, comparisons,
+    CVEs ...).
+
+    Workers record into stats of their own, which are sent back with their results and merged, so the times of a
+    parallel scan are the sums over every worker: the CPU time of a stage can exceed the wall time of the scan.
+    With trace_queries the database queries are traced as well, into queries (see query_trace.py).
+    """
+
+    def __init__(self, trace_queries: bool = False):
+        self.stages: dict[str, StageStats] = {stage: StageStats() for stage in MATCH_STAGES}
+        self.counters: dict[str, int] = {}
+        # Wall and CPU time of the whole scan, as seen by the process that started it.
+        self.scan_wall_sec = 0.0
+        self.scan_cpu_sec = 0.0
+        self.queries: QueryTrace | None = QueryTrace() if trace_queries else None
+
+    def record(self, stage: str, wall_sec: float, cpu_sec: float, calls: int = 1):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = StageStats()
+
+        stats.calls += calls
+        stats.wall_sec += wall_sec
+        stats.cpu_sec += cpu_sec
+
+    def count(self, counter: str, value: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextlib.contextmanager
+    def stage(self, stage: str):
+        """
+        Records the time spent in the with block as one run of the stage.
+        """
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, time.thread_time() - cpu_start)
+
+    @contextlib.contextmanager
+    def scan(self):
+        """
+        Records the time of the with block as the time of the whole scan.
+        """
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.scan_wall_sec += time.perf_counter() - start
+            self.scan_cpu_sec += time.process_time() - cpu_start
+
+    def merge(self, other: "MatchStats | dict"):
+        """
+        Adds the stages and counters of other, a MatchStats or its to_dict().
+        """
+        if isinstance(other, MatchStats):
+            other = other.to_dict()
+
+        for stage, values in other["stages"].items():
+            self.record(stage, values["wall_sec"], values["cpu_sec"], values["calls"])
+        for counter, value in other["counters"].items():
+            self.count(counter, value)
+        if self.queries is not None and other.get("queries"):
+            self.queries.merge(other["queries"])
+
+    def to_dict(self) -> dict:
+        return {
+            "scan_wall_sec": self.scan_wall_sec,
+            "scan_cpu_sec": self.scan_cpu_sec,
+            "stages": {stage: stats.to_dict() for stage, stats in self.stages.items()},
+            "counters": dict(self.counters),
+            "queries": self.queries.to_dict() if self.queries is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "MatchStats":
+        stats = cls(trace_queries=bool(values.get("queries")))
+        stats.merge(values)
+        stats.scan_wall_sec = values.get("scan_wall_sec", 0.0)
+        stats.scan_cpu_sec = values.get("scan_cpu_sec", 0.0)
+        return stats
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def current_stats() -> MatchStats | None:
+    """
+    The stats the current thread records into, None when it does not collect any.
+    """
+    return getattr(_local, "stats", None)
+
+
+@contextlib.contextmanager
+def collecting(stats: MatchStats | None):
+    """
+    Makes stats the stats of the current thread for the with block, and traces the queries of the block into its
+    query trace if it has one. None stops collecting in the block.
+    """
+    previous = current_stats()
+    _local.stats = stats
+    try:
+        if stats is not None and stats.queries is not None:
+            with tracing(stats.queries):
+                yield stats
+        else:
+            yield stats
+    finally:
+        _local.stats = previous
+
+
+def measure(stage: str):
+    """
+    Records the with block as a run of the stage in the stats of the current thread, if it collects any.
+    """
+    stats = current_stats()
+    return stats.stage(stage) if stats is not None else _not_collecting
+
+
+def count(counter: str, value: int = 1):
+    stats = current_stats()
+    if stats is not None:
+        stats.count(counter, value)
+
+
+def call_collecting(func, *args, trace_queries: bool = False) -> tuple:
+    """
+    Runs func(*args) in a worker while collecting stats, and returns its result with the to_dict() of the stats for
+    the caller to merge.
+    """
+    with collecting(MatchStats(trace_queries)) as stats:
+        result = func(*args)
+
+    return result, stats.to_dict()
@@ -4,6 +4,15 @@
 from .base import VersionHandler, invalid_version_list
 from .buildversion import BuildVersion
 from .versionfactory import VersionFactory
+from .versionrange import VersionRange, iter_matching_cves
 from . import handlers
 
-__all__ = ["VersionHandler", "invalid_version_list", "BuildVersion", "VersionFactory", "handlers"]
+__all__ = [
+    "VersionHandler",
+    "invalid_version_list",
+    "BuildVersion",
+    "VersionFactory",
+    "VersionRange",
+    "iter_matching_cves",
+    "handlers",
+]
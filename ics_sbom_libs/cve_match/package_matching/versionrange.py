@@ -0,0 +1,152 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import semantic_version
+
+from beartype.typing import Iterator
+
+from ics_sbom_libs.cve_match.package_matching import VersionHandler
+
+
+class _ConversionError:
+    """Holds an exception raised while converting a bound so it is only raised if the bound is actually used."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def _convert(handler: VersionHandler, ver: str, cache: dict | None):
+    if cache is not None and ver in cache:
+        return cache[ver]
+
+    try:
+        converted = handler.convert(ver)
+    except Exception as e:
+        converted = _ConversionError(e)
+
+    if cache is not None:
+        cache[ver] = converted
+
+    return converted
+
+
+def _resolve(value):
+    if isinstance(value, _ConversionError):
+        raise value.error
+
+    return value
+
+
+class VersionRange:
+    """
+    A single row of the cve_range table with its version bounds already converted by the package's VersionHandler.
+
+    The comparison rules are the ones the matcher has always used for a cve_range row, they are only evaluated against
+    values that were converted once instead of once per lookup.
+    """
+
+    __slots__ = ("vulnerable", "_exact", "_start", "_inc_low", "_end", "_inc_high")
+
+    def __init__(
+        self,
+        handler: VersionHandler,
+        vulnerable,
+        version: str,
+        start_including: str = "",
+        start_excluding: str = "",
+        end_including: str = "",
+        end_excluding: str = "",
+        cache: dict | None = None,
+    ):
+        self.vulnerable = bool(vulnerable)
+        self._exact = None
+        self._start = None
+        self._inc_low = True
+        self._end = None
+        self._inc_high = True
+
+        if not self.vulnerable:
+            # Non vulnerable rows are never compared, so there is no need to convert them.
+            return
+
+        self._exact = _convert(handler, version, cache)
+        if self._exact != "*":
+            return
+
+        self._start = handler.version_type.coerce("0")
+        if start_including:
+            self._start = _convert(handler, start_including, cache)
+        elif start_excluding:
+            self._start = _convert(handler, start_excluding, cache)
+            self._inc_low = False
+
+        self._end = handler.version_type.coerce("10000")
+        if end_including:
+            self._end = _convert(handler, end_including, cache)
+        elif end_excluding:
+            self._end = _convert(handler, end_excluding, cache)
+            self._inc_high = False
+
+    @classmethod
+    def from_row(cls, handler: VersionHandler, row, cache: dict | None = None):
+        """
+        Creates a VersionRange from a row ordered as (vulnerable, version, versionStartIncluding,
+        versionStartExcluding, versionEndIncluding, versionEndExcluding).
+        """
+        return cls(handler, *row[:6], cache=cache)
+
+    def includes(self, package_version) -> bool:
+        if not self.vulnerable:
+            # The simplest way to deal with this is to ignore the result if it's not a true vulnerability.
+            return False
+
+        version_exact = _resolve(self._exact)
+        if version_exact == "*" and isinstance(package_version, semantic_version.Version):
+            version_start = _resolve(self._start)
+            version_end = _resolve(self._end)
+            inc_low = self._inc_low
+            inc_high = self._inc_high
+
+            if isinstance(version_start, str) or isinstance(version_end, str):
+                return True
+            if inc_low and inc_high and (package_version >= version_start) and (package_version <= version_end):
+                return True
+            if inc_low and (package_version >= version_start) and (package_version < version_end):
+                return True
+            if inc_high and (package_version > version_start) and (package_version <= version_end):
+                return True
+            if (package_version > version_start) and (package_version < version_end):
+                return True
+
+        if isinstance(package_version, str) and package_version == "-":
+            return True
+
+        if package_version == version_exact:
+            return True
+
+        return False
+
+
+def iter_matching_cves(
+    cve_ranges: dict[str, list[VersionRange]], handler: VersionHandler, package_version_str: str
+) -> Iterator[str]:
+    """
+    Yields the CVE numbers, in the order of the given dictionary, that have at least one range including the
+    package version.
+
+    :param cve_ranges: The ranges of a product grouped by CVE number.
+    :param handler: The version handler for the product.
+    :param package_version_str: The version of the package as found in the CPE.
+    """
+    if not cve_ranges:
+        return
+
+    package_version = handler.convert(package_version_str)
+    for cve_id, ranges in cve_ranges.items():
+        for version_range in ranges:
+            if version_range.includes(package_version):
+                yield cve_id
+                break
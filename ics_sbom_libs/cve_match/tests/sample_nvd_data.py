@@ -0,0 +1,134 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+
+def make_cpe_match(vendor: str, product: str, version: str = "*", vulnerable: bool = True, **bounds):
+    cpe_match = {"vulnerable": vulnerable, "criteria": f"cpe:2.3:a:{vendor}:{product}:{version}:*:*:*:*:*:*:*"}
+    cpe_match.update(bounds)
+    return cpe_match
+
+
+def make_cve(
+    cve_id: str,
+    cpe_matches: list,
+    severity: str = "HIGH",
+    score: float = 7.5,
+    cwes: list = None,
+    description: str = None,
+):
+    return {
+        "cve": {
+            "id": cve_id,
+            "published": "2023-01-01T00:00:00.000",
+            "lastModified": "2023-06-01T00:00:00.000",
+            "descriptions": [{"lang": "en", "value": description or f"Description of {cve_id}"}],
+            "metrics": {
+                "cvssMetricV31": [
+                    {
+                        "cvssData": {
+                            "version": "3.1",
+                            "vectorString": "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:N/A:N",
+                            "baseScore": score,
+                            "baseSeverity": severity,
+                        }
+                    }
+                ]
+            },
+            "weaknesses": [{"description": [{"lang": "en", "value": cwe}]} for cwe in cwes or ["CWE-787"]],
+            "configurations": [{"nodes": [{"operator": "OR", "negate": False, "cpeMatch": cpe_matches}]}],
+        }
+    }
+
+
+def make_cve_page(cves: list, start_index: int = 0, total_results: int = None):
+    return {
+        "resultsPerPage": len(cves),
+        "startIndex": start_index,
+        "totalResults": len(cves) if total_results is None else total_results,
+        "format": "NVD_CVE",
+        "version": "2.0",
+        "timestamp": "2023-06-02T00:00:00.000",
+        "vulnerabilities": cves,
+    }
+
+
+def make_cpe_product(cpe_id: str, vendor: str, product: str, version: str = "*", deprecated: bool = False):
+    return {
+        "cpe": {
+            "deprecated": deprecated,
+            "cpeName": f"cpe:2.3:a:{vendor}:{product}:{version}:*:*:*:*:*:*:*",
+            "cpeNameId": cpe_id,
+            "lastModified": "2023-06-01T00:00:00.000",
+            "created": "2023-01-01T00:00:00.000",
+        }
+    }
+
+
+def make_cpe_page(products: list, start_index: int = 0, total_results: int = None):
+    return {
+        "resultsPerPage": len(products),
+        "startIndex": start_index,
+        "totalResults": len(products) if total_results is None else total_results,
+        "format": "NVD_CPE",
+        "version": "2.0",
+        "timestamp": "2023-06-02T00:00:00.000",
+        "products": products,
+    }
+
+
+SAMPLE_CVES = [
+    make_cve(
+        "CVE-2023-0001",
+        [make_cpe_match("openssl", "openssl", versionStartIncluding="1.1.1", versionEndExcluding="1.1.1t")],
+    ),
+    make_cve("CVE-2023-0002", [make_cpe_match("openssl", "openssl", "3.0.7")], severity="CRITICAL", score=9.8),
+    make_cve(
+        "CVE-2023-0003",
+        [
+            make_cpe_match("gnu", "glibc", versionEndIncluding="2.36"),
+            make_cpe_match("debian", "debian_linux", "11.0", vulnerable=False),
+        ],
+        severity="MEDIUM",
+        score=5.5,
+        cwes=["CWE-125", "CWE-787"],
+    ),
+    make_cve(
+        "CVE-2023-0004",
+        [make_cpe_match("busybox", "busybox", versionStartExcluding="1.30", versionEndExcluding="1.36")],
+    ),
+    make_cve(
+        "CVE-2023-0005",
+        [make_cpe_match("linux", "linux_kernel", versionStartIncluding="5.10", versionEndExcluding="5.15.90")],
+    ),
+    make_cve("CVE-2023-0006", [make_cpe_match("zlib", "zlib", "-")], severity="LOW", score=2.0),
+    make_cve("CVE-2023-0007", [make_cpe_match("glibc_project", "glibc", "2.35")]),
+]
+
+SAMPLE_CPES = [
+    make_cpe_product("00000000-0000-0000-0000-000000000001", "openssl", "openssl", "3.0.7"),
+    make_cpe_product("00000000-0000-0000-0000-000000000002", "gnu", "glibc", "2.35"),
+    make_cpe_product("00000000-0000-0000-0000-000000000003", "gnu", "glibc", "2.30", deprecated=True),
+    make_cpe_product("00000000-0000-0000-0000-000000000004", "busybox", "busybox", "1.35.0"),
+]
+
+
+def create_sample_database(
+    cache_dir: pathlib.Path, db_file: str = "nvd_test.db", db_properties=None, store_configurations: bool = False
+):
+    db = VulnerabilityDatabase(
+        cache_dir, db_file, api_key="none", db_properties=db_properties, store_configurations=store_configurations
+    )
+    if db_properties is not None:
+        db._backend.reset(db.con)
+    db._process_cve_data_(make_cve_page(SAMPLE_CVES))
+    db._process_cpe_data_(make_cpe_page(SAMPLE_CPES))
+    db.con.commit()
+    db.con.close()
+    db.con = None
+
+    return db.location
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+import tempfile
+import unittest
+
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import BULK_INGEST_TABLES, VulnerabilityDatabase
+
+from sample_nvd_data import SAMPLE_CVES, create_sample_database, make_cve, make_cpe_match, make_cve_page
+
+
+def _index_names(db: VulnerabilityDatabase, tables: list[str]):
+    curs = db.con.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"
+        f" AND tbl_name IN ({', '.join('?' * len(tables))}) ORDER BY name",
+        tables,
+    )
+    return [row[0] for row in curs.fetchall()]
+
+
+class BulkIngestTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        db_path = create_sample_database(pathlib.Path(self._tmp_dir.name))
+        self.db = VulnerabilityDatabase(db_path.parent, db_path.name, api_key="none")
+
+    def tearDown(self):
+        self.db.con.close()
+        self._tmp_dir.cleanup()
+
+    def test_deferred_indexes_are_restored(self):
+        tables = BULK_INGEST_TABLES["cve"]
+        indexes = _index_names(self.db, tables)
+        self.assertTrue(indexes)
+
+        self.db._enable_bulk_ingest()
+        self.db._defer_indexes(tables)
+        self.assertEqual([], _index_names(self.db, tables))
+
+        self.db._restore_deferred_indexes(tables)
+        self.db._finish_bulk_ingest()
+        self.assertEqual(indexes, _index_names(self.db, tables))
+        self.assertEqual("wal", self.db.con.execute("PRAGMA journal_mode").fetchone()[0])
+
+    def test_reloading_a_page_replaces_ranges(self):
+        count_query = "SELECT COUNT(*) FROM cve_range"
+        ranges = self.db.con.execute(count_query).fetchone()[0]
+
+        self.db._process_cve_data_(make_cve_page(SAMPLE_CVES))
+        self.db.con.commit()
+
+        self.assertEqual(ranges, self.db.con.execute(count_query).fetchone()[0])
+
+    def test_merge_only_touches_changed_rows(self):
+        def range_ids(cve_number):
+            curs = self.db.con.execute("SELECT id FROM cve_range_entry WHERE cve_number=? ORDER BY id", (cve_number,))
+            return [row[0] for row in curs.fetchall()]
+
+        unchanged = range_ids("CVE-2023-0003")
+        counts = self.db._process_cve_data_(make_cve_page(SAMPLE_CVES))
+        self.assertEqual(counts["cves_updated"], len(SAMPLE_CVES))
+        self.assertEqual(counts["ranges_inserted"] + counts["ranges_deleted"], 0)
+        self.assertEqual(counts["weaknesses_inserted"] + counts["weaknesses_deleted"], 0)
+        self.assertEqual(unchanged, range_ids("CVE-2023-0003"))
+
+        page = [
+            make_cve("CVE-2023-0001", [make_cpe_match("openssl", "openssl", versionEndExcluding="1.1.1u")]),
+            make_cve("CVE-2023-9999", [make_cpe_match("zlib", "zlib", "1.2.13")], cwes=["CWE-20", "CWE-20"]),
+        ]
+        counts = self.db._process_cve_data_(make_cve_page(page))
+        self.db.con.commit()
+        self.assertEqual(counts["cves_inserted"], 1)
+        self.assertEqual(counts["cves_updated"], 1)
+        self.assertEqual(counts["ranges_inserted"], 2)
+        self.assertEqual(counts["ranges_deleted"], 1)
+        self.assertEqual(counts["weaknesses_inserted"], 1)
+        self.assertEqual(
+            self.db.con.execute(
+                "SELECT versionEndExcluding FROM cve_range WHERE cve_number='CVE-2023-0001'"
+            ).fetchall(),
+            [("1.1.1u",)],
+        )
+
+    def test_merge_looks_up_staged_rows_by_index(self):
+        statements = []
+        self.db.con.set_trace_callback(statements.append)
+        # A CVE listed twice in a page is counted once.
+        counts = self.db._process_cve_data_(make_cve_page(SAMPLE_CVES + SAMPLE_CVES[:1]))
+        self.db.con.set_trace_callback(None)
+        self.assertEqual((counts["cves_inserted"], counts["cves_updated"]), (0, len(SAMPLE_CVES)))
+
+        merges = [statement for statement in statements if "NOT EXISTS (SELECT" in statement]
+        self.assertEqual(len(merges), 4)
+        for statement in merges:
+            with self.subTest(statement=statement):
+                plan = [row[3] for row in self.db.con.execute(f"EXPLAIN QUERY PLAN {statement}")]
+                # Every row of the staged CVEs is compared through an index, never by scanning the other table.
+                self.assertEqual([line for line in plan if line.startswith("SCAN") and line != "SCAN staging_cve"], [])
+
+        page = [make_cve("CVE-2023-9999", [make_cpe_match("zlib", "zlib", "1.2.13")])] * 2
+        counts = self.db._process_cve_data_(make_cve_page(page))
+        self.assertEqual((counts["cves_inserted"], counts["cves_updated"]), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
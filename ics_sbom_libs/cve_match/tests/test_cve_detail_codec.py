@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import json
+import pathlib
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+
+from ics_sbom_libs.benchmarks.nvd_stand_in import NvdStandIn
+from ics_sbom_libs.cve_fetch.cve_detail_codec import DETAIL_DICT_MIN_SAMPLES
+from ics_sbom_libs.cve_fetch.nvd_downloader import NvdDownloader
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+from sample_nvd_data import SAMPLE_CPES, SAMPLE_CVES, create_sample_database, make_cve, make_cpe_match, make_cve_page
+
+
+def _many_cves(count: int):
+    components = ["web interface", "SMB server", "XML parser", "kernel driver", "TLS handshake"]
+    impacts = ["execute arbitrary code", "cause a denial of service", "read sensitive files", "gain privileges"]
+    return [
+        make_cve(
+            f"CVE-2022-{number:05d}",
+            [make_cpe_match(f"vendor{number % 50}", f"product{number % 70}", versionEndExcluding="2.0")],
+            description=(
+                f"A vulnerability in the {components[number % 5]} of Product {number % 70} before 2.0.{number % 9}"
+                f" allows remote attackers to {impacts[number % 4]} via a crafted request, aka issue {number}."
+            ),
+        )
+        for number in range(count)
+    ]
+
+
+class CveDetailCodecTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        db_path = create_sample_database(pathlib.Path(self._tmp_dir.name), store_configurations=True)
+        self.db = VulnerabilityDatabase(db_path.parent, db_path.name, api_key="none", store_configurations=True)
+
+    def tearDown(self):
+        self.db.con.close()
+        self._tmp_dir.cleanup()
+
+    def test_round_trip_without_dictionary(self):
+        self.assertIsNone(self.db._detail_codec.dict_id)
+
+        cve = SAMPLE_CVES[0]["cve"]
+        self.assertEqual(cve["descriptions"][0]["value"], self.db.get_cve(cve["id"]).description)
+        self.assertEqual(cve["configurations"], self.db.get_cve_configurations(cve["id"]))
+
+    def test_round_trip_with_dictionary(self):
+        cves = _many_cves(DETAIL_DICT_MIN_SAMPLES)
+        self.db._process_cve_data_(make_cve_page(cves))
+        self.db.con.commit()
+
+        self.assertIsNotNone(self.db._detail_codec.dict_id)
+
+        # Rows written before the dictionary existed are still readable.
+        self.assertEqual(
+            SAMPLE_CVES[0]["cve"]["descriptions"][0]["value"], self.db.get_cve("CVE-2023-0001").description
+        )
+
+        loaded = self.db.get_cves([cve["cve"]["id"] for cve in cves])
+        for cve in cves:
+            self.assertEqual(cve["cve"]["descriptions"][0]["value"], loaded[cve["cve"]["id"]].description)
+
+        plain = sum(
+            len(cve["cve"]["descriptions"][0]["value"]) + len(json.dumps(cve["cve"]["configurations"])) for cve in cves
+        )
+        stored = self.db.con.execute(
+            "SELECT SUM(LENGTH(description) + LENGTH(configurations)) FROM cve_detail WHERE dict_id IS NOT NULL"
+        ).fetchone()[0]
+        self.assertLess(stored, plain / 2)
+
+    def test_configurations_not_stored_by_default(self):
+        db_path = create_sample_database(pathlib.Path(self._tmp_dir.name), "nvd_default.db")
+        db = VulnerabilityDatabase(db_path.parent, db_path.name, api_key="none")
+        self.addCleanup(db.con.close)
+
+        self.assertIsNone(db.get_cve_configurations("CVE-2023-0001"))
+        self.assertEqual(SAMPLE_CVES[0]["cve"]["descriptions"][0]["value"], db.get_cve("CVE-2023-0001").description)
+
+    def test_rollback_drops_dictionary(self):
+        self.db._process_cve_data_(make_cve_page(_many_cves(DETAIL_DICT_MIN_SAMPLES)))
+        self.assertIsNotNone(self.db._detail_codec.dict_id)
+        self.db._rollback()
+
+        # The next write must not refer to the dictionary that was rolled back.
+        self.assertIsNone(self.db._detail_codec.dict_id)
+        cve = make_cve("CVE-2022-99999", [make_cpe_match("vendor", "product")], description="After the rollback")
+        self.db._process_cve_data_(make_cve_page([cve]))
+        self.db.con.commit()
+
+        other = VulnerabilityDatabase(self.db.cache_dir, self.db.db_file_name, api_key="none")
+        self.addCleanup(other.con.close)
+        self.assertEqual("After the rollback", other.get_cve("CVE-2022-99999").description)
+
+    def test_reset_drops_dictionary(self):
+        cves = _many_cves(DETAIL_DICT_MIN_SAMPLES)
+        self.db._process_cve_data_(make_cve_page(cves))
+        self.db.con.commit()
+        self.assertEqual(cves[0]["cve"]["descriptions"][0]["value"], self.db.get_cve("CVE-2022-00000").description)
+
+        # An update more than 100 days after the last one starts over from an empty database.
+        for src_name in ("cve", "cpe"):
+            self.db._set_status_value(f"initial_{src_name}_download_completed", True)
+            self.db._set_status_value(f"{src_name}_last_updated", (datetime.utcnow() - timedelta(days=200)).isoformat())
+
+        update = cves[:100] + [make_cve("CVE-2022-99999", [make_cpe_match("vendor", "product")], description="New")]
+        with NvdStandIn(update, SAMPLE_CPES) as stand_in:
+            self.db.create_database(
+                downloader=NvdDownloader(base_url=stand_in.base_url, requests_per_window=1000, retry_delay=0)
+            )
+
+        other = VulnerabilityDatabase(self.db.cache_dir, self.db.db_file_name, api_key="none")
+        self.addCleanup(other.con.close)
+        self.assertNotIn("CVE-2023-0001", other.get_cves(["CVE-2023-0001"]))
+        self.assertEqual("New", other.get_cve("CVE-2022-99999").description)
+        self.assertEqual(cves[0]["cve"]["descriptions"][0]["value"], other.get_cve("CVE-2022-00000").description)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+import tempfile
+import unittest
+
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+from ics_sbom_libs.cve_match.cvematcher import find_cve_with_cpe, cpe_factory
+from ics_sbom_libs.cve_match.cve_range_index import CveRangeIndex
+
+from sample_nvd_data import create_sample_database
+
+_test_cpes = [
+    cpe_factory("openssl", "1.1.1k", "openssl"),
+    cpe_factory("openssl", "1.1.1t", "openssl"),
+    cpe_factory("openssl", "3.0.7", "openssl"),
+    cpe_factory("openssl", "3.0.7"),
+    cpe_factory("glibc", "2.35"),
+    cpe_factory("glibc", "2.35", "gnu"),
+    cpe_factory("glibc", "2.37", "gnu"),
+    cpe_factory("busybox", "1.30"),
+    cpe_factory("busybox", "1.35.0"),
+    cpe_factory("linux_kernel", "5.15.71"),
+    cpe_factory("linux_kernel", "5.15.90"),
+    cpe_factory("zlib", "1.2.13"),
+    cpe_factory("debian_linux", "11.0"),
+    cpe_factory("unknown", "1.0"),
+]
+
+
+class CveRangeIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        db_path = create_sample_database(pathlib.Path(self._tmp_dir.name))
+        self.db = VulnerabilityDatabase(db_path.parent, db_path.name, api_key="none")
+
+    def tearDown(self):
+        self.db.con.close()
+        self.db.con = None
+        self._tmp_dir.cleanup()
+
+    def test_row_count(self):
+        index = CveRangeIndex.from_database(self.db)
+        self.assertEqual(index.row_count, 8)
+
+    def test_matches_sql_results(self):
+        index = CveRangeIndex.from_database(self.db)
+
+        for cpe in _test_cpes:
+            with self.subTest(cpe=cpe):
+                expected = find_cve_with_cpe(cpe, self.db)
+                result = find_cve_with_cpe(cpe, self.db, index)
+                self.assertEqual(
+                    sorted(cve.cve_number for cve in result.cve_list),
+                    sorted(cve.cve_number for cve in expected.cve_list),
+                )
+
+    def test_expected_matches(self):
+        index = CveRangeIndex.from_database(self.db)
+
+        def match(cpe):
+            return sorted(cve.cve_number for cve in find_cve_with_cpe(cpe, self.db, index).cve_list)
+
+        self.assertEqual(match(cpe_factory("openssl", "1.1.1k", "openssl")), ["CVE-2023-0001"])
+        self.assertEqual(match(cpe_factory("openssl", "1.1.1t", "openssl")), [])
+        self.assertEqual(match(cpe_factory("glibc", "2.35")), ["CVE-2023-0003", "CVE-2023-0007"])
+        self.assertEqual(match(cpe_factory("glibc", "2.35", "gnu")), ["CVE-2023-0003"])
+        self.assertEqual(match(cpe_factory("debian_linux", "11.0")), [])
+
+    def test_bulk_hydration(self):
+        cves = self.db.get_cves(["CVE-2023-0003", "CVE-2023-0002", "CVE-2099-0000", "CVE-2023-0003"])
+        self.assertEqual(sorted(cves.keys()), ["CVE-2023-0002", "CVE-2023-0003"])
+
+        for cve_number, cve in cves.items():
+            single = self.db.get_cve(cve_number)
+            self.assertEqual(cve, single)
+            self.assertEqual(cve.description, single.description)
+            self.assertEqual(sorted(cve.cwes), sorted(single.cwes))
+
+        self.assertEqual(sorted(cves["CVE-2023-0003"].cwes), ["CWE-125", "CWE-787"])
+
+
+if __name__ == "__main__":
+    unittest.main()
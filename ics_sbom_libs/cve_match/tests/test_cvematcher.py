@@ -0,0 +1,214 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import asyncio
+import json
+import pathlib
+import tempfile
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+from ics_sbom_libs.cve_match.cvematcher import CveMatcher, MatchBackend, iter_process_async
+from ics_sbom_libs.cve_match.match_stats import MATCH_STAGES
+
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+from sample_nvd_data import create_sample_database, make_cpe_match, make_cve, make_cve_page
+
+_test_packages = [
+    ("openssl", "1.1.1k", "openssl"),
+    ("glibc", "2.35", None),
+    ("busybox", "1.35.0", None),
+    ("linux_kernel", "5.15.71", None),
+    ("zlib", "1.2.13", None),
+    ("unknown", "1.0", None),
+]
+
+_expected_cves = {
+    "openssl": ["CVE-2023-0001"],
+    "glibc": ["CVE-2023-0003"],
+    "busybox": ["CVE-2023-0004"],
+    "linux_kernel": ["CVE-2023-0005"],
+    "zlib": [],
+    "unknown": [],
+}
+
+
+def _scan(matcher: CveMatcher):
+    matcher.spdx_document.packages.clear()
+    for name, version, vendor in _test_packages:
+        matcher.add_package(name, version, vendor)
+
+    matcher.process()
+    return {result.name: sorted(cve.cve_number for cve in result.cve_list) for result in matcher.result_list}
+
+
+class CveMatcherTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_path = create_sample_database(pathlib.Path(cls._tmp_dir.name))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp_dir.cleanup()
+
+    def test_serial(self):
+        with CveMatcher(self.db_path, max_workers=1) as matcher:
+            self.assertIsNone(matcher.executor)
+            self.assertEqual(_scan(matcher), _expected_cves)
+            self.assertEqual(matcher.total_cve_count, 4)
+            self.assertEqual(matcher.dirty_package_count, 4)
+            self.assertEqual(matcher.clean_package_count, 2)
+
+    def test_serial_backend_starts_no_pool(self):
+        # Any pool the scan tried to start would fail it.
+        with mock.patch("ics_sbom_libs.cve_match.cvematcher.ProcessPoolExecutor", side_effect=AssertionError):
+            with mock.patch("ics_sbom_libs.cve_match.cvematcher.ThreadPoolExecutor", side_effect=AssertionError):
+                with CveMatcher(self.db_path, backend="serial") as matcher:
+                    self.assertEqual(_scan(matcher), _expected_cves)
+
+    def test_range_index(self):
+        with CveMatcher(self.db_path, use_range_index=True, max_workers=1) as matcher:
+            self.assertEqual(_scan(matcher), _expected_cves)
+
+    def test_backends(self):
+        for backend in MatchBackend:
+            with self.subTest(backend=backend):
+                with CveMatcher(self.db_path, backend=backend, max_workers=2, chunk_size=2) as matcher:
+                    self.assertEqual(matcher.backend, backend)
+                    self.assertEqual(_scan(matcher), _expected_cves)
+
+    def test_pool_reused_across_scans(self):
+        with CveMatcher(self.db_path, max_workers=2, chunk_size=2) as matcher:
+            executor = matcher.executor
+            self.assertIsNotNone(executor)
+            self.assertEqual(_scan(matcher), _expected_cves)
+            self.assertEqual(_scan(matcher), _expected_cves)
+            self.assertIs(matcher.executor, executor)
+
+        self.assertIsNone(matcher._executor)
+
+    def test_thread_pool_sees_updates(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = create_sample_database(pathlib.Path(tmp_dir))
+            with CveMatcher(db_path, backend=MatchBackend.Thread, max_workers=2, chunk_size=2) as matcher:
+                self.assertEqual(_scan(matcher), _expected_cves)
+
+                # The pool threads keep their connections while the database is updated in place, like
+                # create_database does it: in WAL mode, the update is still in the WAL file during the next scan.
+                db = VulnerabilityDatabase(db_path.parent, db_path.name, api_key="none")
+                self.addCleanup(db.con.close)
+                db.con.execute("PRAGMA journal_mode=WAL")
+                cve = make_cve("CVE-2023-0099", [make_cpe_match("zlib", "zlib", versionEndExcluding="1.3")])
+                db._process_cve_data_(make_cve_page([cve]))
+                db.con.commit()
+
+                self.assertEqual(_scan(matcher), _expected_cves | {"zlib": ["CVE-2023-0099"]})
+
+    def test_external_executor_left_running(self):
+        with ProcessPoolExecutor(2) as executor:
+            with CveMatcher(self.db_path, executor=executor) as matcher:
+                self.assertEqual(_scan(matcher), _expected_cves)
+
+            self.assertEqual(executor.submit(sum, [1, 2]).result(), 3)
+
+    def test_process_async(self):
+        async def scan():
+            with CveMatcher(self.db_path, backend=MatchBackend.Serial) as matcher:
+                for name, version, vendor in _test_packages:
+                    matcher.add_package(name, version, vendor)
+
+                await matcher.process_async(max_concurrency=2)
+                return matcher
+
+        matcher = asyncio.run(scan())
+        self.assertEqual(
+            {result.name: sorted(cve.cve_number for cve in result.cve_list) for result in matcher.result_list},
+            _expected_cves,
+        )
+        self.assertEqual(matcher.total_cve_count, 4)
+
+    def test_process_async_matches_process(self):
+        def add_packages(matcher: CveMatcher):
+            matcher.add_package("openssl", "1.1.1k", "openssl")
+            # Another package with the same CPE, its CVEs are only reported for the first one.
+            matcher.add_package("libssl", "1.1.1k", "openssl")
+            matcher.spdx_document.packages[-1].external_references = matcher.spdx_document.packages[
+                0
+            ].external_references
+            matcher.add_package("glibc", "2.35")
+
+        def results(matcher: CveMatcher):
+            return {result.name: sorted(cve.cve_number for cve in result.cve_list) for result in matcher.result_list}
+
+        async def scan_async(matcher: CveMatcher):
+            await matcher.process_async(max_concurrency=2)
+
+        expected = {"openssl": ["CVE-2023-0001"], "libssl": [], "glibc": ["CVE-2023-0003"]}
+        for options in ({}, {"use_range_index": True}, {"use_match_cache": True}, {"use_snapshot": True}):
+            with self.subTest(**options):
+                with CveMatcher(self.db_path, backend=MatchBackend.Thread, max_workers=2, **options) as matcher:
+                    add_packages(matcher)
+                    matcher.process()
+                    self.assertEqual(results(matcher), expected)
+
+                    asyncio.run(scan_async(matcher))
+                    self.assertEqual(results(matcher), expected)
+                    self.assertEqual(matcher.total_cve_count, 2)
+
+    def test_stats(self):
+        totals = []
+        for backend in MatchBackend:
+            with self.subTest(backend=backend):
+                with CveMatcher(
+                    self.db_path, backend=backend, max_workers=2, chunk_size=2, collect_stats=True
+                ) as matcher:
+                    self.assertEqual(_scan(matcher), _expected_cves)
+                    stats = json.loads(matcher.stats.to_json())
+
+                # Every package and CPE is counted once, wherever it was matched.
+                self.assertEqual(stats["counters"]["packages"], len(_test_packages))
+                self.assertEqual(stats["counters"]["hydrated_cves"], 4)
+                for stage in MATCH_STAGES:
+                    self.assertGreater(stats["stages"][stage]["calls"], 0, stage)
+                self.assertEqual(stats["stages"]["cpe_resolution"]["calls"], len(_test_packages))
+                self.assertGreater(stats["scan_wall_sec"], 0)
+                totals.append(stats["counters"])
+
+        self.assertEqual(totals[1:], totals[:-1])
+
+        with CveMatcher(self.db_path, max_workers=1) as matcher:
+            _scan(matcher)
+            self.assertIsNone(matcher.stats)
+
+    def test_process_async_cancel(self):
+        matcher = CveMatcher(self.db_path, max_workers=1)
+        for name, version, vendor in _test_packages:
+            matcher.add_package(name, version, vendor)
+
+        async def scan():
+            received = []
+            results = iter_process_async(matcher.spdx_document, self.db_path, max_concurrency=1)
+            async for result in results:
+                received.append(result)
+                break
+            await results.aclose()
+            return received
+
+        async def cancelled_scan():
+            task = asyncio.ensure_future(matcher.process_async())
+            await asyncio.sleep(0)
+            task.cancel()
+            await task
+
+        self.assertEqual(len(asyncio.run(scan())), 1)
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancelled_scan())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import json
+import pathlib
+import tempfile
+import unittest
+
+from ics_sbom_libs.benchmarks.ingest_benchmark import compare_results, run_benchmark, syncs_per_commit
+from ics_sbom_libs.benchmarks.synthetic_nvd import SyntheticNvd
+
+
+class IngestBenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.work_dir = pathlib.Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_full_and_incremental_ingest(self):
+        nvd = SyntheticNvd(20, 200, seed=3)
+        document = run_benchmark(
+            self.work_dir, nvd, bulk_ingest=[True], changed=0.1, page_size=50, fail_rate=0.05, isolate=False
+        )
+        json.dumps(document)
+
+        full, incremental = document["results"]
+        self.assertEqual((full["phase"], incremental["phase"]), ("full", "incremental"))
+        self.assertEqual(full["records"], {"cves": 200, "cpes": nvd.num_cpes()})
+        # Only the modified records are downloaded again.
+        self.assertEqual(incremental["records"], {"cves": 20, "cpes": round(nvd.num_cpes() * 0.1)})
+        for result in document["results"]:
+            self.assertGreater(result["commits"], 0)
+            self.assertEqual(result["journal_mode"], "wal")
+            self.assertGreater(result["records_per_sec"], 0)
+        self.assertGreater(full["requests"], 200 // 50)
+
+        slower = json.loads(json.dumps(document))
+        slower["results"][1]["commits"] *= 2
+        self.assertEqual(compare_results(document, document), [])
+        regressions = compare_results(document, slower)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("incremental bulk ingest: commits", regressions[0])
+
+    def test_syncs_per_commit(self):
+        self.assertEqual(syncs_per_commit("wal", 1), 0)
+        self.assertEqual(syncs_per_commit("WAL", 2), 1)
+        self.assertEqual(syncs_per_commit("delete", 2), 3)
+        self.assertEqual(syncs_per_commit("delete", 0), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import json
+import pathlib
+import tempfile
+import unittest
+
+from ics_sbom_libs.benchmarks.match_benchmark import MATCH_PHASES, compare_results, run_benchmark
+from ics_sbom_libs.benchmarks.synthetic_nvd import SyntheticNvd
+
+
+class MatchBenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.work_dir = pathlib.Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_synthetic_data_is_reproducible(self):
+        first, second = SyntheticNvd(50, 300, seed=7), SyntheticNvd(50, 300, seed=7)
+        self.assertEqual(list(first.iter_cves()), list(second.iter_cves()))
+        self.assertEqual(list(first.iter_cpes()), list(second.iter_cpes()))
+        self.assertEqual(len(list(first.iter_cpes())), first.num_cpes())
+        self.assertNotEqual(list(first.iter_cves()), list(SyntheticNvd(50, 300, seed=8).iter_cves()))
+
+    def test_modes_agree(self):
+        document = run_benchmark(
+            self.work_dir,
+            [40],
+            ["serial", "thread", "range_index"],
+            workers=2,
+            repeat=2,
+            num_products=60,
+            num_cves=600,
+            isolate=False,
+        )
+        json.dumps(document)
+
+        results = document["results"]
+        self.assertEqual([result["mode"] for result in results], ["serial", "thread", "range_index"])
+        for result in results:
+            self.assertEqual(result["packages"], 40)
+            self.assertEqual(len(result["scan_sec"]), 2)
+            self.assertGreater(result["packages_per_sec"], 0)
+            self.assertEqual(set(result["phase_median_sec"]), set(MATCH_PHASES))
+            self.assertGreater(result["phase_median_sec"]["cpe_resolution"], 0)
+            self.assertGreater(result["phase_median_sec"]["cve_lookup"], 0)
+            self.assertEqual(result["scan_stages"]["cpe_resolution"]["calls"], 40)
+        self.assertGreater(results[0]["cves"], 0)
+        self.assertEqual({result["cves"] for result in results}, {results[0]["cves"]})
+
+        slower = json.loads(json.dumps(document))
+        slower["results"][0]["scan_median_sec"] *= 2
+        self.assertEqual(compare_results(document, document), [])
+        regressions = compare_results(document, slower)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("serial with 40 packages: scan_median_sec", regressions[0])
+
+    def test_profile_memory(self):
+        document = run_benchmark(
+            self.work_dir,
+            [20],
+            ["serial"],
+            workers=1,
+            repeat=1,
+            num_products=30,
+            num_cves=200,
+            isolate=False,
+            profile_memory="tracemalloc",
+        )
+
+        phases = document["results"][0]["memory_phases"]
+        for phase in (
+            "import",
+            "import.parse_dir",
+            "import.spdx_model",
+            "import.filter",
+            "match",
+            "match.cpe_resolution",
+            "match.cve_lookup",
+            "match.cve_hydration",
+            "match.result_aggregation",
+        ):
+            self.assertIn(phase, phases)
+        self.assertEqual(phases["import.spdx_model"]["calls"], 20)
+        self.assertGreater(phases["import"]["retained_bytes"], 0)
+        self.assertGreaterEqual(phases["match"]["peak_bytes"], phases["match.cpe_resolution"]["peak_bytes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+
+from ics_sbom_libs.cve_match.cvematcher import CveMatcher, cpe_factory
+from ics_sbom_libs.cve_match.match_cache import MatchCache, cache_path_for
+
+from sample_nvd_data import create_sample_database
+
+
+def _set_content_version(db_path: pathlib.Path, value: str | None):
+    con = sqlite3.connect(db_path)
+    if value is None:
+        con.execute("DELETE FROM status WHERE key='content_version'")
+    else:
+        con.execute("REPLACE INTO status (key, value) VALUES ('content_version', ?)", (value,))
+    con.commit()
+    con.close()
+
+
+def _scan(matcher: CveMatcher):
+    matcher.spdx_document.packages.clear()
+    matcher.add_package("openssl", "1.1.1k", "openssl")
+    matcher.add_package("busybox", "1.35.0")
+    matcher.process()
+    return {result.name: sorted(cve.cve_number for cve in result.cve_list) for result in matcher.result_list}
+
+
+class MatchCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = create_sample_database(pathlib.Path(self._tmp_dir.name))
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_no_content_version(self):
+        # A database written before content versions were kept.
+        _set_content_version(self.db_path, None)
+        self.assertIsNone(MatchCache.for_database(self.db_path))
+
+        with CveMatcher(self.db_path, max_workers=1, use_match_cache=True) as matcher:
+            self.assertEqual(_scan(matcher), {"openssl": ["CVE-2023-0001"], "busybox": ["CVE-2023-0004"]})
+
+    def test_results_reused(self):
+        _set_content_version(self.db_path, "first")
+        openssl_cpe = cpe_factory("openssl", "1.1.1k", "openssl")
+
+        with CveMatcher(self.db_path, max_workers=1, use_match_cache=True) as matcher:
+            self.assertEqual(_scan(matcher), {"openssl": ["CVE-2023-0001"], "busybox": ["CVE-2023-0004"]})
+            self.assertTrue(cache_path_for(self.db_path).exists())
+            self.assertEqual(matcher.match_cache.get_many([openssl_cpe]), {openssl_cpe: ["CVE-2023-0001"]})
+
+            # A cached result is used as is.
+            matcher.match_cache.put_many({openssl_cpe: ["CVE-2023-0002"]})
+            self.assertEqual(_scan(matcher), {"openssl": ["CVE-2023-0002"], "busybox": ["CVE-2023-0004"]})
+
+            # Updating the database invalidates every cached result.
+            _set_content_version(self.db_path, "second")
+            self.assertEqual(_scan(matcher), {"openssl": ["CVE-2023-0001"], "busybox": ["CVE-2023-0004"]})
+
+        cache = MatchCache.for_database(self.db_path)
+        self.assertEqual(cache.db_version, "1:second")
+        self.assertEqual(cache.con.execute("SELECT COUNT(*) FROM cpe_match").fetchone()[0], 2)
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
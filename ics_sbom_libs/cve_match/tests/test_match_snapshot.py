@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+
+from ics_sbom_libs.cve_fetch.match_snapshot import MatchSnapshot, ensure_match_snapshot, snapshot_path_for
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+from ics_sbom_libs.cve_match.cvematcher import CveMatcher, find_cve_with_cpe
+from ics_sbom_libs.cve_match.cve_range_index import SnapshotRangeIndex
+
+from sample_nvd_data import create_sample_database
+from test_cve_range_index import _test_cpes
+
+
+class MatchSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = create_sample_database(pathlib.Path(self._tmp_dir.name))
+        self.db = VulnerabilityDatabase(self.db_path.parent, self.db_path.name, api_key="none")
+
+    def tearDown(self):
+        self.db.con.close()
+        self.db.con = None
+        self._tmp_dir.cleanup()
+
+    def test_product_ranges(self):
+        snapshot = MatchSnapshot(self.db.export_match_snapshot())
+        self.assertEqual(snapshot.range_count, 8)
+        self.assertEqual(snapshot.content_version, self.db.content_version)
+
+        for product, vendor in [("openssl", "*"), ("glibc", "gnu"), ("glibc", "*"), ("unknown", "*")]:
+            with self.subTest(product=product, vendor=vendor):
+                self.assertEqual(
+                    sorted(snapshot.product_ranges(product, vendor), key=repr),
+                    sorted(self.db.get_product_ranges(product, vendor).fetchall(), key=repr),
+                )
+
+        self.assertEqual(
+            snapshot.cve_severity("CVE-2023-0001"),
+            self.db.query_cache("SELECT severity FROM cve_severity WHERE cve_number='CVE-2023-0001'").fetchone()[0],
+        )
+        self.assertIsNone(snapshot.cve_severity("CVE-2099-0000"))
+        snapshot.close()
+
+    def test_matches_sql_results(self):
+        index = SnapshotRangeIndex(MatchSnapshot(self.db.export_match_snapshot()))
+
+        for cpe in _test_cpes:
+            with self.subTest(cpe=cpe):
+                expected = find_cve_with_cpe(cpe, self.db)
+                result = find_cve_with_cpe(cpe, self.db, index)
+                self.assertEqual(
+                    sorted(cve.cve_number for cve in result.cve_list),
+                    sorted(cve.cve_number for cve in expected.cve_list),
+                )
+
+    def test_matcher_exports_current_snapshot(self):
+        def scan(backend):
+            with CveMatcher(self.db_path, max_workers=2, backend=backend, use_snapshot=True) as matcher:
+                matcher.add_package("openssl", "1.1.1k", "openssl")
+                matcher.add_package("glibc", "2.35")
+                matcher.process()
+                return {
+                    result.name: sorted(cve.cve_number for cve in result.cve_list) for result in matcher.result_list
+                }
+
+        expected = {"openssl": ["CVE-2023-0001"], "glibc": ["CVE-2023-0003"]}
+        self.assertEqual(scan("serial"), expected)
+        self.assertTrue(snapshot_path_for(self.db_path).exists())
+        self.assertEqual(scan("process"), expected)
+
+        # A database update makes the matcher write the snapshot again.
+        con = sqlite3.connect(self.db_path)
+        con.execute("REPLACE INTO status (key, value) VALUES ('content_version', 'second')")
+        con.commit()
+        con.close()
+
+        self.assertEqual(scan("thread"), expected)
+        self.assertEqual(MatchSnapshot(snapshot_path_for(self.db_path)).content_version, "second")
+
+    def test_unversioned_database_is_exported_again(self):
+        # A database written before content versions were kept.
+        con = sqlite3.connect(self.db_path)
+        con.execute("DELETE FROM status WHERE key='content_version'")
+        con.commit()
+        snapshot_path = ensure_match_snapshot(self.db)
+        self.assertIsNone(self.db.content_version)
+
+        # Without a content version, a change to the data must still reach the snapshot.
+        con.execute("DELETE FROM cve_range_entry WHERE product_id = (SELECT id FROM cpe_product WHERE name = 'glibc')")
+        con.commit()
+        con.close()
+
+        self.assertEqual(ensure_match_snapshot(self.db), snapshot_path)
+        snapshot = MatchSnapshot(snapshot_path)
+        self.assertEqual(snapshot.product_ranges("glibc", "gnu"), [])
+        self.assertNotEqual(snapshot.product_ranges("openssl"), [])
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import copy
+import gzip
+import io
+import json
+import pathlib
+import sys
+import tarfile
+import tempfile
+import unittest
+
+from ics_sbom_libs.benchmarks.harness import peak_rss_kb, run_isolated
+from ics_sbom_libs.cve_fetch import vulnerabilitydatabase
+from ics_sbom_libs.cve_fetch.nvd_archive import NvdJsonReader, archive_members
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+from sample_nvd_data import SAMPLE_CPES, SAMPLE_CVES, create_sample_database, make_cpe_page, make_cve_page
+
+if sys.version_info >= (3, 14):
+    from compression import zstd
+else:
+    from backports import zstd
+
+_content_queries = [
+    "SELECT cve_number, vendor, product, version, cpe, vulnerable, versionStartIncluding, versionStartExcluding,"
+    " versionEndIncluding, versionEndExcluding FROM cve_range",
+    "SELECT * FROM cve_severity",
+    "SELECT cve_number, value FROM cve_weakness",
+    "SELECT * FROM cpe_dictionary",
+]
+
+
+def _content(db: VulnerabilityDatabase):
+    return [sorted(db.con.execute(query).fetchall(), key=repr) for query in _content_queries] + [
+        sorted(
+            (cve.cve_number, cve.description) for cve in db.get_cves(f"CVE-2023-000{i}" for i in range(1, 8)).values()
+        )
+    ]
+
+
+def _write_archive(directory: pathlib.Path):
+    """
+    Writes the sample records as CVE pages in every supported compression and one CPE page.
+    """
+    pages = {
+        "cves/page-0.json": (make_cve_page(SAMPLE_CVES[0:3], 0, len(SAMPLE_CVES)), lambda data: data),
+        "cves/page-3.json.gz": (make_cve_page(SAMPLE_CVES[3:5], 3, len(SAMPLE_CVES)), gzip.compress),
+        "cves/page-5.json.zst": (make_cve_page(SAMPLE_CVES[5:], 5, len(SAMPLE_CVES)), zstd.compress),
+        "cpes/page-0.json": (make_cpe_page(SAMPLE_CPES), lambda data: data),
+    }
+    for name, (page, compress) in pages.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(compress(json.dumps(page).encode()))
+
+
+def _write_large_archive(directory: pathlib.Path, num_cves: int):
+    """
+    Writes num_cves copies of the sample CVEs with long descriptions as a single file.
+    """
+    cves = []
+    for i in range(num_cves):
+        cve = copy.deepcopy(SAMPLE_CVES[i % len(SAMPLE_CVES)])
+        cve["cve"]["id"] = f"CVE-2020-{i:06d}"
+        cve["cve"]["descriptions"][0]["value"] = "x" * 5000
+        cves.append(cve)
+
+    directory.mkdir(parents=True)
+    (directory / "cves.json").write_text(json.dumps(make_cve_page(cves)))
+
+
+def _import_peak_rss_kb(archive_path: pathlib.Path, db_path: pathlib.Path) -> int:
+    """
+    Imports the archive with two workers and returns the peak memory of the largest worker.
+    """
+    db = VulnerabilityDatabase(db_path, "nvd_test.db", api_key="none")
+    db.import_archive(archive_path, max_workers=2)
+    db.con.close()
+    return peak_rss_kb(children=True)
+
+
+class NvdArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = pathlib.Path(self._tmp_dir.name)
+        self.archive_dir = self.tmp_path / "archive"
+        _write_archive(self.archive_dir)
+
+        online_path = create_sample_database(self.tmp_path / "online")
+        self.online = VulnerabilityDatabase(online_path.parent, online_path.name, api_key="none")
+
+    def tearDown(self):
+        self.online.con.close()
+        self._tmp_dir.cleanup()
+
+    def test_directory_import_matches_online_database(self):
+        db = VulnerabilityDatabase(self.tmp_path / "offline", "nvd_test.db", api_key="none")
+        self.assertEqual(db.import_archive(self.archive_dir, max_workers=2), {"cve": 3, "cpe": 1})
+
+        self.assertEqual(_content(db), _content(self.online))
+
+    def test_tarball_import(self):
+        tarball = self.tmp_path / "nvd.tar.gz"
+        with tarfile.open(tarball, "w:gz") as tar:
+            tar.add(self.archive_dir, arcname="nvd")
+
+        db = VulnerabilityDatabase(self.tmp_path / "offline", "nvd_test.db", api_key="none")
+        self.assertEqual(db.import_archive(tarball, max_workers=1), {"cve": 3, "cpe": 1})
+
+        self.assertEqual(_content(db), _content(self.online))
+        for src_name in ("cve", "cpe"):
+            self.assertTrue(db._get_status_value(f"initial_{src_name}_download_completed"))
+            self.assertEqual(db._get_status_value(f"{src_name}_last_updated"), "2023-06-02T00:00:00.000")
+
+    def test_plain_tarball_import_in_workers(self):
+        (self.archive_dir / "other.json").write_text('{"other": []}')
+        tarball = self.tmp_path / "nvd.tar"
+        with tarfile.open(tarball, "w") as tar:
+            tar.add(self.archive_dir, arcname="nvd")
+
+        # The workers open the members of a plain tarball themselves, a compressed one is read in this process.
+        members = archive_members(tarball)
+        self.assertEqual(
+            [name for name, _, _ in members], [f"nvd/{name}" for name, _, _ in archive_members(self.archive_dir)]
+        )
+        self.assertTrue(all(member is not None for _, _, member in members))
+        with tarfile.open(self.tmp_path / "nvd.tar.gz", "w:gz") as tar:
+            tar.add(self.archive_dir, arcname="nvd")
+        self.assertIsNone(archive_members(self.tmp_path / "nvd.tar.gz"))
+
+        db = VulnerabilityDatabase(self.tmp_path / "offline", "nvd_test.db", api_key="none")
+        self.assertEqual(db.import_archive(tarball, max_workers=2), {"cve": 3, "cpe": 1})
+
+        self.assertEqual(_content(db), _content(self.online))
+
+    @unittest.skipIf(peak_rss_kb() is None, "needs the resource module")
+    def test_worker_memory_does_not_grow_with_file_size(self):
+        # Each run gets a fresh process, the files are written by others so that their memory is not counted.
+        peaks = {}
+        for num_cves in (3000, 12000):
+            archive_path = self.tmp_path / f"large-{num_cves}"
+            run_isolated(_write_large_archive, archive_path, num_cves)
+            peaks[num_cves] = run_isolated(_import_peak_rss_kb, archive_path, self.tmp_path / f"db-{num_cves}")
+
+        # The larger file has about 54 MB more records, a worker keeping them all would grow by more than that.
+        self.assertLess(peaks[12000] - peaks[3000], 25 * 1024)
+
+    def test_reimport_changes_content_version_only(self):
+        db = VulnerabilityDatabase(self.tmp_path / "offline", "nvd_test.db", api_key="none")
+        db.import_archive(self.archive_dir, max_workers=1)
+        version = db.content_version
+        self.assertIsNotNone(version)
+
+        # Changed data with the same timestamp is new content.
+        page = make_cve_page(copy.deepcopy(SAMPLE_CVES[0:1]), 0, 1)
+        page["vulnerabilities"][0]["cve"]["descriptions"][0]["value"] = "Changed"
+        (self.tmp_path / "same.json").write_text(json.dumps(page))
+        db.import_archive(self.tmp_path / "same.json", max_workers=1)
+
+        self.assertNotEqual(db.content_version, version)
+        self.assertEqual(db.get_cve("CVE-2023-0001").description, "Changed")
+
+        # An older archive does not move the watermark of the online updates back.
+        page["timestamp"] = "2023-01-01T00:00:00.000"
+        (self.tmp_path / "older.json").write_text(json.dumps(page))
+        db.import_archive(self.tmp_path / "older.json", max_workers=1)
+        self.assertEqual(db._get_status_value("cve_last_updated"), "2023-06-02T00:00:00.000")
+
+    def test_import_in_small_batches(self):
+        batch_size = vulnerabilitydatabase.INGEST_BATCH_SIZE
+        vulnerabilitydatabase.INGEST_BATCH_SIZE = {"cve": 1, "cpe": 2}
+        try:
+            db = VulnerabilityDatabase(self.tmp_path / "offline", "nvd_test.db", api_key="none")
+            self.assertEqual(db.import_archive(self.archive_dir, max_workers=1), {"cve": 3, "cpe": 1})
+        finally:
+            vulnerabilitydatabase.INGEST_BATCH_SIZE = batch_size
+
+        self.assertEqual(_content(db), _content(self.online))
+
+
+class NvdJsonReaderTestCase(unittest.TestCase):
+    def test_records_match_json_loads(self):
+        page = make_cve_page(SAMPLE_CVES, 0, len(SAMPLE_CVES))
+        page["format"] = "NVD_CVE"
+        for text in (json.dumps(page), json.dumps(page, indent=2)):
+            for chunk_size in (1, 7, 1 << 20):
+                reader = NvdJsonReader(io.StringIO(text), chunk_size=chunk_size)
+                self.assertEqual(list(reader), page["vulnerabilities"])
+                self.assertEqual(reader.src_name, "cve")
+                self.assertEqual(reader.fields, {k: v for k, v in page.items() if k != "vulnerabilities"})
+
+    def test_empty_and_unknown_documents(self):
+        reader = NvdJsonReader(io.StringIO('{"products": [], "totalResults": 0}'))
+        self.assertEqual(list(reader), [])
+        self.assertEqual((reader.src_name, reader.fields), ("cpe", {"totalResults": 0}))
+
+        reader = NvdJsonReader(io.StringIO('{"other": [1, 2]}'))
+        self.assertEqual(list(reader), [])
+        self.assertIsNone(reader.src_name)
+
+        with self.assertRaises(ValueError):
+            list(NvdJsonReader(io.StringIO('{"products": [{"cpe": 1}')))
+
+
+if __name__ == "__main__":
+    unittest.main()
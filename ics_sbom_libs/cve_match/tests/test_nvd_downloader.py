@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import json
+import pathlib
+import tempfile
+import unittest
+
+from unittest import mock
+
+from ics_sbom_libs.benchmarks.nvd_stand_in import NvdStandIn
+from ics_sbom_libs.common.ratelimiter import RateLimiter
+from ics_sbom_libs.cve_fetch import vulnerabilitydatabase
+from ics_sbom_libs.cve_fetch.nvd_downloader import NvdDownloader
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase
+
+from sample_nvd_data import SAMPLE_CPES, SAMPLE_CVES
+
+
+class NvdDownloaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = pathlib.Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _download(self, stand_in: NvdStandIn, max_in_flight: int = 3, db: VulnerabilityDatabase | None = None):
+        db = db or VulnerabilityDatabase(self.cache_dir, "nvd_test.db", api_key="none")
+        downloader = NvdDownloader(
+            base_url=stand_in.base_url, max_in_flight=max_in_flight, requests_per_window=1000, retry_delay=0
+        )
+        db.create_database(downloader=downloader)
+
+        return VulnerabilityDatabase(self.cache_dir, "nvd_test.db", api_key="none")
+
+    def _assert_complete(self, db: VulnerabilityDatabase):
+        self.assertEqual(db.con.execute("SELECT COUNT(*) FROM cve_severity").fetchone()[0], len(SAMPLE_CVES))
+        self.assertEqual(db.con.execute("SELECT COUNT(*) FROM cpe_dictionary").fetchone()[0], len(SAMPLE_CPES))
+        self.assertEqual(db.con.execute("SELECT COUNT(*) FROM cve_range").fetchone()[0], 8)
+        for src_name in ("cve", "cpe"):
+            self.assertTrue(db._get_status_value(f"initial_{src_name}_download_completed"))
+            self.assertIsNone(db._get_status_value(f"last_{src_name}_record_received"))
+
+    def test_concurrent_download(self):
+        with NvdStandIn(SAMPLE_CVES, SAMPLE_CPES, delay=0.05) as stand_in:
+            db = self._download(stand_in)
+
+        self._assert_complete(db)
+        self.assertGreater(stand_in.max_in_flight, 1)
+        self.assertLessEqual(stand_in.max_in_flight, 4)
+
+    def test_resume_from_checkpoint(self):
+        db = VulnerabilityDatabase(self.cache_dir, "nvd_test.db", api_key="none")
+        db._set_status_value("last_cve_record_received", 4)
+        del db
+
+        with NvdStandIn(SAMPLE_CVES, SAMPLE_CPES) as stand_in:
+            db = self._download(stand_in)
+
+        cve_starts = sorted(int(params["startIndex"]) for feed, params in stand_in.requests if feed == "cves")
+        self.assertEqual(cve_starts, [4, 6])
+        self.assertEqual(db.con.execute("SELECT COUNT(*) FROM cve_severity").fetchone()[0], 3)
+
+    def test_retries_busy_server(self):
+        with NvdStandIn(SAMPLE_CVES, SAMPLE_CPES, fail_first=3) as stand_in:
+            db = self._download(stand_in, max_in_flight=1)
+
+        self._assert_complete(db)
+
+    def test_write_failure_stops_only_its_feed(self):
+        db = VulnerabilityDatabase(self.cache_dir, "nvd_test.db", api_key="none")
+
+        def fail(cpeArray):
+            raise RuntimeError("disk full")
+
+        db._write_cpe_records = fail
+        with NvdStandIn(SAMPLE_CVES, SAMPLE_CPES) as stand_in, self.assertLogs(level="ERROR"):
+            db = self._download(stand_in, db=db)
+
+        self.assertEqual(db.con.execute("SELECT COUNT(*) FROM cve_severity").fetchone()[0], len(SAMPLE_CVES))
+        self.assertEqual(db.con.execute("SELECT COUNT(*) FROM cpe_dictionary").fetchone()[0], 0)
+        self.assertTrue(db._get_status_value("initial_cve_download_completed"))
+        self.assertFalse(db._get_status_value("initial_cpe_download_completed", False))
+
+    def test_query_cve_retries_and_shares_limiter(self):
+        limiter = RateLimiter(rate=1000, max_tokens=10, retry_delay=0)
+        db = VulnerabilityDatabase(self.cache_dir, "nvd_test.db", api_key="none")
+        with (
+            NvdStandIn(SAMPLE_CVES, SAMPLE_CPES, fail_first=2) as stand_in,
+            mock.patch.object(vulnerabilitydatabase, "CVE_URL", stand_in.base_url.format("cves")),
+            mock.patch.object(vulnerabilitydatabase, "nvd_rate_limiter", return_value=limiter),
+        ):
+            data = json.loads(db.query_cve_from_nvd("CVE-2023-0001"))
+
+        self.assertEqual(data["vulnerabilities"][0]["cve"]["id"], SAMPLE_CVES[0]["cve"]["id"])
+        self.assertEqual(len(stand_in.requests), 3)
+        self.assertIs(db._nvd_client()[1], limiter)
+        # Throttled twice, then recovering.
+        self.assertLess(limiter.rate, 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import json
+import pathlib
+import tempfile
+import unittest
+
+from ics_sbom_libs.cve_fetch.connection_registry import get_database
+from ics_sbom_libs.cve_fetch.query_trace import QueryTrace, current_trace, normalize_query, tracing
+from ics_sbom_libs.cve_match.cvematcher import CveMatcher, MatchBackend
+
+from sample_nvd_data import create_sample_database
+
+
+class QueryTraceTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_path = create_sample_database(pathlib.Path(cls._tmp_dir.name))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp_dir.cleanup()
+
+    def test_normalize_query(self):
+        self.assertEqual(
+            normalize_query("SELECT a FROM t\n WHERE cve_number='CVE-2023-0001' AND n = 12 AND b IN (?, ?,?);"),
+            "SELECT a FROM t WHERE cve_number=? AND n = ? AND b IN (?...)",
+        )
+        self.assertEqual(
+            normalize_query("SELECT id FROM cpe_v2 WHERE x IN (?)"), "SELECT id FROM cpe_v2 WHERE x IN (?...)"
+        )
+
+    def test_trace_database_queries(self):
+        db = get_database(self.db_path)
+        with tracing(QueryTrace()) as trace:
+            self.assertIs(current_trace(), trace)
+            db.get_cves(["CVE-2023-0001"])
+            db.get_cves(["CVE-2023-0003", "CVE-2023-0004", "CVE-2023-9999"])
+            ranges = db.get_product_ranges("openssl").fetchall()
+        self.assertIsNone(current_trace())
+
+        # The CVE lookups of different sizes share their shapes.
+        shapes = {stats.shape: stats for stats in trace.shapes.values()}
+        weakness = shapes["SELECT cve_number, value FROM cve_weakness WHERE cve_number IN (?...)"]
+        self.assertEqual(weakness.count, 2)
+        range_shape = next(stats for shape, stats in shapes.items() if "FROM cve_range" in shape)
+        self.assertEqual(range_shape.rows, len(ranges))
+        self.assertEqual(range_shape.count, 1)
+        self.assertLessEqual(weakness.percentile(50), weakness.max_sec)
+
+        plans = trace.explain(db, top=2)
+        self.assertEqual(len(plans), 2)
+        self.assertTrue(all(plans.values()))
+
+        exported = json.loads(trace.to_json())
+        self.assertEqual(exported["query_count"], trace.query_count)
+        self.assertEqual(QueryTrace.from_dict(exported).to_dict()["shapes"], exported["shapes"])
+
+    def test_matcher_workers(self):
+        with CveMatcher(self.db_path, backend=MatchBackend.Process, max_workers=2, trace_queries=True) as matcher:
+            for package, version in [("openssl", "1.1.1k"), ("glibc", "2.35"), ("zlib", "1.2.13")]:
+                matcher.add_package(package, version)
+            matcher.process()
+            plans = matcher.explain_slowest_queries(top=1)
+
+        queries = matcher.stats.queries
+        lookups = queries.shapes["SELECT cpe FROM cpe_dictionary WHERE product=? AND deprecated=?"]
+        # Recorded by the workers, one lookup per package.
+        self.assertEqual(lookups.count, 3)
+        self.assertEqual(len(plans), 1)
+        self.assertEqual(json.loads(matcher.stats.to_json())["queries"]["query_count"], queries.query_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: LGPL-2.0-or-later
+# SPDX-FileCopyrightText: 2024 Ics inc.
+# SPDX-FileContributor: Michael Dingwall <mdingwall@ics.com>
+
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+
+from ics_sbom_libs.cve_fetch.vulnerabilitydatabase import VulnerabilityDatabase, _nvd_schema_version
+
+from sample_nvd_data import create_sample_database
+
+
+def _make_v4_0_database(db_path: pathlib.Path):
+    # Databases created before the migrations existed recorded "3.0", kept the ranges in the cve_range table, the
+    # descriptions in cve_severity and only had product_index.
+    db = VulnerabilityDatabase(db_path.parent, db_path.name, api_key="none")
+    cve_ids = [row[0] for row in db.con.execute("SELECT cve_number FROM cve_severity").fetchall()]
+    descriptions = [(cve.description, cve.cve_number) for cve in db.get_cves(cve_ids).values()]
+    db.con.close()
+
+    con = sqlite3.connect(db_path)
+    con.executescript("""
+        CREATE TABLE cve_range_v4_0 AS SELECT * FROM cve_range;
+        DROP VIEW cve_range;
+        DROP TABLE cve_range_entry;
+        DROP TABLE cpe_vendor;
+        DROP TABLE cpe_product;
+        ALTER TABLE cve_range_v4_0 RENAME TO cve_range;
+        CREATE INDEX product_index ON cve_range (cve_number, vendor, product);
+        DROP INDEX cpe_dictionary_product_index;
+        ALTER TABLE cve_severity ADD COLUMN description text;
+        ALTER TABLE cve_severity ADD COLUMN configurations text;
+        DROP TABLE cve_detail;
+        DROP TABLE cve_detail_dict;
+        REPLACE INTO status (key, value) VALUES ('version', '3.0');
+    """)
+    con.executemany("UPDATE cve_severity SET description=? WHERE cve_number=?", descriptions)
+    con.commit()
+    con.close()
+
+
+def _range_rows(db: VulnerabilityDatabase):
+    return db.con.execute("SELECT * FROM cve_range ORDER BY id").fetchall()
+
+
+def _query_plan(db: VulnerabilityDatabase, query: str, parameters=()):
+    return " ".join(row[-1] for row in db.con.execute(f"EXPLAIN QUERY PLAN {query}", parameters).fetchall())
+
+
+class SchemaMigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = create_sample_database(pathlib.Path(self._tmp_dir.name))
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _open(self):
+        db = VulnerabilityDatabase(self.db_path.parent, self.db_path.name, api_key="none")
+        self.addCleanup(db.con.close)
+        return db
+
+    def test_new_database_is_current(self):
+        self.assertEqual(_nvd_schema_version, self._open().schema_version)
+
+    def test_upgrade_in_place(self):
+        db = self._open()
+        rows = _range_rows(db)
+        description = db.get_cve("CVE-2023-0001").description
+        db.con.close()
+        _make_v4_0_database(self.db_path)
+
+        db = self._open()
+        self.assertEqual(_nvd_schema_version, db.schema_version)
+        self.assertTrue(db.has_interned_ranges)
+        self.assertTrue(db.has_cve_details)
+        self.assertEqual(rows, _range_rows(db))
+        self.assertEqual(description, db.get_cve("CVE-2023-0001").description)
+
+        product_id = db.get_name_id("cpe_product", "openssl")
+        vendor_id = db.get_name_id("cpe_vendor", "openssl")
+        plan = _query_plan(
+            db, "SELECT cve_number FROM cve_range_entry WHERE product_id=? AND vendor_id=?", (product_id, vendor_id)
+        )
+        self.assertIn("cve_range_entry_product_vendor_index", plan)
+
+        plan = _query_plan(db, "SELECT cpe FROM cpe_dictionary WHERE product=? AND deprecated=?", ("openssl", 0))
+        self.assertIn("cpe_dictionary_product_index", plan)
+
+        self.assertTrue(db.query_cpe_dictionary("openssl"))
+
+    def test_read_only_v4_0_database(self):
+        db = self._open()
+        ranges = db.get_product_ranges("openssl", "openssl").fetchall()
+        db.con.close()
+        _make_v4_0_database(self.db_path)
+
+        # Read only connections do not upgrade the database and keep using the cve_range table.
+        db = VulnerabilityDatabase(self.db_path.parent, self.db_path.name, api_key="none", read_only=True)
+        self.addCleanup(db.con.close)
+        self.assertFalse(db.has_interned_ranges)
+        self.assertEqual(sorted(ranges), sorted(db.get_product_ranges("openssl", "openssl").fetchall()))
+
+
+if __name__ == "__main__":
+    unittest.main()
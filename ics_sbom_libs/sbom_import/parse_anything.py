@@ -29,6 +29,7 @@ from spdx_tools.spdx.model import CreationInfo as SPDXCreationInfo
 from spdx_tools.spdx.model import Actor as SPDXActor
 from spdx_tools.spdx.model import ActorType as SPDXActorType
 
+from ics_sbom_libs.common.memory_profile import memory_phase
 from ics_sbom_libs.sbom_import.spdx_tag_value.parse import parse_from_tag_value_file
 from ics_sbom_libs.sbom_import.spdx_json.parse import parse_from_json_file, parse_from_json
 
@@ -282,13 +283,16 @@ class FilteredParser:
         doc: SPDXDocument | None = None
 
         if sbom_name.is_file() and tarfile.is_tarfile(sbom_name):
-            doc = self._parse_tar(sbom_name)
+            with memory_phase("import.parse_tar"):
+                doc = self._parse_tar(sbom_name)
 
         elif sbom_name.is_file():
-            doc = self._parse_file(sbom_name)
+            with memory_phase("import.parse_file"):
+                doc = self._parse_file(sbom_name)
 
         elif sbom_name.is_dir():
-            doc = self._parse_dir(sbom_name)
+            with memory_phase("import.parse_dir"):
+                doc = self._parse_dir(sbom_name)
 
         if not doc:
             return None
@@ -359,24 +363,25 @@ class FilteredParser:
 
             return return_packages
 
-        exclusions = self._filter.compile_exclusions()
-        substitutions = list(self._filter.substitutions.keys())
+        with memory_phase("import.filter"):
+            exclusions = self._filter.compile_exclusions()
+            substitutions = list(self._filter.substitutions.keys())
 
-        packages = sorted(doc.packages, key=lambda pkg: pkg.name)
-        doc.packages.clear()
-        for package in packages:
-            added_packages = []
-            if exclusions.search(package.name):
-                continue
+            packages = sorted(doc.packages, key=lambda pkg: pkg.name)
+            doc.packages.clear()
+            for package in packages:
+                added_packages = []
+                if exclusions.search(package.name):
+                    continue
 
-            if package.name in substitutions:
-                added_packages = handle_substitutions(package, self._filter.substitutions[package.name])
-            else:
-                added_packages = [package]
+                if package.name in substitutions:
+                    added_packages = handle_substitutions(package, self._filter.substitutions[package.name])
+                else:
+                    added_packages = [package]
 
-            doc.packages += added_packages
+                doc.packages += added_packages
 
-        doc.packages = sorted(doc.packages, key=lambda pkg: pkg.name)
+            doc.packages = sorted(doc.packages, key=lambda pkg: pkg.name)
         return doc
 
     def _parse_file(self, sbom_file_name: pathlib.Path):
@@ -515,7 +520,8 @@ def parse_anything(sbom_name: pathlib.Path, encoding: str = "utf-8"):
     parser = FilteredParser()
     parser.encoding = encoding
 
-    return parser.parse(sbom_name)
+    with memory_phase("import"):
+        return parser.parse(sbom_name)
 
 
 def print_package_table(doc: SPDXDocument):
@@ -8,11 +8,14 @@ from beartype.typing import Dict
 from spdx_tools.spdx.model import Document as SPDXDocument
 from spdx_tools.spdx.parser.jsonlikedict.json_like_dict_parser import JsonLikeDictParser
 
+from ics_sbom_libs.common.memory_profile import memory_phase
+
 _replacement_symbols = {"&": "AND", "|": "OR"}
 
 
 def parse_from_json(file):
-    input_doc_as_dict: Dict = json.load(file)
+    with memory_phase("import.json_load"):
+        input_doc_as_dict: Dict = json.load(file)
 
     if "packages" in input_doc_as_dict.keys():
         for package in input_doc_as_dict["packages"]:
@@ -23,7 +26,8 @@ def parse_from_json(file):
 
                 package["licenseDeclared"] = new_string
 
-    return JsonLikeDictParser().parse(input_doc_as_dict)
+    with memory_phase("import.spdx_model"):
+        return JsonLikeDictParser().parse(input_doc_as_dict)
 
 
 def parse_from_json_file(file_name: str, encoding: str = "utf-8") -> SPDXDocument:
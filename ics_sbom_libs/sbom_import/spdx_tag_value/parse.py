@@ -7,6 +7,7 @@ import re
 from spdx_tools.spdx.model import Document as SPDXDocument
 from spdx_tools.spdx.parser.tagvalue.parser import Parser as TagValueParser
 
+from ics_sbom_libs.common.memory_profile import memory_phase
 from ics_sbom_libs.sbom_import.spdx_tag_value.filter_lexers import SimplifiedFilterLexer
 from ics_sbom_libs.sbom_import.spdx_tag_value.progress_lexer import ProgressLexer
 
@@ -17,5 +18,6 @@ def parse_from_tag_value_file(file_name: str, encoding: str = "utf-8") -> SPDXDo
     parser.lex.build(reflags=re.UNICODE)
     with open(file_name, encoding=encoding) as file:
         data = file.read()
-    document: SPDXDocument = parser.parse(data)
+    with memory_phase("import.spdx_model"):
+        document: SPDXDocument = parser.parse(data)
     return document